@@ -1,15 +1,19 @@
+import concurrent.futures
 import ctypes
 from tkinter.constants import W
-import cv2 as cv
-import numpy as np
 import os
-from PIL import Image, ImageTk
 import sys
+import time
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
 import tkinter.filedialog
 
+import tasks
+import tracing
+
+startTime = time.perf_counter()
+
 
 versionImported = False
 try:
@@ -19,6 +23,41 @@ except ImportError:
     pass
 
 
+# OpenCV, numpy and PIL, and the modules built on them, take a while to
+# import, especially from the PyInstaller build. They are imported in a
+# background thread while the window comes up, and only used once the import
+# is done; see MobyCAIRO.modulesImported().
+cv = None
+analysis = None
+analysiscache = None
+confidence = None
+export = None
+imagesource = None
+items = None
+loader = None
+recipe = None
+render = None
+session = None
+viewport = None
+
+
+def importModules(progress):
+    global cv, analysis, analysiscache, confidence, export, imagesource, items, loader, recipe, render, session, viewport
+    with tracing.span('importModules'):
+        import cv2 as cv
+        import analysis
+        import analysiscache
+        import confidence
+        import export
+        import imagesource
+        import items
+        import loader
+        import recipe
+        import render
+        import session
+        import viewport
+
+
 class MobyCAIRO:
 
     # enumerating tabs
@@ -39,15 +78,88 @@ class MobyCAIRO:
 
     logoFilename = "MobyCAIRO.png"
 
+    # width of the bins, in degrees, used to group line segments by angle
+    angleBinSize = 1.0
+
+    # milliseconds to wait for window resize events to stop before redrawing
+    resizeSettleTime = 200
+
+    # upper limit for the redraw rate while dragging or holding down keys
+    maxFrameRate = 30
+
+    # images larger than this are analyzed and previewed from a reduced-
+    # resolution decode; the full resolution is only decoded when saving
+    workingImageSize = 2048
+
+    # pixel sizes that the crop candidate detectors reduce the image to
+    circleAnalysisSize = 400
+    rectAnalysisSize = 600
+
+    # the number of top circle candidates whose rims are located again at
+    # full resolution, see analysis.refineCircle()
+    refinedCircleCount = 3
+
+    # rectangle candidates skewed further than this in degrees are not
+    # straightened; near 45 degrees, it is unclear which of the sides is
+    # meant to be horizontal
+    maxStraightenSkew = 44.0
+
+    # limits for the cache of rotated preview frames
+    previewCacheEntries = 16
+    previewCacheBytes = 128 * 1024 * 1024
+
+    # review sessions: the number of scans decoded and analyzed ahead of the
+    # current one, by how many threads, and the memory they may hold on to
+    prefetchDepth = 3
+    prefetchWorkers = 2
+    prefetchBytes = 768 * 1024 * 1024
+
+    # size of the thumbnails in the session strip, and milliseconds between
+    # checks for newly prefetched scans
+    thumbnailSize = 64
+    sessionPollInterval = 250
+
 
     #############################################
     # Event handlers
 
     def windowIsReady(self, event):
-        self.windowWidth = self.imageLabel.winfo_width()
-        self.windowHeight = self.imageLabel.winfo_height()
+        self.windowWidth = self.pictureFrame.winfo_width()
+        self.windowHeight = self.pictureFrame.winfo_height()
+        self.windowAspect = self.windowWidth / self.windowHeight
+        if self.viewport is not None:
+            self.viewport.setWindow(self.windowWidth, self.windowHeight)
+        self.startupMilestone('window shown')
+
+
+    def windowResized(self, event):
+        # a window resize delivers a stream of Configure events; wait for
+        # the stream to settle before rebuilding the display proxies
+        if self.resizeAfterId is not None:
+            self.parent.after_cancel(self.resizeAfterId)
+        self.resizeAfterId = self.parent.after(self.resizeSettleTime, self.windowResizeSettled)
+
+
+    def windowResizeSettled(self):
+        self.resizeAfterId = None
+        windowWidth = self.pictureFrame.winfo_width()
+        windowHeight = self.pictureFrame.winfo_height()
+        if (windowWidth, windowHeight) == (self.windowWidth, self.windowHeight) or windowWidth <= 1 or windowHeight <= 1:
+            return
+        self.windowWidth = windowWidth
+        self.windowHeight = windowHeight
         self.windowAspect = self.windowWidth / self.windowHeight
-        
+        if self.viewport is not None:
+            self.viewport.setWindow(self.windowWidth, self.windowHeight)
+        if self.workingImage is None:
+            return
+
+        self.buildDisplayProxies()
+        if self.tabControl.index("current") in [self.TAB_ROTATE, self.TAB_CROP]:
+            self.drawImage()
+        elif self.tabControl.index("current") == self.TAB_SAVE:
+            self.drawFinalImage()
+
 
     def tabChanged(self, event):
         if self.tabControl.index("current") == self.TAB_ROTATE:
@@ -62,105 +174,758 @@ class MobyCAIRO:
             if self.currentRotationAngle != currentAngleText:
                 currentAngle = float(currentAngleText[:-1])
                 self.currentRotationAngle = currentAngleText
+                self.circles = []
+                self.rects = []
+                self.currentCropIndex = 0
+                self.currentRectIndex = None
+                self.circleCropList.delete(0, tk.END)
+                self.rectCropList.delete(0, tk.END)
+                self.updateSaveTab()
+
+                # the candidates are remembered per angle, so returning to an
+                # angle that was already analyzed does not repeat the work
+                key = (round(currentAngle, 4), self.circleAnalysisSize, self.rectAnalysisSize)
+                if key in self.cropCandidates:
+                    self.cropCandidatesFound(key, self.cropCandidates[key])
+                else:
+                    # compute the most likely crop candidates in the background,
+                    # unless they are in the analysis cache from an earlier session
+                    analysisImage = self.analysisImage
+                    analysisScale = self.analysisScale
+                    contentHash = self.contentHash
+                    cacheParameters = key + (self.workingImageSize,)
+
+                    def work(progress):
+                        cached = self.analysisCache.get(contentHash, 'cropCandidates', cacheParameters)
+                        if cached is not None:
+                            return analysiscache.unpackCropCandidates(cached)
+                        progress(0.0, 'searching for crop candidates...')
+                        (circles, rects) = analysis.findCropCandidates(analysisImage, currentAngle, analysisScale,
+                            self.circleAnalysisSize, self.rectAnalysisSize)
+                        self.analysisCache.put(contentHash, 'cropCandidates', cacheParameters, analysiscache.packCropCandidates(circles, rects))
+                        return (circles, rects)
+                    self.startTask('cropTask', work, lambda result: self.cropCandidatesFound(key, result))
 
-                # compute a rotated image per the current rotation angle
-                (rows, cols, _) = self.imagePrime.shape
-                M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), currentAngle, 1)
-                rotatedImage = cv.warpAffine(self.imagePrime, M, (cols, rows))
+            self.drawImage()
+        elif self.tabControl.index("current") == self.TAB_SAVE:
+            self.drawFinalImage()
 
-                # compute most likely crop candidates
-                self.findCircles(rotatedImage)
-                #self.findRects(rotatedImage)
 
-                # populate the candidate circle crop list box
-                for i in range(len(self.circles)):
-                    (centerX, centerY, radius) = self.circles[i]
-                    self.circleCropList.insert(i, str('(%d, %d), %d' % (centerX, centerY, radius)))
+    def cropCandidatesFound(self, key, candidates):
+        self.cropCandidates[key] = candidates
+        self.circlesKey = key
 
-                # populate the candidate rectangle crop box
-                """
-                for i in range(len(self.rects)):
-                    (minX, minY, maxX, maxY, _) = self.rects[i]
-                    self.rectCropList.insert(i, str('(%d, %d) -> (%d, %d)' % (minX, minY, maxX, maxY)))
-                """
+        # the lists are copied since the user may adjust the candidates
+        (circles, rects) = candidates
+        self.circles = list(circles)
+        self.rects = list(rects)
 
+        # populate the candidate circle crop list box
+        self.circleCropList.delete(0, tk.END)
+        for i in range(len(self.circles)):
+            self.circleCropList.insert(i, self.circleLabel(self.circles[i]))
+
+        # populate the candidate rectangle crop box; each rectangle comes
+        # with its own skew, which may straighten the image further
+        self.rectCropList.delete(0, tk.END)
+        for i in range(len(self.rects)):
+            (minX, minY, maxX, maxY, _, skew) = self.rects[i][:6]
+            self.rectCropList.insert(i, str('(%d, %d) -> (%d, %d), %+0.2f°' % (minX, minY, maxX, maxY, skew)))
+
+        # the top circles were found on a reduced image; their rims are
+        # located again at full resolution in the background
+        if key in self.refinedCircles:
+            self.circlesRefined(key, circles, (None, self.refinedCircles[key]))
+        elif len(circles):
+            self.refineCircles(key, circles)
+
+        self.updateSaveTab()
+        if self.tabControl.index("current") == self.TAB_CROP:
             self.drawImage()
+
+
+    # Refine the top circle candidates to sub-pixel accuracy on the
+    # full-resolution image; only the pixels around the rims are read. This
+    # happens right away only if the full-resolution image is at hand or can
+    # be memory mapped; any other file is only decoded when saving, and the
+    # chosen circle is refined then, see buttonClickSaveImage().
+    # Parameters:
+    #   key: the key of the candidates in self.cropCandidates
+    #   circles: the candidate circles, in full-resolution coordinates
+    def refineCircles(self, key, circles):
+        angle = key[0]
+        circles = circles[:self.refinedCircleCount]
+        imageFilename = self.imageFilename
+        imagePrime = self.imagePrime
+        contentHash = self.contentHash
+        cacheParameters = key + (self.workingImageSize, len(circles))
+        band = self.circleRefinementBand()
+
+        def work(progress):
+            cached = self.analysisCache.get(contentHash, 'refinedCircles', cacheParameters)
+            if cached is not None:
+                return (None, analysiscache.unpackRefinedCircles(cached))
+            image = imagePrime
+            if image is None:
+                image = imagesource.openImage(imageFilename)
+                if image is None:
+                    return (None, None)
+            refined = []
+            for (i, circle) in enumerate(circles):
+                progress(i / len(circles), 'refining circle %d of %d...' % (i + 1, len(circles)))
+                refined.append(analysis.refineCircle(image, angle, circle, band))
+            self.analysisCache.put(contentHash, 'refinedCircles', cacheParameters, analysiscache.packRefinedCircles(refined))
+            return (image, refined)
+        self.startTask('refineTask', work, lambda result: self.circlesRefined(key, circles, result))
+
+
+    # The half-width of the band around a circle candidate that its rim is
+    # searched in, see analysis.circleRefinementBand()
+    def circleRefinementBand(self):
+        return analysis.circleRefinementBand((self.analysisImage.shape[1], self.analysisImage.shape[0]),
+            self.analysisScale, self.circleAnalysisSize)
+
+
+    # Replace the circle candidates by their refined versions, except for the
+    # ones the user has adjusted in the meantime
+    def circlesRefined(self, key, circles, result):
+        (image, refined) = result
+        if image is not None and self.imagePrime is None:
+            self.imagePrime = image
+        if refined is None:
+            return
+        self.refinedCircles[key] = refined
+        if key != self.circlesKey:
+            return
+        for (i, circle) in enumerate(refined):
+            if circle is None or i >= len(self.circles) or self.circles[i] != circles[i]:
+                continue
+            self.circles[i] = circle
+            self.circleCropList.delete(i)
+            self.circleCropList.insert(i, self.circleLabel(circle))
+        self.redrawCrop()
+
+
+    # Redraw whichever view shows the current crop: the crop tab, or the
+    # final preview of the save tab, which is what gets saved
+    def redrawCrop(self):
+        if self.tabControl.index("current") == self.TAB_CROP:
+            self.renderScheduler.request()
         elif self.tabControl.index("current") == self.TAB_SAVE:
             self.drawFinalImage()
 
 
+    # Describe a circle candidate for the list box; refined circles are
+    # shown to a fraction of a pixel
+    def circleLabel(self, circle):
+        if all([float(v).is_integer() for v in circle]):
+            return '(%d, %d), %d' % tuple(circle)
+        return '(%0.2f, %0.2f), %0.2f' % tuple(circle)
+
+
     def buttonClickLoadImage(self):
-        self.imageFilename = tkinter.filedialog.askopenfilename(
-            title='Open image to process',
+        imageFilenames = tkinter.filedialog.askopenfilenames(
+            title='Open images to process',
             filetypes=self.filetypes,
             parent=self.parent
         )
-        if not self.imageFilename:
+        if not imageFilenames:
             return
-        self.imagePrime = cv.imread(self.imageFilename)
-        if self.imagePrime is None:
-            messagebox.showerror('Could not open file', 'Failed to open file "%s"\nIs it an image file?' % (self.imageFilename))
+
+        # several files make a review session
+        if len(imageFilenames) > 1:
+            self.startSession(imageFilenames)
             return
-        self.imagePrime = cv.cvtColor(self.imagePrime, cv.COLOR_BGR2RGB)
-        self.imagePrimeWidth = self.imagePrime.shape[1]
-        self.imagePrimeHeight = self.imagePrime.shape[0]
-        self.imagePrimeAspect = 1.0 * self.imagePrimeWidth / self.imagePrimeHeight
+        self.closeSession()
+        self.loadImage(imageFilenames[0], self.multiResolutionCheckboxValue.get())
 
-        # perform straight line analysis to find possible rotation candidate angles
-        self.straightLineAnalysis()
 
-        # reset the list boxes
-        self.angleList.delete(0, tk.END)
-        self.circleCropList.delete(0, tk.END)
+    def buttonClickLoadFolder(self):
+        folder = tkinter.filedialog.askdirectory(title='Open folder of images to process', parent=self.parent)
+        if not folder:
+            return
+        imageFilenames = session.imagesInFolder(folder)
+        if not imageFilenames:
+            messagebox.showerror('No images found', 'There are no image files in "%s"' % (folder))
+            return
+        self.startSession(imageFilenames)
 
-        # populate the candidate angle list box
-        for i in range(len(self.lengths)):
-            self.angleList.insert(i, str('%0.2f' % self.lineListByLength[self.lengths[i]]['angle']) + '°')
 
-        # select the first angle in the list box
-        self.angleList.select_set(0)
+    # Review the scans left by batch.py in a review list, see
+    # confidence.writeReviewList()
+    def buttonClickLoadReviewList(self):
+        listFilename = tkinter.filedialog.askopenfilename(
+            title='Open review list',
+            filetypes=(('Review lists', '*.txt'), ('All files', '*.*')),
+            parent=self.parent
+        )
+        if not listFilename:
+            return
+        try:
+            entries = confidence.readReviewList(listFilename)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror('Could not open review list', str(e))
+            return
+        imageFilenames = [filename for (filename, _, _) in entries if os.path.isfile(filename)]
+        if not imageFilenames:
+            messagebox.showerror('No images found', 'None of the scans listed in "%s" were found' % (listFilename))
+            return
+        self.startSession(imageFilenames)
+
+
+    # Start a review session over several scans; the scans after the current
+    # one are prefetched, see session.py
+    def startSession(self, imageFilenames):
+        self.closeSession()
+        multiResolution = self.multiResolutionCheckboxValue.get()
+        self.session = session.Session(imageFilenames,
+            lambda filename: self.loadScan(filename, multiResolution, refine=True),
+            self.prefetchWorkers, self.prefetchDepth, self.prefetchBytes)
+        self.sessionMultiResolution = multiResolution
+        self.sessionFrame.pack(side=tk.TOP, expand=tk.NO, fill=tk.X, padx=3, pady=3, after=self.tabControl)
+        self.goToScan(0)
+        self.pollSession()
+
+
+    def closeSession(self):
+        if self.session is None:
+            return
+        self.session.close()
+        self.session = None
+        if self.sessionPollId is not None:
+            self.parent.after_cancel(self.sessionPollId)
+            self.sessionPollId = None
+        self.sessionFrame.pack_forget()
+
+
+    def goToScan(self, index):
+        if self.session is None or not 0 <= index < len(self.session.filenames):
+            return
+        future = self.session.moveTo(index)
+        self.loadImage(self.session.current(), self.sessionMultiResolution, future)
+        self.drawSessionStrip()
+
+
+    def buttonClickPreviousScan(self):
+        if self.session is not None:
+            self.goToScan(self.session.index - 1)
+
+
+    def buttonClickNextScan(self):
+        if self.session is not None:
+            self.goToScan(self.session.index + 1)
+
+
+    def sessionStripClick(self, event):
+        index = int(self.sessionStrip.canvasx(event.x) // (self.thumbnailSize + 8))
+        if self.session is not None and index != self.session.index:
+            self.goToScan(index)
+
+
+    # Make thumbnails of the scans that finished prefetching
+    def pollSession(self):
+        self.sessionPollId = None
+        if self.session is None:
+            return
+        changed = False
+        for filename in self.session.prefetcher.ready():
+            if filename not in self.session.thumbnails:
+                result = self.session.prefetcher.peek(filename)
+                if result is not None:
+                    self.session.thumbnails[filename] = render.thumbnailPhoto(result[0], self.thumbnailSize)
+                    changed = True
+        if changed:
+            self.drawSessionStrip()
+        self.sessionPollId = self.parent.after(self.sessionPollInterval, self.pollSession)
+
+
+    # Draw the strip of thumbnails, one per scan of the session: the current
+    # scan is outlined, saved scans are checked and scans that have not been
+    # decoded yet show their number
+    def drawSessionStrip(self):
+        canvas = self.sessionStrip
+        canvas.delete('all')
+        size = self.thumbnailSize
+        spacing = size + 8
+        for (i, filename) in enumerate(self.session.filenames):
+            x = i * spacing + 4
+            if i == self.session.index:
+                canvas.create_rectangle(x - 3, 1, x + size + 2, size + 6, outline='#3070e0', width=3)
+            photo = self.session.thumbnails.get(filename)
+            if photo is not None:
+                canvas.create_image(x + size // 2, size // 2 + 4, image=photo)
+            else:
+                canvas.create_rectangle(x, 4, x + size, size + 4, fill='#d0d0d0', outline='')
+                canvas.create_text(x + size // 2, size // 2 + 4, text=str(i + 1))
+            if filename in self.session.done:
+                canvas.create_text(x + size - 6, size - 4, text='\u2714', fill='#20a020')
+        stripWidth = len(self.session.filenames) * spacing
+        canvas.configure(scrollregion=(0, 0, stripWidth, size + 8))
+
+        # keep the current scan in the middle of the strip
+        center = self.session.index * spacing + spacing / 2
+        canvas.xview_moveto(max(0.0, center - canvas.winfo_width() / 2) / stripWidth)
+        self.sessionLabel.configure(text='Scan %d of %d: %s' % (self.session.index + 1, len(self.session.filenames),
+            os.path.basename(self.session.current())))
+        self.buttonPreviousScan.configure(state='normal' if self.session.index > 0 else 'disabled')
+        self.buttonNextScan.configure(state='normal' if self.session.hasNext() else 'disabled')
+
+
+    # Load an image and find its candidate angles in the background.
+    # Parameters:
+    #   imageFilename: the image file
+    #   multiResolution: use the multi-resolution line analysis
+    #   future: the prefetch of the image in a review session, if any; see
+    #   session.Prefetcher.take()
+    def loadImage(self, imageFilename, multiResolution, future=None):
+        # loading another file supersedes any work still in flight
+        self.cancelTask('analysisTask')
+        self.cancelTask('cropTask')
+        self.cancelTask('exportTask')
+        self.cancelTask('viewTask')
+        self.cancelTask('refineTask')
+        tracing.defaultTracer.resetStages()
+
+        # a finished prefetch is shown right away
+        if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+            self.imageLoaded(imageFilename, multiResolution, future.result())
+            return
+
+        def work(progress):
+            if future is not None and not future.cancelled():
+                while True:
+                    progress(0.0, 'waiting for the prefetched image...')
+                    try:
+                        return future.result(timeout=0.1)
+                    except concurrent.futures.TimeoutError:
+                        pass
+            return self.loadScan(imageFilename, multiResolution, progress)
+
+        self.startTask('analysisTask', work, lambda result: self.imageLoaded(imageFilename, multiResolution, result))
+
+
+    # Decode the working image of a scan and find its candidate angles, or
+    # take them from the analysis cache; this runs in a background thread.
+    # Parameters:
+    #   imageFilename: the image file
+    #   multiResolution: use the multi-resolution line analysis
+    #   progress: function(fraction, message), or None
+    #   refine: in multi-resolution mode, refine the candidate angles right
+    #   away instead of leaving that to imageLoaded(); used for prefetching
+    # Returns the tuple handed to imageLoaded(), or None if the file could not
+    #   be read
+    def loadScan(self, imageFilename, multiResolution, progress=None, refine=False):
+        if progress is None:
+            progress = lambda fraction, message: None
+        # only a reduced-resolution version is decoded for now
+        progress(0.0, 'reading image...')
+        (workingImage, workingScale) = loader.readReduced(imageFilename, self.workingImageSize)
+        if workingImage is None:
+            return None
+        progress(0.4, 'converting image...')
+        with tracing.span('cvtColor', size=workingImage.shape[:2]):
+            workingImage = cv.cvtColor(workingImage, cv.COLOR_BGR2RGB)
+
+        # the analysis of a file that was opened before comes from the
+        # analysis cache; in multi-resolution mode, prefer the refined
+        # candidates over the coarse ones
+        progress(0.45, 'checking the analysis cache...')
+        with tracing.span('fileHash'):
+            contentHash = analysiscache.fileHash(imageFilename)
+        cacheParameters = (self.angleBinSize, self.workingImageSize)
+        kinds = ['refinedLines', 'coarseLines'] if multiResolution else ['lines']
+        for kind in kinds:
+            cached = self.analysisCache.get(contentHash, kind, cacheParameters)
+            if cached is not None:
+                return (workingImage, workingScale) + analysiscache.unpackLines(cached) + (contentHash, kind == 'refinedLines')
+
+        # perform straight line analysis to find possible rotation
+        # candidate angles; the line segments are kept in the coordinates
+        # of the full-resolution image
+        progress(0.5, 'finding straight lines...')
+        (edges, lineListByLength, lengths) = self.straightLineAnalysis(workingImage, multiResolution)
+        analysis.scaleLineSegments(lineListByLength, workingScale)
+        self.analysisCache.put(contentHash, kinds[-1], cacheParameters, analysiscache.packLines(edges, lineListByLength, lengths))
+        if multiResolution and refine:
+            self.refineAngles(workingImage, workingScale, edges, contentHash, lineListByLength, lengths, progress)
+            return (workingImage, workingScale, edges, lineListByLength, lengths, contentHash, True)
+        return (workingImage, workingScale, edges, lineListByLength, lengths, contentHash, False)
+
+
+    # Refine the coarse candidate angles of the multi-resolution analysis up
+    # to the resolution of the working image, in place, and save them in the
+    # analysis cache; this runs in a background thread
+    def refineAngles(self, workingImage, workingScale, edges, contentHash, lineListByLength, lengths, progress):
+        analysis.scaleLineSegments(lineListByLength, 1.0 / workingScale)
+        analysis.refineCandidateAngles(workingImage, lineListByLength, lengths, progress=progress)
+        analysis.scaleLineSegments(lineListByLength, workingScale)
+        self.analysisCache.put(contentHash, 'refinedLines', (self.angleBinSize, self.workingImageSize),
+            analysiscache.packLines(edges, lineListByLength, lengths))
+
+
+    def imageLoaded(self, imageFilename, multiResolution, result):
+        if result is None:
+            messagebox.showerror('Could not open file', 'Failed to open file "%s"\nIs it an image file?' % (imageFilename))
+            return
+        (self.workingImage, self.workingScale, self.edgesImage, self.lineListByLength, self.lengths, self.contentHash, refined) = result
+        self.imageFilename = imageFilename
+        self.imagePrime = None
+        self.imagePrimeWidth = self.workingImage.shape[1] * self.workingScale
+        self.imagePrimeHeight = self.workingImage.shape[0] * self.workingScale
+        self.imagePrimeAspect = 1.0 * self.imagePrimeWidth / self.imagePrimeHeight
+        self.buildDisplayProxies()
+
+        # the zoomed view samples the working image and the edge map; the
+        # full-resolution image is added once the view is zoomed in past the
+        # resolution of the working image
+        self.viewport.setImage(self.imagePrimeWidth, self.imagePrimeHeight)
+        self.viewport.setWindow(self.windowWidth, self.windowHeight)
+        self.viewport.addLayer('image', self.workingImage, self.workingScale)
+        self.viewport.addLayer('edges', self.edgesImage, self.imagePrimeWidth / self.edgesImage.shape[1], cv.COLOR_GRAY2RGB)
+        self.viewportHasFullResolution = False
+
+        # a small copy of the image for crop candidate detection
+        analysisSize = max(self.circleAnalysisSize, self.rectAnalysisSize)
+        self.analysisScale = max(1.0, min(self.imagePrimeWidth, self.imagePrimeHeight) / analysisSize)
+        analysisWidth = max(1, int(self.imagePrimeWidth / self.analysisScale))
+        analysisHeight = max(1, int(self.imagePrimeHeight / self.analysisScale))
+        self.analysisImage = cv.resize(self.workingImage, (analysisWidth, analysisHeight), interpolation=cv.INTER_AREA)
+
+        # reset the list boxes and the crop candidates
+        self.circleCropList.delete(0, tk.END)
+        self.rectCropList.delete(0, tk.END)
+        self.circles = []
+        self.rects = []
+        self.cropCandidates = {}
+        self.refinedCircles = {}
+        self.circlesKey = None
+        self.currentCropIndex = 0
+        self.currentRectIndex = None
+        self.cropMode = self.CROP_CIRCLE_ASSIST
+        self.currentRotationAngle = "999.00°"
+        self.populateAngleList()
 
         self.tabControl.tab(self.TAB_ROTATE, state="normal")
         self.tabControl.tab(self.TAB_CROP, state="normal")
-        self.tabControl.tab(self.TAB_SAVE, state="normal")
+        self.updateSaveTab()
 
         # automatically skip to the next tab
         self.tabControl.select(1)
 
+        if self.session is not None and imageFilename == self.session.current():
+            self.session.thumbnails[imageFilename] = render.thumbnailPhoto(self.workingImage, self.thumbnailSize)
+            self.drawSessionStrip()
+
+        # in multi-resolution mode, the candidates shown so far came from a
+        # reduced-resolution image; refine the top candidates' angles now, up
+        # to the resolution of the working image
+        if multiResolution and not refined:
+            workingImage = self.workingImage
+            workingScale = self.workingScale
+            edges = self.edgesImage
+            contentHash = self.contentHash
+            lineListByLength = {length: dict(item) for (length, item) in self.lineListByLength.items()}
+            lengths = list(self.lengths)
+
+            def work(progress):
+                self.refineAngles(workingImage, workingScale, edges, contentHash, lineListByLength, lengths, progress)
+                return (lineListByLength, lengths)
+            self.startTask('analysisTask', work, self.anglesRefined)
+
+
+    def anglesRefined(self, result):
+        (self.lineListByLength, self.lengths) = result
+        self.populateAngleList(min(self.currentAngleIndex, len(self.lengths) - 1))
+        if self.tabControl.index("current") == self.TAB_ROTATE:
+            self.drawImage()
+
+
+    def populateAngleList(self, selectIndex=0):
+        # the candidates' line segments may have changed
+        self.compositor.invalidate()
+        self.angleList.delete(0, tk.END)
+        for i in range(len(self.lengths)):
+            self.angleList.insert(i, str('%0.2f' % self.lineListByLength[self.lengths[i]]['angle']) + '°')
+
+        # select the first angle in the list box
+        self.currentAngleIndex = max(0, selectIndex)
+        self.angleList.select_set(self.currentAngleIndex)
+
 
     def buttonClickSaveImage(self):
+        if not self.hasCrop():
+            messagebox.showerror('Nothing to save', 'Select a crop region on the Crop tab first')
+            return
+
+        # during a review session, suggest the scan's own name in the folder
+        # the previous scan was saved to
+        options = {}
+        if self.session is not None:
+            options['initialfile'] = os.path.basename(self.imageFilename)
+            if self.lastSaveDirectory:
+                options['initialdir'] = self.lastSaveDirectory
         self.saveFilename = tkinter.filedialog.asksaveasfilename(
             title='Specify filename to save...',
             filetypes=self.filetypes,
-            parent=self.parent
+            parent=self.parent,
+            **options
         )
-        if self.saveFilename:
-            bgrCroppedImage = cv.cvtColor(self.finalCroppedImage, cv.COLOR_RGB2BGR)
+        if not self.saveFilename:
+            return
+        self.lastSaveDirectory = os.path.dirname(self.saveFilename)
+
+        # the final crop is made from the full-resolution image, which is
+        # opened now unless it already was; memory mapped files are not
+        # decoded at all, only the cropped region is read from them
+        saveFilename = self.saveFilename
+        imageFilename = self.imageFilename
+        imagePrime = self.imagePrime
+        cropFunction = self.currentCropFunction()
+
+        # the edit is also saved as a recipe next to the image, so that the
+        # image can be regenerated later without repeating the session
+        (angle, crop, transparent) = self.currentCrop()
+        contentHash = self.contentHash
+
+        # a circle candidate that could not be refined before, since the file
+        # has to be decoded, is refined now that it is
+        unrefinedIndex = self.unrefinedCircleIndex()
+        band = self.circleRefinementBand() if unrefinedIndex is not None else None
+
+        def work(progress):
+            nonlocal cropFunction, crop
+            image = imagePrime
+            if image is None:
+                progress(0.0, 'reading full-resolution image...')
+                with tracing.span('openFull'):
+                    image = loader.openFull(imageFilename)
+                if image is None:
+                    raise IOError('Failed to read "%s"' % (imageFilename))
+
+            refined = None
+            if band is not None:
+                progress(0.6, 'refining circle...')
+                refined = analysis.refineCircle(image, angle, (crop['centerX'], crop['centerY'], crop['radius']), band)
+                if refined is not None:
+                    crop = recipe.circleCrop(*refined)
+                    cropFunction = lambda image, scale: export.exportCircle(image, angle, refined[0] / scale, refined[1] / scale, refined[2] / scale, transparent)
+            editRecipe = recipe.makeRecipe(imageFilename, contentHash, angle, crop, saveFilename, transparent)
+
+            # the full-resolution image is BGR, as is the cropped image
+            progress(0.7, 'cropping image...')
+            croppedImage = cropFunction(image, 1)
+            progress(0.8, 'saving image...')
             try:
-                cv.imwrite(self.saveFilename, bgrCroppedImage)
+                with tracing.span('imwrite', size=croppedImage.shape[:2]):
+                    saved = cv.imwrite(saveFilename, croppedImage)
             except cv.error as e:
-                messagebox.showerror('Failed to save image', 'Could not save image\nDid you specify a valid image extension?\n')
-                print(str(e))
+                return (image, str(e), None)
+            if not saved:
+                return (image, 'Could not write ' + saveFilename, None)
+            recipe.writeRecipe(saveFilename, editRecipe)
+            return (image, None, refined)
+        self.startTask('exportTask', work, lambda result: self.imageSaved(self.circlesKey, unrefinedIndex, result))
+
+
+    # The index of the selected circle candidate if it is one of the top
+    # candidates, has not been refined at full resolution and has not been
+    # adjusted by the user; otherwise None
+    def unrefinedCircleIndex(self):
+        if self.cropMode != self.CROP_CIRCLE_ASSIST or not self.circles or self.circlesKey in self.refinedCircles:
+            return None
+        index = self.currentCropIndex
+        if index >= self.refinedCircleCount or self.circles[index] != self.cropCandidates[self.circlesKey][0][index]:
+            return None
+        return index
+
+
+    # Parameters:
+    #   key, index: the candidates and the circle that was refined while
+    #   saving, if any; see unrefinedCircleIndex()
+    #   result: (full-resolution image, the reason the image could not be
+    #   saved or None, the refined circle or None)
+    def imageSaved(self, key, index, result):
+        (self.imagePrime, error, refined) = result
+
+        # the candidate list and the final preview show the circle that was
+        # saved
+        if refined is not None and key == self.circlesKey and index < len(self.circles) and self.circles[index] == self.cropCandidates[key][0][index]:
+            self.circles[index] = refined
+            self.circleCropList.delete(index)
+            self.circleCropList.insert(index, self.circleLabel(refined))
+            self.redrawCrop()
+        if error is not None:
+            messagebox.showerror('Failed to save image', 'Could not save image\nDid you specify a valid image extension?\n', detail=error)
+        else:
+            self.scanSaved()
+
+
+    # Check off the current scan of a review session once it is saved
+    def scanSaved(self):
+        if self.session is not None and self.imageFilename == self.session.current():
+            self.session.done.add(self.imageFilename)
+            self.drawSessionStrip()
+
+
+    # Save every item on the scanner bed, e.g. a disc along with its booklet
+    # and inlay, each straightened by its own skew angle; see items.py. The
+    # items are numbered after the chosen filename.
+    def buttonClickSaveAllItems(self):
+        saveFilename = tkinter.filedialog.asksaveasfilename(
+            title='Specify base filename for the items...',
+            filetypes=self.filetypes,
+            parent=self.parent
+        )
+        if not saveFilename:
+            return
+
+        # the items are found on the working image, which is already decoded,
+        # and cropped from the full-resolution image
+        imageFilename = self.imageFilename
+        imagePrime = self.imagePrime
+        workingImage = self.workingImage
+        workingScale = self.workingScale
+        fullSize = (self.imagePrimeWidth, self.imagePrimeHeight)
+        contentHash = self.contentHash
+        transparent = bool(self.transparentBackgroundCheckboxValue.get())
+
+        def work(progress):
+            progress(0.0, 'finding items...')
+            with tracing.span('findItems'):
+                foundItems = items.findItems(cv.cvtColor(workingImage, cv.COLOR_RGB2BGR), workingScale, fullSize)
+            image = imagePrime
+            if image is None:
+                progress(0.2, 'reading full-resolution image...')
+                with tracing.span('openFull'):
+                    image = loader.openFull(imageFilename)
+                if image is None:
+                    raise IOError('Failed to read "%s"' % (imageFilename))
+            if not foundItems:
+                return (image, foundItems, [])
+
+            def exportProgress(fraction, message):
+                progress(0.3 + 0.7 * fraction, message)
+            results = items.exportItems(image, foundItems, saveFilename, imageFilename, contentHash,
+                transparent=transparent, progress=exportProgress)
+            return (image, foundItems, results)
+        self.startTask('exportTask', work, self.itemsSaved)
+
+
+    def itemsSaved(self, result):
+        (self.imagePrime, foundItems, results) = result
+        if not foundItems:
+            messagebox.showerror('No items found', 'Could not find any items on the scan')
+            return
+        failures = ['%s: %s' % (os.path.basename(filename), error) for (filename, error) in results if error]
+        if failures:
+            messagebox.showerror('Failed to save items', 'Could not save %d of %d items\n%s' % (len(failures), len(results), '\n'.join(failures)))
+            return
+        self.scanSaved()
+        lines = ['%s: %s' % (os.path.basename(filename), items.describeItem(item)) for ((filename, _), item) in zip(results, foundItems)]
+        messagebox.showinfo('Saved items', 'Saved %d items\n%s' % (len(results), '\n'.join(lines)))
 
 
-    def imageLabelMouseDown(self, event):
+    def imageCanvasMouseDown(self, event):
         if self.tabControl.index("current") == self.TAB_CROP:
+            # the corners are kept in image coordinates, so that the box stays
+            # put while the view is zoomed or panned
             self.cropMode = self.CROP_RECTANGLE_FREEFORM
             self.freeformCropActive = True
-            self.freeformBoxCorner1Screen = (event.x, event.y)
-            self.freeformBoxCorner2Screen = (event.x, event.y)
-            self.drawImage()
+            self.freeformBoxCorner1Image = self.displayToImage(event.x, event.y)
+            self.freeformBoxCorner2Image = self.freeformBoxCorner1Image
+            self.renderScheduler.request()
+        elif self.tabControl.index("current") == self.TAB_ROTATE:
+            self.imageCanvasPanStart(event)
 
 
-    def imageLabelMouseMove(self, event):
+    def imageCanvasMouseMove(self, event):
         if self.tabControl.index("current") == self.TAB_CROP and self.freeformCropActive:
-            self.freeformBoxCorner2Screen = (event.x, event.y)
-            self.drawImage()
+            self.freeformBoxCorner2Image = self.displayToImage(event.x, event.y)
+            self.renderScheduler.request()
+        elif self.tabControl.index("current") == self.TAB_ROTATE:
+            self.imageCanvasPan(event)
 
 
-    def imageLabelMouseUp(self, event):
+    def imageCanvasMouseUp(self, event):
         if self.tabControl.index("current") == self.TAB_CROP:
             self.freeformCropActive = False
+            self.updateSaveTab()
+        self.imageCanvasPanEnd(event)
+
+
+    # Dragging with the right or middle mouse button pans the zoomed view in
+    # either tab; in the rotate tab, so does the left button
+    def imageCanvasPanStart(self, event):
+        self.panPosition = (event.x, event.y)
+
+
+    def imageCanvasPanEnd(self, event):
+        self.panPosition = None
+
+
+    def imageCanvasPan(self, event):
+        if self.panPosition is None or not self.viewport.isZoomed():
+            return
+        self.viewport.pan(event.x - self.panPosition[0], event.y - self.panPosition[1])
+        self.panPosition = (event.x, event.y)
+        self.renderScheduler.request()
+
+
+    def imageCanvasMouseWheel(self, event):
+        if self.workingImage is None or self.tabControl.index("current") not in [self.TAB_ROTATE, self.TAB_CROP]:
+            return
+        # X11 reports the wheel as buttons 4 and 5
+        if event.num == 4 or event.delta > 0:
+            self.zoomView(1.25, event.x, event.y)
+        elif event.num == 5 or event.delta < 0:
+            self.zoomView(0.8, event.x, event.y)
+
+
+    # Zoom the view in or out by a factor, keeping the display point
+    # (anchorX, anchorY) in place; the center of the view by default
+    def zoomView(self, factor, anchorX=None, anchorY=None):
+        if self.workingImage is None:
+            return
+        if not self.viewport.isZoomed() and (anchorX is not None and anchorY is not None):
+            # the fit view is centered in the window; move the anchor into
+            # the window's coordinates
+            anchorX += (self.windowWidth - self.displayImage.shape[1]) / 2
+            anchorY += (self.windowHeight - self.displayImage.shape[0]) / 2
+        self.viewport.zoomBy(factor, anchorX, anchorY)
+
+        # past the resolution of the working image, the view samples the
+        # full-resolution image, which is opened in the background
+        if self.viewport.isZoomed() and self.workingScale > 1 and self.viewport.zoom > 1.0 / self.workingScale and \
+           not self.viewportHasFullResolution and self.viewTask is None:
+            imageFilename = self.imageFilename
+            imagePrime = self.imagePrime
+
+            def work(progress):
+                if imagePrime is not None:
+                    return imagePrime
+                progress(0.0, 'reading full-resolution image...')
+                with tracing.span('openFull'):
+                    image = loader.openFull(imageFilename)
+                if image is None:
+                    raise IOError('Failed to read "%s"' % (imageFilename))
+                return image
+            self.startTask('viewTask', work, self.fullResolutionOpened)
+        self.renderScheduler.request()
+
+
+    def buttonClickZoomFit(self):
+        self.viewport.reset()
+        self.renderScheduler.request()
+
+
+    def fullResolutionOpened(self, image):
+        # the full-resolution image is BGR; it is also used when saving
+        self.imagePrime = image
+        self.viewport.addLayer('image', image, 1, cv.COLOR_BGR2RGB)
+        self.viewportHasFullResolution = True
+        self.compositor.invalidate()
+        if self.tabControl.index("current") in [self.TAB_ROTATE, self.TAB_CROP]:
+            self.drawImage()
 
 
     def listEvent(self, event):
@@ -170,12 +935,30 @@ class MobyCAIRO:
             if len(self.circleCropList.curselection()):
                 self.cropMode = self.CROP_CIRCLE_ASSIST
                 self.currentCropIndex = self.circleCropList.curselection()[0]
-            """
             elif len(self.rectCropList.curselection()):
-                # re-use the same variable for rects, but negative
-                self.currentCropIndex = -(self.rectCropList.curselection()[0]+1)
-            """
-        self.drawImage()
+                # the box is kept apart from the candidate, since it stays
+                # selected when the image is straightened to the rectangle
+                self.cropMode = self.CROP_RECTANGLE_ASSIST
+                self.currentRectIndex = self.rectCropList.curselection()[0]
+                self.selectedRect = self.rects[self.currentRectIndex][:4]
+            self.updateSaveTab()
+        self.renderScheduler.request()
+
+
+    # Rotate the image further by the skew of the selected rectangle
+    # candidate, so that its sides become parallel to the image's, and search
+    # for the crop candidates again at the new angle
+    def buttonClickStraightenRect(self):
+        if self.cropMode != self.CROP_RECTANGLE_ASSIST or self.currentRectIndex is None:
+            return
+        rect = self.rects[self.currentRectIndex]
+
+        # a rectangle at 45 degrees could be straightened either way
+        if abs(rect[5]) > self.maxStraightenSkew:
+            return
+        (skew, self.selectedRect) = analysis.straightenRect(rect, (self.imagePrimeWidth, self.imagePrimeHeight))
+        self.rotateImage(skew)
+        self.tabChanged(None)
 
 
     def rotateImage(self, angleAdjustment):
@@ -186,10 +969,12 @@ class MobyCAIRO:
         self.lineListByLength[self.lengths[self.currentAngleIndex]]['angle'] = angle
         self.angleList.delete(self.currentAngleIndex)
         self.angleList.insert(self.currentAngleIndex, str('%0.2f' % angle) + '°')
-        self.drawImage()
+        self.renderScheduler.request()
 
 
     def keyboardCallback(self, event):
+        if not self.circles or self.cropMode != self.CROP_CIRCLE_ASSIST:
+            return
         (centerX, centerY, radius) = self.circles[self.currentCropIndex]
 
         # adjust radius
@@ -212,229 +997,275 @@ class MobyCAIRO:
 
         self.circles[self.currentCropIndex] = (centerX, centerY, radius)
         self.circleCropList.delete(self.currentCropIndex)
-        self.circleCropList.insert(self.currentCropIndex, str('(%d, %d), %d' % (centerX, centerY, radius)))
-        self.drawImage()
-
+        self.circleCropList.insert(self.currentCropIndex, self.circleLabel((centerX, centerY, radius)))
+        self.renderScheduler.request()
 
-    #############################################
-    # Image functions
 
-    def straightLineAnalysis(self):
-        # create an image for Hough line analysis; convert color -> grayscale
-        self.lineAnalyzerImage = cv.cvtColor(self.imagePrime, cv.COLOR_BGR2GRAY)
-        # blur the image
-        self.lineAnalyzerImage = cv.GaussianBlur(self.lineAnalyzerImage, (7, 7), 0)
-
-        # adapting the pipeline described in this Stack Overflow answer:
-        #  https://stackoverflow.com/a/45560545/475067
-        lowThreshold = 50
-        highThreshold = 150
-        edges = cv.Canny(self.lineAnalyzerImage, lowThreshold, highThreshold)
-        edgesImage = cv.cvtColor(edges, cv.COLOR_GRAY2BGR)
-        self.edgesImage = cv.resize(edgesImage, (self.windowWidth, self.windowHeight))
-        rho = 1
-        theta = np.pi / 180
-        threshold = 15
-        minLineLength = 50
-        maxLineGap = 20
-        lines = cv.HoughLinesP(edges, rho, theta, threshold, np.array([]), minLineLength=minLineLength, maxLineGap=maxLineGap)
-
-        # organize the line segments into bins according to their angles
-        self.lineList = {}
-        self.lineListByLength = {}
-        for line in lines[:]:
-            for (x1, y1, x2, y2) in line:
-                dx = x2 - x1
-                dy = y2 - y1
-                # special case for vertical line
-                if dx == 0:
-                    theta = 90
-                else:
-                    theta = round(np.arctan(dy/dx) * 180/np.pi)
-                if theta not in self.lineList:
-                    self.lineList[theta] = { 'lines': set(), 'total': 0.0 }
-                self.lineList[theta]['lines'].add((x1, y1, x2, y2))
-                # accumulate line length
-                self.lineList[theta]['total'] += np.sqrt(np.square(dx) + np.square(dy))
-
-        # organize the line list according to the most distance represented per angle
-        for angle in self.lineList.keys():
-            lineItem = self.lineList[angle]
-            self.lineListByLength[lineItem['total']] = { 'lines': lineItem['lines'], 'angle': angle * 1.0 }
-        lengths = self.lineListByLength.keys()
-        self.lengths = sorted(lengths)
-        self.lengths.reverse()
-
-
-    # Find the circles in an image.
+    # Start a background task, cancelling the task already running in the same
+    # slot. The progress bar follows the most recently started task.
     # Parameters:
-    #   image: the image to be analyzed
-    #   houghAnalysisSize: the pixel size to resize the image down to before
-    #   analysis
-    # Upon exit, this populates self.circles with a list of (X Y R) tuples
-    #   defining circles, sorted in descending order by radius
-    def findCircles(self, image, houghAnalysisSize=400):
-        # set up an image for analysis
-        (primeRows, primeCols, _) = image.shape
-        circleScaleFactor = min(primeRows, primeCols) / houghAnalysisSize
-        analyzerWidth = int(primeCols / circleScaleFactor)
-        analyzerHeight = int(primeRows / circleScaleFactor)
-        analyzerImage = cv.resize(image, (analyzerWidth, analyzerHeight))
-        (_, analyzerImage) = cv.threshold(analyzerImage, 60, 255, cv.THRESH_BINARY)
-        analyzerImageGray = cv.cvtColor(analyzerImage, cv.COLOR_BGR2GRAY)
-
-        # find the circles
-        circlesPrime = cv.HoughCircles(analyzerImageGray, cv.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=0, maxRadius=int(houghAnalysisSize/2))
-
-        # qualify the discovered circles: no circles that go outside the box
-        circles = []
-        if circlesPrime is None:
-            self.circles = []
-            return
-        for circle in circlesPrime[0]:
-            (centerX, centerY, radius) = circle
-            if centerX - radius > 0 and \
-               centerY - radius > 0 and \
-               centerX + radius < houghAnalysisSize and \
-               centerY + radius < houghAnalysisSize:
+    #   slot: name of the attribute holding the task, e.g. 'analysisTask'
+    #   work: function(progress) to run in the background thread
+    #   onDone: function(result) to run on the main thread with the result
+    def startTask(self, slot, work, onDone):
+        self.cancelTask(slot)
+        task = tasks.BackgroundTask(self.parent, work, onDone,
+            onProgress=self.taskProgress, onError=self.taskError, onFinished=self.taskFinished)
+        setattr(self, slot, task)
+        self.progressTask = task
+        self.progressBar['value'] = 0
+        self.progressLabel.configure(text='working...')
+        self.progressFrame.pack(side=tk.BOTTOM, expand=tk.NO, fill=tk.X, before=self.statusBar)
 
-               # scale the parameters before appending
-               circle = (int(centerX * circleScaleFactor), int(centerY * circleScaleFactor), int(radius * circleScaleFactor))
-               circles.append(circle)
 
-        # sort descending by radius
-        self.circles = sorted(circles, key=lambda x: x[2])
-        self.circles.reverse()
+    def cancelTask(self, slot):
+        task = getattr(self, slot)
+        if task is not None:
+            task.cancel()
+            setattr(self, slot, None)
 
 
-    # Find the rectangles in an image.
-    # Parameters:
-    #   image: the image to be analyzed
-    #   houghAnalysisSize: the pixel size to resize the image down to before
-    #   analysis
-    # Upon exit, this populates self.rectanges with a list of (X Y R) tuples
-    #   defining circles, sorted in descending order by radius
-    def findRects(self, image, houghAnalysisSize=600):
-        # set up an image for analysis
-        (primeRows, primeCols, _) = image.shape
-        rectScaleFactor = min(primeRows, primeCols) / houghAnalysisSize
-        analyzerWidth = int(primeCols / rectScaleFactor)
-        analyzerHeight = int(primeRows / rectScaleFactor)
-
-        # recipe from here: https://dev.to/simarpreetsingh019/detecting-geometrical-shapes-in-an-image-using-opencv-4g72
-        analyzerImage = cv.resize(image, (analyzerWidth, analyzerHeight))
-        analyzerImageGray = cv.cvtColor(analyzerImage, cv.COLOR_BGR2GRAY)
-        _, analyzerImage = cv.threshold(analyzerImageGray, 240, 255, cv.CHAIN_APPROX_NONE)
-
-        rects = []
-        contours, _ = cv.findContours(analyzerImage, cv.RETR_TREE, cv.CHAIN_APPROX_NONE)
-        for contour in contours:
-            approx = cv.approxPolyDP(contour, 0.01 * cv.arcLength(contour, True), True)
-            if len(approx) == 4:
-                minX = minY = 99999999
-                maxX = maxY = 0
-                for point in approx:
-                    minX = min(minX, point[0][0])
-                    maxX = max(maxX, point[0][0])
-                    minY = min(minY, point[0][1])
-                    maxY = max(maxY, point[0][1])
-                minX *= rectScaleFactor
-                minY *= rectScaleFactor
-                maxX *= rectScaleFactor
-                maxY *= rectScaleFactor
-                area = (maxX - minX) * (maxY - minY)
-                rects.append((minX, minY, maxX, maxY, area))
-
-            # sort descending by rectangle area
-            self.rects = sorted(rects, key=lambda x: x[4])
-            self.rects.reverse()
+    def buttonClickCancelTask(self):
+        if self.progressTask is not None:
+            self.progressTask.cancel()
 
 
-    def drawImage(self):
+    def taskProgress(self, fraction, message):
+        self.progressBar['value'] = fraction * 100
+        self.progressLabel.configure(text=message)
+
+
+    def taskError(self, exception, tracebackText):
+        messagebox.showerror('Image analysis failed', str(exception), detail=tracebackText)
+
+
+    def taskFinished(self, task):
+        for slot in ['analysisTask', 'cropTask', 'exportTask', 'viewTask', 'refineTask']:
+            if getattr(self, slot) is task:
+                setattr(self, slot, None)
+        if task is self.progressTask:
+            self.progressTask = None
+            self.progressFrame.pack_forget()
+        if tracing.isEnabled():
+            self.updateStatusBar()
+
+
+    def frameRendered(self, scheduler):
+        # refresh the frame statistics at most twice per second
+        now = time.time()
+        if now - self.statusUpdateTime >= 0.5:
+            self.statusUpdateTime = now
+            self.updateStatusBar()
+
+
+    # Show the frame statistics and, while tracing is on, the stages that
+    # took the most time since the image was loaded
+    def updateStatusBar(self):
+        text = str(self.renderScheduler)
+        if self.viewport.isZoomed():
+            text += '\n' + str(self.viewport)
+        if self.session is not None:
+            text += '\n' + str(self.session.prefetcher)
+        if tracing.isEnabled():
+            text += '\n' + tracing.defaultTracer.summary()
+        self.statusBar.configure(text=text)
+
+
+    #############################################
+    # Image functions
+
+    # Find the candidate rotation angles of an image; this runs in a
+    # background thread. Returns a tuple of (edges, lineListByLength, lengths).
+    def straightLineAnalysis(self, image, multiResolution):
+        if multiResolution:
+            # only find the coarse candidates here; they are refined after
+            # the first candidates are on the screen
+            return analysis.coarseLineAnalysis(image, self.angleBinSize)
+        else:
+            return analysis.straightLineAnalysis(image, self.angleBinSize)
+
+
+    # Build display-resolution copies of the image and of the edge map; all of
+    # the interactive drawing works from these instead of the full-resolution
+    # image. They only need to be rebuilt when a new image is loaded or when
+    # the window size changes.
+    def buildDisplayProxies(self):
         if self.imagePrimeAspect > self.windowAspect:
             scaler = self.imagePrimeWidth / self.windowWidth
         else:
             scaler = self.imagePrimeHeight / self.windowHeight
-        scaledWidth = int(self.imagePrimeWidth / scaler)
-        scaledHeight = int(self.imagePrimeHeight / scaler)
-        if self.tabControl.index("current") == self.TAB_ROTATE and self.showComputedEdgesCheckboxValue.get():
-            scaledImage = cv.resize(self.edgesImage, (scaledWidth, scaledHeight))
+        scaledWidth = max(1, int(self.imagePrimeWidth / scaler))
+        scaledHeight = max(1, int(self.imagePrimeHeight / scaler))
+
+        self.displayScaler = scaler
+        with tracing.span('resize', size=(scaledHeight, scaledWidth)):
+            self.displayImage = cv.resize(self.workingImage, (scaledWidth, scaledHeight), interpolation=cv.INTER_AREA)
+            displayEdges = cv.resize(self.edgesImage, (scaledWidth, scaledHeight), interpolation=cv.INTER_AREA)
+            self.displayEdges = cv.cvtColor(displayEdges, cv.COLOR_GRAY2RGB)
+        self.displayProxySize = (self.windowWidth, self.windowHeight)
+        self.rotatedFrameCache.clear()
+        self.compositor.invalidate()
+
+
+    # Build the base frame for drawImage(): the rotated image or edge map, plus
+    # the grid and line analysis overlays in the rotate tab. When the view is
+    # zoomed in, the frame is rendered by the viewport from its tiles.
+    def buildBaseFrame(self, layerName, angle, showLines, showGrid):
+        if self.viewport.isZoomed():
+            baseFrame = self.viewport.render(layerName, angle)
+        elif layerName == 'edges':
+            baseFrame = self.rotatedFrameCache.get('edges', self.displayEdges, angle).copy()
         else:
-            scaledImage = cv.resize(self.imagePrime, (scaledWidth, scaledHeight))
-
-        # draw the lines computed from the Hough transform (only in rotate mode)
-        if self.tabControl.index("current") == self.TAB_ROTATE and self.showLineAnalysisCheckboxValue.get():
-            for line in self.lineListByLength[self.lengths[self.currentAngleIndex]]['lines']:
-                (x1, y1, x2, y2) = line
-                x1 = int(x1 / scaler)
-                y1 = int(y1 / scaler)
-                x2 = int(x2 / scaler)
-                y2 = int(y2 / scaler)
-                cv.line(scaledImage, (x1, y1), (x2, y2), (255, 0, 0), 1)
-
-        # rotate the image so that the angle of the computed lines is parallel to the horizontal
-        (rows, cols, _) = scaledImage.shape
-        angle = self.lineListByLength[self.lengths[self.currentAngleIndex]]['angle']
-        M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
-        scaledImage = cv.warpAffine(scaledImage, M, (cols, rows))
+            baseFrame = self.rotatedFrameCache.get('image', self.displayImage, angle).copy()
+        (scaledHeight, scaledWidth) = baseFrame.shape[:2]
+
+        # draw the lines computed from the Hough transform, rotated to match
+        # the image
+        if showLines:
+            lines = self.lineListByLength[self.lengths[self.currentAngleIndex]]['lines']
+            if self.viewport.isZoomed():
+                # rotate about the center of the full-resolution image, then
+                # move into the view
+                (zoom, originX, originY) = self.viewport.transform()
+                M = render.rotationMatrix(self.imagePrimeWidth, self.imagePrimeHeight, angle) * zoom
+                M[0, 2] -= originX * zoom
+                M[1, 2] -= originY * zoom
+                lines = render.transformSegments(lines, M)
+            else:
+                M = render.rotationMatrix(scaledWidth, scaledHeight, angle)
+                lines = render.transformSegments(lines / self.displayScaler, M)
+            render.drawSegments(baseFrame, lines, (255, 0, 0), 1)
 
         # draw a light-colored grid
-        if self.tabControl.index("current") == self.TAB_ROTATE and self.showGridLinesCheckboxValue.get():
-            for x in range(1, scaledWidth, 20):
-                cv.line(scaledImage, (x, 0), (x, scaledHeight), (64, 64, 64), 1)
-            for y in range(1, scaledHeight, 20):
-                cv.line(scaledImage, (0, y), (scaledWidth, y), (64, 64, 64), 1)
+        if showGrid:
+            render.drawGrid(baseFrame)
 
-        # draw the current crop candidate
-        if self.tabControl.index("current") == self.TAB_CROP:
-            if self.freeformCropActive:
-                cv.rectangle(scaledImage, self.freeformBoxCorner1Screen, self.freeformBoxCorner2Screen, (255, 0, 0), 1)
-                self.freeformBoxCorner1Image = (int(self.freeformBoxCorner1Screen[0]*scaler), int(self.freeformBoxCorner1Screen[1]*scaler))
-                self.freeformBoxCorner2Image = (int(self.freeformBoxCorner2Screen[0]*scaler), int(self.freeformBoxCorner2Screen[1]*scaler))
-            elif len(self.circles):
-                (centerX, centerY, radius) = self.circles[self.currentCropIndex]
-                cv.circle(scaledImage, (int(centerX/scaler), int(centerY/scaler)), int(radius/scaler), (255, 0, 0), 1)
-                cv.rectangle(scaledImage, (int((centerX-radius)/scaler), int((centerY-radius)/scaler)), 
-                    (int((centerX+radius)/scaler), int((centerY+radius)/scaler)), (200, 0, 0), 1)
+        return baseFrame
 
-        # convert to a form that Tk can display
-        image = ImageTk.PhotoImage(Image.fromarray(scaledImage))
-        self.imageLabel.configure(image=image)
-        self.imageLabel.image = image
 
+    # Map between the coordinates of the displayed frame and those of the
+    # rotated full-resolution image, for the fit-to-window view as well as for
+    # the zoomed view
+    def imageToDisplay(self, x, y):
+        if self.viewport.isZoomed():
+            (x, y) = self.viewport.toDisplay(x, y)
+            return (int(x), int(y))
+        return (int(x / self.displayScaler), int(y / self.displayScaler))
 
-    def drawFinalImage(self):
-        # rotate the image so that the angle of the computed lines is parallel to the horizontal
-        (rows, cols, _) = self.imagePrime.shape
-        angle = self.lineListByLength[self.lengths[self.currentAngleIndex]]['angle']
-        M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
-        rotatedImage = cv.warpAffine(self.imagePrime, M, (cols, rows))
 
-        # final crop
-        if self.cropMode == self.CROP_CIRCLE_ASSIST:
-            (centerX, centerY, radius) = self.circles[self.currentCropIndex]
-            diameter = int(radius*2) + 1
-            # create a white canvas for copying the circle onto
-            self.finalCroppedImage = np.zeros((diameter, diameter, 3), np.uint8)
-            cv.rectangle(self.finalCroppedImage, (0, 0), (diameter, diameter), (255, 255, 255), thickness=-1)
-
-            # copy individual lines of the circle onto the final cropped image
-            self.finalCroppedImage[radius][0:radius*2] = rotatedImage[centerY][centerX-radius:centerX+radius]
-            for i in range(radius):
-                dx = int(np.sqrt(np.square(radius) - np.square(i)))
-                self.finalCroppedImage[radius-i][radius-dx:radius+dx] = rotatedImage[centerY-i][centerX-dx:centerX+dx]
-                self.finalCroppedImage[radius+i][radius-dx:radius+dx] = rotatedImage[centerY+i][centerX-dx:centerX+dx]
-            croppedWidth = croppedHeight = diameter
-        elif self.cropMode == self.CROP_RECTANGLE_FREEFORM:
+    def displayToImage(self, x, y):
+        if self.viewport.isZoomed():
+            (x, y) = self.viewport.toFull(x, y)
+            return (int(x), int(y))
+        return (int(x * self.displayScaler), int(y * self.displayScaler))
+
+
+    def drawImage(self):
+        # this frame supersedes any scheduled redraw
+        self.renderScheduler.cancel()
+        if self.displayProxySize != (self.windowWidth, self.windowHeight):
+            self.buildDisplayProxies()
+        zoom = 1.0 / self.displayScaler
+        if self.viewport.isZoomed():
+            zoom = self.viewport.zoom
+        currentTab = self.tabControl.index("current")
+
+        # rotate the image so that the angle of the computed lines is parallel
+        # to the horizontal; the base frame is only rebuilt when the angle or
+        # one of the overlays changes
+        angle = self.lineListByLength[self.lengths[self.currentAngleIndex]]['angle']
+        if currentTab == self.TAB_ROTATE and self.showComputedEdgesCheckboxValue.get():
+            layerName = 'edges'
+        else:
+            layerName = 'image'
+        showLines = currentTab == self.TAB_ROTATE and bool(self.showLineAnalysisCheckboxValue.get())
+        showGrid = currentTab == self.TAB_ROTATE and bool(self.showGridLinesCheckboxValue.get())
+        view = self.viewport.transform() if self.viewport.isZoomed() else None
+        baseKey = (layerName, round(angle, 4), self.currentAngleIndex if showLines else None, showGrid, view)
+        self.compositor.setBase(baseKey, lambda: self.buildBaseFrame(layerName, angle, showLines, showGrid))
+
+        # draw the current crop candidate on the top layer
+        shapes = []
+        if currentTab == self.TAB_CROP:
+            if self.freeformCropActive:
+                shapes.append(('rectangle', self.imageToDisplay(*self.freeformBoxCorner1Image), self.imageToDisplay(*self.freeformBoxCorner2Image), (255, 0, 0), 1))
+            elif self.cropMode == self.CROP_RECTANGLE_ASSIST:
+                (minX, minY, maxX, maxY) = self.selectedRect
+                shapes.append(('rectangle', self.imageToDisplay(minX, minY), self.imageToDisplay(maxX, maxY), (255, 0, 0), 1))
+            elif len(self.circles):
+                (centerX, centerY, radius) = self.circles[self.currentCropIndex]
+                shapes.append(('circle', self.imageToDisplay(centerX, centerY), int(radius*zoom), (255, 0, 0), 1))
+                shapes.append(('rectangle', self.imageToDisplay(centerX-radius, centerY-radius),
+                    self.imageToDisplay(centerX+radius, centerY+radius), (200, 0, 0), 1))
+        with tracing.span('drawTop'):
+            scaledImage = self.compositor.drawTop(shapes)
+
+        # only the regions that changed since the last frame are updated
+        with tracing.span('present'):
+            self.frameSink.present(scaledImage, self.compositor.changed)
+
+
+    # Whether there is a crop region to save: a circle candidate, a rectangle
+    # candidate or a box drawn with the mouse. The circle candidates are
+    # searched for in the background each time the angle changes, and there
+    # may be none.
+    def hasCrop(self):
+        if self.cropMode == self.CROP_RECTANGLE_FREEFORM:
+            return self.freeformBoxCorner1Image[0] != self.freeformBoxCorner2Image[0] and \
+                self.freeformBoxCorner1Image[1] != self.freeformBoxCorner2Image[1]
+        elif self.cropMode == self.CROP_RECTANGLE_ASSIST:
+            return True
+        return self.currentCropIndex < len(self.circles)
+
+
+    # The save tab is only enabled while there is a crop region to save
+    def updateSaveTab(self):
+        self.tabControl.tab(self.TAB_SAVE, state="normal" if self.hasCrop() else "disabled")
+
+
+    # Describe the current rotation angle and crop region.
+    # Returns a tuple of (angle, crop, transparent); crop is in the format of
+    #   an edit recipe, see recipe.py
+    def currentCrop(self):
+        angle = self.lineListByLength[self.lengths[self.currentAngleIndex]]['angle']
+        if self.cropMode == self.CROP_RECTANGLE_FREEFORM:
             topX = min(self.freeformBoxCorner1Image[0], self.freeformBoxCorner2Image[0])
             bottomX = max(self.freeformBoxCorner1Image[0], self.freeformBoxCorner2Image[0])
             topY = min(self.freeformBoxCorner1Image[1], self.freeformBoxCorner2Image[1])
             bottomY = max(self.freeformBoxCorner1Image[1], self.freeformBoxCorner2Image[1])
-            self.finalCroppedImage = np.zeros((bottomY-topY, bottomX-topX, 3), np.uint8)
-            for i in range(topY, bottomY):
-                self.finalCroppedImage[i-topY][:] = rotatedImage[i][topX:bottomX]
-            croppedWidth = bottomX - topX
-            croppedHeight = bottomY - topY
+            return (angle, recipe.rectangleCrop(topX, topY, bottomX, bottomY), False)
+        elif self.cropMode == self.CROP_RECTANGLE_ASSIST:
+            return (angle, recipe.rectangleCrop(*self.selectedRect), False)
+        else:
+            (centerX, centerY, radius) = self.circles[self.currentCropIndex]
+            alpha = bool(self.transparentBackgroundCheckboxValue.get())
+            return (angle, recipe.circleCrop(centerX, centerY, radius), alpha)
+
+
+    # Capture the current rotation angle and crop region as a function that
+    # applies them to an image. The function takes the image and its scale
+    # relative to the full-resolution image, so the same crop can be applied
+    # to the reduced-resolution working image for the preview and to the full
+    # image when saving. Rotating the image so that the angle of the computed
+    # lines is parallel to the horizontal only touches the region being
+    # cropped.
+    def currentCropFunction(self):
+        (angle, crop, alpha) = self.currentCrop()
+        if crop['type'] == 'rectangle':
+            return lambda image, scale: export.exportRectangle(image, angle,
+                crop['topX'] / scale, crop['topY'] / scale, crop['bottomX'] / scale, crop['bottomY'] / scale)
+        else:
+            return lambda image, scale: export.exportCircle(image, angle,
+                crop['centerX'] / scale, crop['centerY'] / scale, crop['radius'] / scale, alpha)
+
+
+    def drawFinalImage(self):
+        if not self.hasCrop():
+            return
+
+        # preview the final crop from the working image
+        self.finalCroppedImage = self.currentCropFunction()(self.workingImage, self.workingScale)
+        (croppedHeight, croppedWidth) = self.finalCroppedImage.shape[:2]
 
         # scale the image
         aspectRatio = 1.0 * croppedWidth / croppedHeight
@@ -446,10 +1277,8 @@ class MobyCAIRO:
         scaledHeight = int(croppedHeight / scaler)
         scaledImage = cv.resize(self.finalCroppedImage, (scaledWidth, scaledHeight))
 
-        # convert to a form that Tk can display
-        image = ImageTk.PhotoImage(Image.fromarray(scaledImage))
-        self.imageLabel.configure(image=image)
-        self.imageLabel.image = image
+        with tracing.span('present'):
+            self.frameSink.present(scaledImage)
 
 
     #############################################
@@ -460,17 +1289,27 @@ class MobyCAIRO:
         self.tabControl.add(self.loadTab, text=" Load ")
 
         ttk.Label(self.loadTab, text="Load image: ").pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
-        self.buttonLoadFile = ttk.Button(self.loadTab, text="Select image file...", command=self.buttonClickLoadImage).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        # the button is enabled once the image processing modules are loaded
+        self.buttonLoadFile = ttk.Button(self.loadTab, text="Starting...", command=self.buttonClickLoadImage, state="disabled")
+        self.buttonLoadFile.pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        ttk.Label(self.loadTab, text="Review several images: ").pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.buttonLoadFolder = ttk.Button(self.loadTab, text="Select folder...", command=self.buttonClickLoadFolder, state="disabled")
+        self.buttonLoadFolder.pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.buttonLoadReviewList = ttk.Button(self.loadTab, text="Select review list...", command=self.buttonClickLoadReviewList, state="disabled")
+        self.buttonLoadReviewList.pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.multiResolutionCheckboxValue = tk.IntVar(value=1)
+        self.multiResolutionCheckbox = ttk.Checkbutton(self.loadTab, text="Multi-resolution analysis (faster for large scans)", variable=self.multiResolutionCheckboxValue).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
 
 
     def initRotateTab(self):
         self.rotateTab = ttk.Frame(self.tabControl)
         self.tabControl.add(self.rotateTab, text=" Rotate ")
 
-        # work on the zoom feature a bit later
-        #ttk.Label(self.rotateTab, text="Zoom: ").grid(column=0, row=0, padx=3, pady=10, sticky='e')
-        #self.buttonZoomIn = ttk.Button(self.rotateTab, text="In", command=None).grid(column=1, row=0, padx=3, pady=10)
-        #self.buttonZoomOut = ttk.Button(self.rotateTab, text="Out", command=None).grid(column=2, row=0, padx=3, pady=10)
+        # the mouse wheel zooms as well, and dragging the image pans it
+        ttk.Label(self.rotateTab, text="Zoom: ").grid(column=0, row=0, padx=3, pady=10, sticky='e')
+        self.buttonZoomIn = ttk.Button(self.rotateTab, text="In", command=lambda: self.zoomView(2.0)).grid(column=1, row=0, padx=3, pady=10)
+        self.buttonZoomOut = ttk.Button(self.rotateTab, text="Out", command=lambda: self.zoomView(0.5)).grid(column=2, row=0, padx=3, pady=10)
+        self.buttonZoomFit = ttk.Button(self.rotateTab, text="Fit", command=self.buttonClickZoomFit).grid(column=3, row=0, padx=3, pady=10)
 
         ttk.Label(self.rotateTab, text="Counter clockwise: ").grid(column=0, row=1, padx=3, pady=10, sticky='e')
         self.buttonCounter90  = ttk.Button(self.rotateTab, text="90",   command=lambda: self.rotateImage(90)).grid( column=1, row=1, padx=3, pady=10)
@@ -486,11 +1325,11 @@ class MobyCAIRO:
 
         ttk.Label(self.rotateTab, text="Clockwise: ").grid(column=0, row=2, padx=3, pady=10, sticky='e')
         self.showGridLinesCheckboxValue = tk.IntVar(value=1)
-        self.showGridLinesCheckbox = ttk.Checkbutton(self.rotateTab, text="Show grid lines", variable=self.showGridLinesCheckboxValue, command=self.drawImage).grid(column=0, row=3, padx=3, pady=10, sticky='w')
+        self.showGridLinesCheckbox = ttk.Checkbutton(self.rotateTab, text="Show grid lines", variable=self.showGridLinesCheckboxValue, command=lambda: self.renderScheduler.request()).grid(column=0, row=3, padx=3, pady=10, sticky='w')
         self.showLineAnalysisCheckboxValue = tk.IntVar(value=1)
-        self.showLineAnalysisCheckbox = ttk.Checkbutton(self.rotateTab, text="Show line analysis", variable=self.showLineAnalysisCheckboxValue, command=self.drawImage).grid(column=0, row=4, padx=3, pady=10, sticky='w')
+        self.showLineAnalysisCheckbox = ttk.Checkbutton(self.rotateTab, text="Show line analysis", variable=self.showLineAnalysisCheckboxValue, command=lambda: self.renderScheduler.request()).grid(column=0, row=4, padx=3, pady=10, sticky='w')
         self.showComputedEdgesCheckboxValue = tk.IntVar(value=0)
-        self.showComputedEdgesCheckbox = ttk.Checkbutton(self.rotateTab, text="Show computed edges", variable=self.showComputedEdgesCheckboxValue, command=self.drawImage).grid(column=0, row=5, padx=3, pady=10, sticky='w')
+        self.showComputedEdgesCheckbox = ttk.Checkbutton(self.rotateTab, text="Show computed edges", variable=self.showComputedEdgesCheckboxValue, command=lambda: self.renderScheduler.request()).grid(column=0, row=5, padx=3, pady=10, sticky='w')
 
         ttk.Label(self.rotateTab, text="Candidate Angles: ").grid(column=0, row=6, padx=3, pady=10, sticky='ne')
         self.angleList = tk.Listbox(self.rotateTab)
@@ -503,7 +1342,7 @@ class MobyCAIRO:
         self.cropTab = ttk.Frame(self.tabControl)
         self.tabControl.add(self.cropTab, text=" Crop ")
 
-        ttk.Label(self.cropTab, text="Use the mouse to select a rectangular crop region,\nor select an auto-detected circle crop region\nand make fine adjustments with the keyboard commands").grid(column=0, row=0, columnspan=3, padx=3, pady=10, sticky='nw')
+        ttk.Label(self.cropTab, text="Use the mouse to select a rectangular crop region,\nor select an auto-detected circle or rectangle crop region;\nmake fine adjustments to circles with the keyboard commands").grid(column=0, row=0, columnspan=3, padx=3, pady=10, sticky='nw')
 
         ttk.Label(self.cropTab, text="Candidate Circles: ").grid(column=0, row=1, padx=3, pady=10, sticky='ne')
         self.circleCropList = tk.Listbox(self.cropTab)
@@ -525,12 +1364,12 @@ class MobyCAIRO:
         self.circleCropList.bind('<D>', self.keyboardCallback)
         self.circleCropList.bind('<d>', self.keyboardCallback)
 
-        """
-        ttk.Label(self.cropTab, text="Candidate Rectangles: ").grid(column=0, row=1, padx=3, pady=10, sticky='ne')
-        self.rectCropList = tk.Listbox(self.cropTab)
-        self.rectCropList.grid(column=1, row=1, padx=5, pady=5, sticky='w')
+        ttk.Label(self.cropTab, text="Candidate Rectangles: ").grid(column=0, row=2, padx=3, pady=10, sticky='ne')
+        self.rectCropList = tk.Listbox(self.cropTab, width=32)
+        self.rectCropList.grid(column=1, row=2, padx=5, pady=5, sticky='w')
         self.rectCropList.bind('<<ListboxSelect>>', self.listEvent)
-        """
+        self.buttonStraightenRect = ttk.Button(self.cropTab, text="Straighten to rectangle", command=self.buttonClickStraightenRect)
+        self.buttonStraightenRect.grid(column=3, row=2, padx=3, pady=10, sticky='nw')
 
 
     def initSaveTab(self):
@@ -538,7 +1377,11 @@ class MobyCAIRO:
         self.tabControl.add(self.saveTab, text=" Save ")
 
         ttk.Label(self.saveTab, text="Save image: ").pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
-        self.buttonLoadFile = ttk.Button(self.saveTab, text="Select file...", command=self.buttonClickSaveImage).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.buttonSaveFile = ttk.Button(self.saveTab, text="Select file...", command=self.buttonClickSaveImage).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        ttk.Label(self.saveTab, text="Save every disc and rectangle on the scan,\neach straightened on its own: ").pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.buttonSaveAllItems = ttk.Button(self.saveTab, text="Save all items...", command=self.buttonClickSaveAllItems).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
+        self.transparentBackgroundCheckboxValue = tk.IntVar(value=0)
+        self.transparentBackgroundCheckbox = ttk.Checkbutton(self.saveTab, text="Transparent background outside circle\n(PNG, TIFF or WebP only)", variable=self.transparentBackgroundCheckboxValue, command=self.drawFinalImage).pack(side=tk.TOP, expand=tk.NO, padx=5, pady=5)
 
 
     def initGUI(self):
@@ -551,8 +1394,13 @@ class MobyCAIRO:
         self.parent.title(titleString)
         try:
             self.parent.state('zoomed')
-        except:
-            pass
+        except tk.TclError:
+            # X11 has no zoomed state; ask the window manager to maximize the
+            # window instead, or failing that, cover the screen
+            try:
+                self.parent.attributes('-zoomed', True)
+            except tk.TclError:
+                self.parent.geometry('%dx%d+0+0' % (self.parent.winfo_screenwidth(), self.parent.winfo_screenheight()))
         self.mainContainer = tk.Frame(self.parent)
         self.mainContainer.pack(expand=tk.YES, fill=tk.BOTH)
 
@@ -562,7 +1410,7 @@ class MobyCAIRO:
 
         # load the logo
         logoPath = os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), self.logoFilename)
-        self.logoImage = ImageTk.PhotoImage(Image.open(logoPath))
+        self.logoImage = tk.PhotoImage(file=logoPath)
         self.logoLabel = tk.Label(self.controlFrame, image=self.logoImage)
         self.logoLabel.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
 
@@ -577,6 +1425,34 @@ class MobyCAIRO:
         self.initSaveTab()
         self.tabControl.pack(side=tk.TOP, expand=tk.YES, fill=tk.BOTH)
 
+        # the scans of a review session; only shown during a session
+        self.sessionFrame = ttk.Frame(self.controlFrame)
+        self.sessionLabel = ttk.Label(self.sessionFrame, text='', anchor='w')
+        self.sessionLabel.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
+        self.sessionStrip = tk.Canvas(self.sessionFrame, height=self.thumbnailSize + 8, highlightthickness=0)
+        self.sessionStrip.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
+        self.sessionStrip.bind('<ButtonPress-1>', self.sessionStripClick)
+        sessionScrollbar = ttk.Scrollbar(self.sessionFrame, orient=tk.HORIZONTAL, command=self.sessionStrip.xview)
+        sessionScrollbar.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
+        self.sessionStrip.configure(xscrollcommand=sessionScrollbar.set)
+        self.buttonPreviousScan = ttk.Button(self.sessionFrame, text="Previous scan", command=self.buttonClickPreviousScan)
+        self.buttonPreviousScan.pack(side=tk.LEFT, padx=3, pady=3)
+        self.buttonNextScan = ttk.Button(self.sessionFrame, text="Next scan", command=self.buttonClickNextScan)
+        self.buttonNextScan.pack(side=tk.RIGHT, padx=3, pady=3)
+
+        # progress indicator for background tasks; only shown while a task
+        # is running
+        self.progressFrame = ttk.Frame(self.controlFrame)
+        self.progressLabel = ttk.Label(self.progressFrame, text='', anchor='w')
+        self.progressLabel.pack(side=tk.TOP, expand=tk.NO, fill=tk.X)
+        self.progressBar = ttk.Progressbar(self.progressFrame, mode='determinate', maximum=100)
+        self.progressBar.pack(side=tk.LEFT, expand=tk.YES, fill=tk.X, padx=3)
+        ttk.Button(self.progressFrame, text="Cancel", command=self.buttonClickCancelTask).pack(side=tk.RIGHT, padx=3)
+
+        # status bar for performance statistics
+        self.statusBar = ttk.Label(self.controlFrame, text='', anchor='w', justify=tk.LEFT)
+        self.statusBar.pack(side=tk.BOTTOM, expand=tk.NO, fill=tk.X)
+
         # disable most tabs until the first image is loaded
         self.tabControl.tab(self.TAB_ROTATE, state="disabled")
         self.tabControl.tab(self.TAB_CROP, state="disabled")
@@ -584,35 +1460,101 @@ class MobyCAIRO:
 
         # set up the picture frame
         self.pictureFrame = tk.Frame(self.mainContainer)
-        self.pictureFrame.pack(side=tk.RIGHT, expand=tk.YES)
-
-        # create a giant blank image to plot on the image label in order
-        # to push the image out to the boundaries; obtain the actual
-        # resolution of the image window when the Map event is received
-        blankImage = np.zeros((5000, 5000, 3), np.uint8)
-        image = ImageTk.PhotoImage(Image.fromarray(blankImage))
-        self.imageLabel = tk.Label(self.pictureFrame, image=image)
-        self.imageLabel.pack(side=tk.RIGHT, expand=tk.YES)
-        
-        self.imageLabel.bind('<ButtonPress-1>', self.imageLabelMouseDown)
-        self.imageLabel.bind('<Motion>', self.imageLabelMouseMove)
-        self.imageLabel.bind('<ButtonRelease-1>', self.imageLabelMouseUp)
-        self.imageLabel.bind('<Map>', self.windowIsReady)
-
-
-    def __init__(self, parent):
+        self.pictureFrame.pack(side=tk.RIGHT, expand=tk.YES, fill=tk.BOTH)
+        self.pictureFrame.bind('<Configure>', self.windowResized)
+
+        # the picture frame takes up the rest of the window; obtain the
+        # actual resolution of the image window when the Map event is
+        # received. The canvas takes the size of the frames shown on it.
+        self.imageCanvas = tk.Canvas(self.pictureFrame, width=1, height=1, borderwidth=0, highlightthickness=0)
+        self.imageCanvas.pack(side=tk.RIGHT, expand=tk.YES)
+
+        self.imageCanvas.bind('<ButtonPress-1>', self.imageCanvasMouseDown)
+        self.imageCanvas.bind('<Motion>', self.imageCanvasMouseMove)
+        self.imageCanvas.bind('<ButtonRelease-1>', self.imageCanvasMouseUp)
+        for button in ['2', '3']:
+            self.imageCanvas.bind('<ButtonPress-%s>' % (button), self.imageCanvasPanStart)
+            self.imageCanvas.bind('<B%s-Motion>' % (button), self.imageCanvasPan)
+            self.imageCanvas.bind('<ButtonRelease-%s>' % (button), self.imageCanvasPanEnd)
+        self.imageCanvas.bind('<MouseWheel>', self.imageCanvasMouseWheel)
+        self.imageCanvas.bind('<Button-4>', self.imageCanvasMouseWheel)
+        self.imageCanvas.bind('<Button-5>', self.imageCanvasMouseWheel)
+        self.imageCanvas.bind('<Map>', self.windowIsReady)
+
+
+    # Parameters:
+    #   parent: the Tk root window
+    #   exitAfterStartup: print how long the startup took and exit, for
+    #   measuring the startup time
+    def __init__(self, parent, exitAfterStartup=False):
         self.parent = parent
+        self.windowWidth = None
+        self.windowHeight = None
         self.lineAnalyzerImage = None
+        self.imagePrime = None
+
+        # reduced-resolution copy of the image used for analysis and preview;
+        # see loader.readReduced()
+        self.workingImage = None
+        self.workingScale = 1
+
+        # display-resolution copies of the image, see buildDisplayProxies()
+        self.displayImage = None
+        self.displayEdges = None
+        self.displayScaler = 1.0
+        self.displayProxySize = None
+        self.resizeAfterId = None
+        self.rotatedFrameCache = None
+        self.compositor = None
+        self.frameSink = None
+        self.renderScheduler = None
+        self.statusUpdateTime = 0.0
+
+        # the zoomed view, see viewport.py
+        self.viewport = None
+        self.viewportHasFullResolution = False
+        self.panPosition = None
+
+        # background tasks: image loading and line analysis, crop candidates,
+        # saving the final image
+        self.analysisTask = None
+        self.cropTask = None
+        self.exportTask = None
+        self.viewTask = None
+        self.refineTask = None
+        self.progressTask = None
+        self.importTask = None
+
+        # the review session over several scans, see startSession()
+        self.session = None
+        self.sessionMultiResolution = False
+        self.sessionPollId = None
+        self.lastSaveDirectory = None
+
+        # crop candidates for the current angle, and all of the candidates
+        # found so far, keyed by (angle, analysis sizes); the top circles
+        # refined at full resolution are keyed the same way
+        self.circles = []
+        self.rects = []
+        self.cropCandidates = {}
+        self.refinedCircles = {}
+        self.circlesKey = None
+        self.analysisImage = None
+        self.analysisScale = 1.0
+
+        # results of earlier analyses, keyed by the hash of the file contents
+        self.analysisCache = None
+        self.contentHash = None
 
         # related to automated rotation
         self.currentAngleIndex = 0
         self.currentCropIndex = 0
+        self.currentRectIndex = None
+        self.selectedRect = (0, 0, 0, 0)
         self.currentRotationAngle = "999.00°"
 
         self.cropMode = self.CROP_CIRCLE_ASSIST
         self.freeformCropActive = False
-        self.freeformBoxCorner1Screen = (0, 0)
-        self.freeformBoxCorner2Screen = (0, 0)
         self.freeformBoxCorner1Image = (0, 0)
         self.freeformBoxCorner2Image = (0, 0)
 
@@ -622,11 +1564,49 @@ class MobyCAIRO:
             self.scaleFactor = ctypes.windll.shcore.GetScaleFactorForDevice(0) / 100
         self.parent.tk.call('tk', 'scaling', self.scaleFactor)
 
-        # initialize GUI elements and event callbacks
+        # for benchmarks/bench_startup.py
+        self.exitAfterStartup = exitAfterStartup
+        self.startupMilestones = set()
+
+        # initialize GUI elements and event callbacks; the image processing
+        # modules are imported in the meantime
+        self.importTask = tasks.BackgroundTask(self.parent, importModules, self.modulesImported, onError=self.taskError)
         self.initGUI()
 
 
+    # Finish setting up once the image processing modules are imported
+    def modulesImported(self, result):
+        self.importTask = None
+        self.rotatedFrameCache = render.RotatedFrameCache(self.previewCacheEntries, self.previewCacheBytes)
+        self.compositor = render.Compositor()
+        self.frameSink = render.TkFrameSink(self.imageCanvas)
+        self.renderScheduler = render.RenderScheduler(self.parent, self.drawImage, self.maxFrameRate, self.frameRendered)
+        self.viewport = viewport.Viewport()
+        if self.windowWidth:
+            self.viewport.setWindow(self.windowWidth, self.windowHeight)
+        self.analysisCache = analysiscache.defaultCache
+        self.buttonLoadFile.configure(text="Select image files...", state="normal")
+        self.buttonLoadFolder.configure(state="normal")
+        self.buttonLoadReviewList.configure(state="normal")
+        self.startupMilestone('ready')
+
+
+    # Note a point in the startup; with exitAfterStartup, the time since the
+    # program started is printed and the program exits once the window is
+    # shown and ready
+    def startupMilestone(self, name):
+        if not self.exitAfterStartup or name in self.startupMilestones:
+            return
+        self.startupMilestones.add(name)
+        print('startup: %s after %0.3f sec' % (name, time.perf_counter() - startTime), flush=True)
+        if self.startupMilestones >= set(['window shown', 'ready']):
+            self.parent.after_idle(self.parent.destroy)
+
+
 if __name__ == '__main__':
+    # "--trace <trace filename>" turns on the stage timing, see tracing.py
+    tracing.enableFromArguments(sys.argv)
+    exitAfterStartup = '--exit-after-startup' in sys.argv
     root = tk.Tk()
-    app = MobyCAIRO(root)
+    app = MobyCAIRO(root, exitAfterStartup)
     root.mainloop()
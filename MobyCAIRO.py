@@ -5,7 +5,9 @@ import sys
 import tkinter as tk
 import tkinter.font as font
 
+import loader
 import process
+import tracing
 
 versionImported = False
 try:
@@ -38,9 +40,11 @@ def doEscape(arg):
     root.destroy()
 
 
-# process arguments
+# process arguments; "--trace <trace filename>" writes a trace of the
+# processing stages, see tracing.py
+tracing.enableFromArguments(sys.argv)
 if len(sys.argv) < 3:
-    print('%s <input image filename> <output image filename>' % (sys.argv[0]))
+    print('%s [--trace <trace filename>] <input image filename> <output image filename>' % (sys.argv[0]))
     sys.exit(1)
 
 inputFilename = sys.argv[1]
@@ -69,20 +73,25 @@ screen = screeninfo.get_monitors()[0]
 screenWidth = int(screen.width * 0.95)
 screenHeight = int(screen.height * 0.70)
 
-# use OpenCV to load the image
-image = cv.imread(inputFilename)
+# load a reduced-resolution version of the image; it is handed on to the
+# editing step so that the image is not decoded a second time
+(workingImage, workingScale) = loader.readReduced(inputFilename)
+if workingImage is None:
+    print("could not read image '%s'" % (inputFilename))
+    sys.exit(1)
 
 # scale down the image and move the window to the right side of the screen
 minDimension = min(screenWidth, screenHeight)
-ratio = max(minDimension / image.shape[0], minDimension / image.shape[1])
-windowWidth = int(image.shape[1] * ratio)
-windowHeight = int(image.shape[0] * ratio)
+ratio = max(minDimension / workingImage.shape[0], minDimension / workingImage.shape[1])
+windowWidth = int(workingImage.shape[1] * ratio)
+windowHeight = int(workingImage.shape[0] * ratio)
 root.geometry("+%d+20" % (screenWidth-windowWidth))
-scaledImage = cv.resize(image, (windowWidth, windowHeight))
+scaledImage = cv.resize(workingImage, (windowWidth, windowHeight))
 scaledImage = cv.cvtColor(scaledImage, cv.COLOR_BGR2RGB)
 
 # put the image on a label
-image = ImageTk.PhotoImage(Image.fromarray(scaledImage))
+with tracing.span('PhotoImage'):
+    image = ImageTk.PhotoImage(Image.fromarray(scaledImage))
 photoLabel = tk.Label(frame, image=image)
 photoLabel.pack(side=tk.TOP)
 
@@ -105,8 +114,8 @@ root.mainloop()
 
 # proceed to the editing action
 if action == 'circle':
-    process.processImage(circle=True)
+    process.processImage(True, workingImage, workingScale)
 elif action == 'rectangle':
-    process.processImage(circle=False)
+    process.processImage(False, workingImage, workingScale)
 else:
     print('exiting with no editing action')
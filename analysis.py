@@ -0,0 +1,590 @@
+import concurrent.futures
+import cv2 as cv
+import numpy as np
+
+import imagesource
+import tracing
+
+
+# Fold an array of angles in degrees into (-90, 90]; lines have no direction,
+# so angles 180 degrees apart describe the same line
+def foldAngles(angles):
+    angles = np.mod(angles, 180.0)
+    angles[angles > 90] -= 180
+    return angles
+
+
+# Organize line segments into bins according to their angles.
+# Parameters:
+#   lines: line segments as returned by cv.HoughLinesP (Nx1x4 or Nx4 array of
+#   x1, y1, x2, y2), or None
+#   binSize: width of each angle bin in degrees; values below 1.0 give
+#   sub-degree bins
+# Returns a tuple of (lineListByLength, lengths):
+#   lineListByLength: dictionary keyed by the total length of all the line
+#   segments in a bin; each entry holds the 'lines' in the bin as an Mx4 array
+#   and the 'angle' of the bin in degrees
+#   lengths: the keys of lineListByLength, sorted in descending order
+def binLineSegments(lines, binSize=1.0):
+    if lines is None or len(lines) == 0:
+        return ({}, [])
+    segments = np.asarray(lines, dtype=np.int32).reshape(-1, 4)
+    dx = (segments[:, 2] - segments[:, 0]).astype(np.float64)
+    dy = (segments[:, 3] - segments[:, 1]).astype(np.float64)
+
+    # compute the angle of every segment, folded into (-90, 90] so that a
+    # vertical line is always 90 degrees
+    angles = foldAngles(np.degrees(np.arctan2(dy, dx)))
+    segmentLengths = np.hypot(dx, dy)
+
+    # length-weighted angle histogram: group the segments by bin and total
+    # up the segment lengths in each bin
+    bins = np.rint(angles / binSize).astype(np.int64)
+    order = np.argsort(bins, kind='stable')
+    (binIndices, starts) = np.unique(bins[order], return_index=True)
+    totals = np.add.reduceat(segmentLengths[order], starts)
+    groups = np.split(segments[order], starts[1:])
+
+    # organize the line list according to the most distance represented per angle
+    lineListByLength = {}
+    for (binIndex, total, group) in zip(binIndices, totals, groups):
+        lineListByLength[float(total)] = { 'lines': group, 'angle': round(float(binIndex) * binSize, 6) }
+    lengths = sorted(lineListByLength.keys())
+    lengths.reverse()
+
+    return (lineListByLength, lengths)
+
+
+# The stages of the straight line analysis, adapting the pipeline described
+# in this Stack Overflow answer:
+#  https://stackoverflow.com/a/45560545/475067
+
+# Compute the Canny edge map of an image (3-channel)
+def detectEdges(image):
+    # create an image for Hough line analysis; convert color -> grayscale
+    with tracing.span('cvtColor', size=image.shape[:2]):
+        lineAnalyzerImage = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    # blur the image
+    with tracing.span('GaussianBlur'):
+        lineAnalyzerImage = cv.GaussianBlur(lineAnalyzerImage, (7, 7), 0)
+
+    lowThreshold = 50
+    highThreshold = 150
+    with tracing.span('Canny'):
+        return cv.Canny(lineAnalyzerImage, lowThreshold, highThreshold)
+
+
+# Find the straight line segments in an edge map with the probabilistic Hough
+# transform; returns the segments as cv.HoughLinesP() does
+def findLineSegments(edges):
+    rho = 1
+    theta = np.pi / 180
+    threshold = 15
+    minLineLength = 50
+    maxLineGap = 20
+    with tracing.span('HoughLinesP', size=edges.shape[:2]):
+        return cv.HoughLinesP(edges, rho, theta, threshold, np.array([]), minLineLength=minLineLength, maxLineGap=maxLineGap)
+
+
+# Find the straight lines in an image and organize them by angle.
+# Parameters:
+#   image: the image to be analyzed (3-channel)
+#   binSize: width of each angle bin in degrees
+# Returns a tuple of (edges, lineListByLength, lengths):
+#   edges: the single-channel Canny edge map
+#   lineListByLength, lengths: see binLineSegments()
+def straightLineAnalysis(image, binSize=1.0):
+    edges = detectEdges(image)
+    lines = findLineSegments(edges)
+    with tracing.span('binLineSegments'):
+        (lineListByLength, lengths) = binLineSegments(lines, binSize)
+    return (edges, lineListByLength, lengths)
+
+
+# Find candidate angles on a reduced-resolution copy of an image. This is the
+# first, fast stage of the multi-resolution analysis.
+# Parameters:
+#   image: the image to be analyzed (3-channel), or an image source
+#   binSize: width of each angle bin in degrees
+#   coarseSize: the largest dimension of the reduced-resolution copy
+# Returns a tuple of (edges, lineListByLength, lengths) like
+#   straightLineAnalysis(); the line segments are in the coordinates of the
+#   full-resolution image while the edge map is the reduced-resolution one
+def coarseLineAnalysis(image, binSize=1.0, coarseSize=1000):
+    (rows, cols) = image.shape[:2]
+    scale = min(1.0, coarseSize / max(rows, cols))
+    if scale < 1.0:
+        with tracing.span('resize'):
+            coarseImage = imagesource.resize(image, (max(1, int(cols * scale)), max(1, int(rows * scale))))
+    else:
+        coarseImage = image
+
+    (edges, lineListByLength, lengths) = straightLineAnalysis(coarseImage, binSize)
+
+    # move the line segments into full-resolution coordinates
+    scaleLineSegments(lineListByLength, 1.0 / scale)
+
+    return (edges, lineListByLength, lengths)
+
+
+# Scale the line segments of every candidate in place, e.g. to move them from
+# the coordinates of a reduced-resolution copy of an image into those of the
+# full-resolution image
+def scaleLineSegments(lineListByLength, scale):
+    for candidate in lineListByLength.values():
+        candidate['lines'] = np.rint(candidate['lines'] * scale).astype(np.int32)
+
+
+# Measure the angle of a single line segment precisely by sampling a thin
+# strip of the image along the segment, finding the sub-pixel edge position
+# across each column of the strip and fitting a line to those positions.
+# Parameters:
+#   image: the full-resolution image (3-channel), or an image source
+#   segment: (x1, y1, x2, y2) estimate of the segment, full-resolution coords
+#   scale: sampling resolution relative to the full-resolution image
+#   band: half-width of the strip, in samples
+# Returns the refined segment as a float array (x1, y1, x2, y2), or None if
+#   there was not enough edge support to fit a line
+def refineSegment(image, segment, scale, band):
+    (x1, y1, x2, y2) = [float(v) for v in segment]
+    length = np.hypot(x2 - x1, y2 - y1)
+    stripLength = int(length * scale)
+    if stripLength < 8:
+        return None
+    stripWidth = 2 * band + 1
+
+    # unit vectors along (d) and across (n) the segment
+    (dX, dY) = ((x2 - x1) / length, (y2 - y1) / length)
+    (nX, nY) = (-dY, dX)
+
+    # strip coordinates (u, v) -> image coordinates
+    M = np.array([
+        [dX / scale, nX / scale, x1 - band * nX / scale],
+        [dY / scale, nY / scale, y1 - band * nY / scale]])
+    strip = imagesource.warpAffine(image, M, (stripLength, stripWidth), flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP, borderMode=cv.BORDER_REPLICATE)
+    if strip.ndim == 3:
+        strip = cv.cvtColor(strip, cv.COLOR_BGR2GRAY)
+    strip = cv.GaussianBlur(strip, (3, 3), 0)
+    gradient = np.abs(cv.Sobel(strip, cv.CV_32F, 0, 1, ksize=3))
+
+    # strongest edge across each column, refined to sub-pixel precision by
+    # fitting a parabola through the peak and its neighbors
+    gradient = gradient[1:-1]
+    peaks = np.argmax(gradient, axis=0)
+    columns = np.arange(stripLength)
+    strength = gradient[peaks, columns]
+    inner = (peaks > 0) & (peaks < gradient.shape[0] - 1) & (strength > 20)
+    if np.count_nonzero(inner) < 8:
+        return None
+    (peaks, columns) = (peaks[inner], columns[inner])
+    before = gradient[peaks - 1, columns]
+    at = gradient[peaks, columns]
+    after = gradient[peaks + 1, columns]
+    denominator = before - 2 * at + after
+    offsets = np.where(denominator != 0, 0.5 * (before - after) / np.where(denominator != 0, denominator, 1), 0)
+    v = peaks + 1 + offsets
+
+    # fit v = a*u + b, then refit without the outliers
+    u = columns.astype(np.float64)
+    (a, b) = np.polyfit(u, v, 1)
+    inliers = np.abs(v - (a * u + b)) < 1.0
+    if np.count_nonzero(inliers) < 8:
+        return None
+    (a, b) = np.polyfit(u[inliers], v[inliers], 1)
+
+    # map the fitted line back into image coordinates
+    uEnd = stripLength - 1
+    refined = []
+    for (uPoint, vPoint) in ((0.0, b), (uEnd, a * uEnd + b)):
+        refined.append(x1 + (uPoint * dX + (vPoint - band) * nX) / scale)
+        refined.append(y1 + (uPoint * dY + (vPoint - band) * nY) / scale)
+    return np.array(refined)
+
+
+# Refine the angles of the top candidates from coarseLineAnalysis(), moving
+# up through successively higher resolution levels until reaching the full
+# resolution image. Only thin strips along the longest line segments of each
+# candidate are sampled, so the cost does not depend on the image size.
+# Parameters:
+#   image: the full-resolution image (3-channel), or an image source
+#   lineListByLength, lengths: output of coarseLineAnalysis(); the 'angle' of
+#   each refined candidate is updated in place
+#   coarseSize: must match the value given to coarseLineAnalysis()
+#   candidateCount: number of top candidates to refine
+#   segmentCount: number of line segments per candidate used for refinement
+#   mergeTolerance: candidates whose refined angles are closer than this, in
+#   degrees, are merged together
+#   progress: optional function(fraction, message) called before each
+#   candidate is refined
+def refineCandidateAngles(image, lineListByLength, lengths, coarseSize=1000, candidateCount=5, segmentCount=20, mergeTolerance=0.05, progress=None):
+    (rows, cols) = image.shape[:2]
+    coarseScale = min(1.0, coarseSize / max(rows, cols))
+
+    # pyramid levels, each 4 times the resolution of the one before it
+    levels = []
+    scale = coarseScale
+    while scale < 1.0:
+        scale = min(1.0, scale * 4)
+        levels.append(scale)
+    if not levels:
+        levels = [1.0]
+
+    for (candidateIndex, length) in enumerate(lengths[:candidateCount]):
+        if progress:
+            progress(candidateIndex / candidateCount, 'refining candidate angle %d...' % (candidateIndex+1))
+        candidate = lineListByLength[length]
+        lines = candidate['lines'].astype(np.float64)
+        segmentLengths = np.hypot(lines[:, 2] - lines[:, 0], lines[:, 3] - lines[:, 1])
+        segments = list(lines[np.argsort(-segmentLengths)[:segmentCount]])
+
+        previousScale = coarseScale
+        for scale in levels:
+            # the position of a segment is only known to within a couple of
+            # pixels at the previous level
+            band = int(np.ceil(2 * scale / previousScale)) + 2
+            with tracing.span('refineSegments', scale=scale):
+                for i in range(len(segments)):
+                    if segments[i] is None:
+                        continue
+                    segments[i] = refineSegment(image, segments[i], scale, band)
+            previousScale = scale
+
+        # the refined angle is the length-weighted mean of the refined
+        # segment angles, measured relative to the coarse angle so that
+        # segments on either side of vertical average correctly
+        segments = np.array([segment for segment in segments if segment is not None])
+        if len(segments) == 0:
+            continue
+        dx = segments[:, 2] - segments[:, 0]
+        dy = segments[:, 3] - segments[:, 1]
+        deltas = foldAngles(np.degrees(np.arctan2(dy, dx)) - candidate['angle'])
+        weights = np.hypot(dx, dy)
+        candidate['angle'] = round(float(candidate['angle'] + np.average(deltas, weights=weights)), 4)
+
+    # neighboring coarse bins often refine to the same angle; merge those
+    # into the higher ranked candidate
+    merged = []
+    for length in lengths:
+        candidate = lineListByLength[length]
+        for (i, (mergedLength, mergedCandidate)) in enumerate(merged[:candidateCount]):
+            if abs(foldAngles(np.array([candidate['angle'] - mergedCandidate['angle']]))[0]) < mergeTolerance:
+                mergedCandidate = { 'lines': np.concatenate([mergedCandidate['lines'], candidate['lines']]), 'angle': mergedCandidate['angle'] }
+                merged[i] = (mergedLength + length, mergedCandidate)
+                break
+        else:
+            merged.append((length, candidate))
+    lineListByLength.clear()
+    lineListByLength.update(merged)
+    lengths[:] = sorted(lineListByLength.keys(), reverse=True)
+
+
+# Multi-resolution straight line analysis: find candidate angles on a small
+# copy of the image, then refine the top candidates at higher resolutions.
+# Parameters and return value are the same as coarseLineAnalysis()
+def pyramidLineAnalysis(image, binSize=1.0, coarseSize=1000, candidateCount=5):
+    (edges, lineListByLength, lengths) = coarseLineAnalysis(image, binSize, coarseSize)
+    refineCandidateAngles(image, lineListByLength, lengths, coarseSize, candidateCount)
+    return (edges, lineListByLength, lengths)
+
+
+# Find the circles in an image.
+# Parameters:
+#   image: the image to be analyzed
+#   houghAnalysisSize: the pixel size to resize the image down to before
+#   analysis
+# Returns a list of (X Y R) tuples defining circles, sorted in descending
+#   order by radius
+def findCircles(image, houghAnalysisSize=400):
+    # set up an image for analysis
+    (primeRows, primeCols, _) = image.shape
+    circleScaleFactor = min(primeRows, primeCols) / houghAnalysisSize
+    analyzerWidth = int(primeCols / circleScaleFactor)
+    analyzerHeight = int(primeRows / circleScaleFactor)
+    analyzerImage = cv.resize(image, (analyzerWidth, analyzerHeight))
+    (_, analyzerImage) = cv.threshold(analyzerImage, 60, 255, cv.THRESH_BINARY)
+    analyzerImageGray = cv.cvtColor(analyzerImage, cv.COLOR_BGR2GRAY)
+
+    # find the circles
+    with tracing.span('HoughCircles', size=analyzerImageGray.shape):
+        circlesPrime = cv.HoughCircles(analyzerImageGray, cv.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=0, maxRadius=int(houghAnalysisSize/2))
+    if circlesPrime is None:
+        return []
+
+    # qualify the discovered circles: no circles that go outside the box
+    circles = []
+    for circle in circlesPrime[0]:
+        (centerX, centerY, radius) = circle
+        if centerX - radius > 0 and \
+           centerY - radius > 0 and \
+           centerX + radius < analyzerWidth and \
+           centerY + radius < analyzerHeight:
+
+            # scale the parameters before appending
+            circle = (int(centerX * circleScaleFactor), int(centerY * circleScaleFactor), int(radius * circleScaleFactor))
+            circles.append(circle)
+
+    # sort descending by radius
+    circles = sorted(circles, key=lambda x: x[2])
+    circles.reverse()
+    return circles
+
+
+# Fit a circle to a set of points by linear least squares (the Kasa fit).
+# Returns (centerX, centerY, radius), or None for degenerate points
+def fitCircle(points):
+    (x, y) = (points[:, 0], points[:, 1])
+    A = np.column_stack([x, y, np.ones_like(x)])
+    ((D, E, F), _, rank, _) = np.linalg.lstsq(A, -(x * x + y * y), rcond=None)
+    if rank < 3:
+        return None
+    (centerX, centerY) = (-D / 2, -E / 2)
+    squaredRadius = centerX * centerX + centerY * centerY - F
+    if squaredRadius <= 0:
+        return None
+    return (centerX, centerY, np.sqrt(squaredRadius))
+
+
+# Find the rim of a circle to sub-pixel precision at the resolution of an
+# image. Short strips straddling the estimated rim are sampled all the way
+# around it, each one a single affine warp of the unrotated image; the
+# strongest edge across each column of a strip is located to sub-pixel
+# precision. Only the strips are read, so the cost grows with the
+# circumference of the circle rather than with the area of the image.
+# Parameters:
+#   image: the unrotated image (3-channel), or an image source
+#   angle: rotation angle in degrees; the circle is in the coordinates of the
+#   image rotated by this angle, like the crop candidates
+#   circle: (centerX, centerY, radius) estimate
+#   band: half-width of the strips, in pixels; the rim is expected within
+#   this distance of the estimate
+#   stripLength: length of each strip along the rim, in pixels
+# Returns an Nx2 array of rim points, in rotated image coordinates
+def sampleCircleRim(image, angle, circle, band, stripLength=32):
+    (rows, cols) = image.shape[:2]
+    (centerX, centerY, radius) = [float(v) for v in circle]
+    stripWidth = 2 * band + 1
+    stripCount = max(16, int(2 * np.pi * radius / stripLength))
+
+    # rotated image coordinates -> unrotated image coordinates
+    inverse = cv.invertAffineTransform(cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1))
+
+    strips = []
+    frames = []
+    for theta in np.linspace(0, 2 * np.pi, stripCount, endpoint=False):
+        # strip coordinates (u, v) run along the tangent (t) and the normal
+        # (n) of the rim
+        (nX, nY) = (np.cos(theta), np.sin(theta))
+        (tX, tY) = (-nY, nX)
+        originX = centerX + (radius - band) * nX - stripLength / 2 * tX
+        originY = centerY + (radius - band) * nY - stripLength / 2 * tY
+        stripToRotated = np.array([[tX, nX, originX], [tY, nY, originY]])
+        M = inverse[:, :2] @ stripToRotated
+        M[:, 2] += inverse[:, 2]
+        strip = imagesource.warpAffine(image, M, (stripLength, stripWidth), flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP, borderMode=cv.BORDER_REPLICATE)
+        if strip.ndim == 3:
+            strip = cv.cvtColor(strip, cv.COLOR_BGR2GRAY)
+        strips.append(strip)
+        frames.append(stripToRotated)
+
+    # the strips are stacked so that the gradients and the peaks are found
+    # for all of them at once
+    stack = np.concatenate(strips, axis=1)
+    stack = cv.GaussianBlur(stack, (3, 3), 0)
+    gradient = np.abs(cv.Sobel(stack, cv.CV_32F, 0, 1, ksize=3))[1:-1]
+    peaks = np.argmax(gradient, axis=0)
+    columns = np.arange(gradient.shape[1])
+    strength = gradient[peaks, columns]
+    inner = (peaks > 0) & (peaks < gradient.shape[0] - 1) & (strength > 20)
+    (peaks, columns) = (peaks[inner], columns[inner])
+    before = gradient[peaks - 1, columns]
+    at = gradient[peaks, columns]
+    after = gradient[peaks + 1, columns]
+    denominator = before - 2 * at + after
+    offsets = np.where(denominator != 0, 0.5 * (before - after) / np.where(denominator != 0, denominator, 1), 0)
+    v = peaks + 1 + offsets
+
+    # map the edge positions back into rotated image coordinates
+    frames = np.array(frames)[columns // stripLength]
+    u = (columns % stripLength).astype(np.float64)
+    x = frames[:, 0, 0] * u + frames[:, 0, 1] * v + frames[:, 0, 2]
+    y = frames[:, 1, 0] * u + frames[:, 1, 1] * v + frames[:, 1, 2]
+    return np.column_stack([x, y])
+
+
+# Refine a circle candidate to sub-pixel accuracy against an image at full
+# resolution: the rim is sampled in a band as wide as the uncertainty of the
+# estimate, a circle is fitted to the rim points without the outliers, and
+# the rim is sampled again in a narrow band around the fitted circle.
+# Parameters:
+#   image: the unrotated full-resolution image (3-channel), or an image source
+#   angle: rotation angle in degrees, see sampleCircleRim()
+#   circle: (centerX, centerY, radius) estimate
+#   band: half-width of the band searched first, in pixels
+#   minSupport: the fraction of the rim that must be found for the fit to
+#   be trusted
+# Returns the refined (centerX, centerY, radius) as floats, or None if the
+#   rim was not found clearly enough
+def refineCircle(image, angle, circle, band, minSupport=0.5):
+    estimate = circle
+    for passBand in [int(band), 3]:
+        with tracing.span('refineCircle', band=passBand):
+            points = sampleCircleRim(image, angle, estimate, passBand)
+        if len(points) < 16:
+            return None
+
+        # fit, then refit without the points off the rim, e.g. where a label
+        # edge or a scratch was stronger than the rim
+        fitted = fitCircle(points)
+        if fitted is None:
+            return None
+        for tolerance in [max(2.0, passBand / 4), 1.0]:
+            distances = np.abs(np.hypot(points[:, 0] - fitted[0], points[:, 1] - fitted[1]) - fitted[2])
+            points = points[distances < tolerance]
+            if len(points) < 16:
+                return None
+            fitted = fitCircle(points)
+            if fitted is None:
+                return None
+        estimate = fitted
+
+    # the rim must have been found along enough of the circumference
+    if len(points) < minSupport * 2 * np.pi * estimate[2]:
+        return None
+    return tuple(round(float(v), 2) for v in estimate)
+
+
+# The band a circle candidate from findCircles() is searched in by
+# refineCircle(): the Hough estimate is off by up to a few pixels of the
+# reduced image it was found in, each of which covers several full-resolution
+# pixels.
+# Parameters:
+#   imageSize: (width, height) of the image the candidates were found in
+#   scale: factor mapping that image's coordinates to full resolution
+#   houghAnalysisSize: see findCircles()
+# Returns the half-width of the band in full-resolution pixels
+def circleRefinementBand(imageSize, scale, houghAnalysisSize=400):
+    return int(np.ceil(4 * scale * min(imageSize) / houghAnalysisSize)) + 2
+
+
+# Find the rectangles in an image: the outlines that fill most of their
+# minimum-area bounding rectangle, such as booklets and inlays on the white
+# scanner lid. The outlines are filtered on arrays of their areas and of
+# their fitted rectangles rather than point by point, and the fitted
+# rectangle of each one gives an estimate of its skew along with its box.
+# Parameters:
+#   image: the image to be analyzed
+#   houghAnalysisSize: the pixel size to resize the image down to before
+#   analysis
+#   minArea: the smallest rectangle, as a fraction of the area of the image
+#   minFill: the fraction of its fitted rectangle that an outline must fill
+# Returns a list of (minX minY maxX maxY area skew width height) tuples
+#   defining rectangles, sorted in descending order by area. The box bounds
+#   the rectangle in the image; skew is the further rotation angle, in
+#   degrees, that would straighten the rectangle, and width and height are
+#   the sides of the rectangle once it is straightened, see straightenRect().
+def findRects(image, houghAnalysisSize=600, minArea=0.005, minFill=0.9):
+    # set up an image for analysis
+    (primeRows, primeCols, _) = image.shape
+    rectScaleFactor = min(primeRows, primeCols) / houghAnalysisSize
+    analyzerWidth = int(primeCols / rectScaleFactor)
+    analyzerHeight = int(primeRows / rectScaleFactor)
+
+    analyzerImage = cv.resize(image, (analyzerWidth, analyzerHeight))
+    analyzerImageGray = cv.cvtColor(analyzerImage, cv.COLOR_BGR2GRAY)
+    # the scanner lid is white; invert so that the scanned items are foreground
+    _, analyzerImage = cv.threshold(analyzerImageGray, 240, 255, cv.THRESH_BINARY_INV)
+
+    with tracing.span('findContours', size=analyzerImage.shape):
+        contours, _ = cv.findContours(analyzerImage, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+
+    # most of the outlines are specks and letters; they are dropped by their
+    # bounding boxes before anything is fitted to them
+    if len(contours) == 0:
+        return []
+    minPixels = minArea * analyzerWidth * analyzerHeight
+    boxes = np.array([cv.boundingRect(contour) for contour in contours], dtype=np.float64).reshape(-1, 4)
+    candidates = np.flatnonzero(boxes[:, 2] * boxes[:, 3] >= minPixels)
+    if len(candidates) == 0:
+        return []
+
+    # fit a rectangle to each remaining outline and keep the ones that fill it
+    areas = np.array([cv.contourArea(contours[i]) for i in candidates])
+    fitted = [cv.minAreaRect(contours[i]) for i in candidates]
+    corners = np.array([cv.boxPoints(rect) for rect in fitted], dtype=np.float64)
+    sides = np.hypot(*np.moveaxis(corners[:, 1:3] - corners[:, 0:2], 2, 0))
+    fittedAreas = sides[:, 0] * sides[:, 1]
+    keep = (areas >= minPixels) & (areas >= minFill * fittedAreas)
+    if not keep.any():
+        return []
+    corners = corners[keep]
+    fittedAreas = fittedAreas[keep]
+
+    # the skew is the angle of the first side, folded into [-45, 45) since
+    # any of the sides may come first
+    (dx, dy) = (corners[:, 1, 0] - corners[:, 0, 0], corners[:, 1, 1] - corners[:, 0, 1])
+    firstAngles = np.degrees(np.arctan2(dy, dx))
+    skews = np.mod(firstAngles + 45, 90) - 45
+
+    # the width is the side that turns horizontal when the rectangle is
+    # straightened; that is the first side unless it is closer to vertical
+    sides = sides[keep] * rectScaleFactor
+    vertical = np.abs(foldAngles(firstAngles)) > 45
+    sides[vertical] = sides[vertical][:, ::-1]
+
+    # sort descending by rectangle area
+    order = np.argsort(-fittedAreas, kind='stable')
+    mins = np.floor(corners.min(axis=1) * rectScaleFactor)
+    maxs = np.ceil(corners.max(axis=1) * rectScaleFactor)
+    return [(int(mins[i, 0]), int(mins[i, 1]), int(maxs[i, 0]), int(maxs[i, 1]),
+        int(fittedAreas[i] * rectScaleFactor * rectScaleFactor), round(float(skews[i]), 3),
+        int(round(sides[i, 0])), int(round(sides[i, 1]))) for i in order]
+
+
+# Straighten a rectangle found by findRects(): rotating the image by the
+# rectangle's skew, on top of the angle it was found at, makes its sides
+# parallel to the image's.
+# Parameters:
+#   rect: (minX, minY, maxX, maxY, area, skew, width, height), see
+#   findRects()
+#   imageSize: (width, height) of the image the rectangle's coordinates are
+#   in; the rotations are about its center
+# Returns a tuple of (skew, (minX, minY, maxX, maxY)): the further rotation
+#   angle and the box of the rectangle in the image rotated by it
+def straightenRect(rect, imageSize):
+    (minX, minY, maxX, maxY, _, skew, width, height) = rect
+    (imageWidth, imageHeight) = imageSize
+    M = cv.getRotationMatrix2D(((imageWidth-1)/2.0, (imageHeight-1)/2.0), skew, 1)
+    (centerX, centerY) = M[:, :2] @ np.array([(minX + maxX) / 2.0, (minY + maxY) / 2.0]) + M[:, 2]
+    box = (int(np.floor(centerX - width / 2)), int(np.floor(centerY - height / 2)),
+        int(np.ceil(centerX + width / 2)), int(np.ceil(centerY + height / 2)))
+    return (skew, box)
+
+
+# Find the circle and rectangle crop candidates of an image at a rotation
+# angle. Only a small analysis-size copy of the image is rotated; the
+# detectors reduce their input to their analysis size anyway. The two
+# detectors run at the same time in a pair of threads; OpenCV releases the
+# GIL while it works.
+# Parameters:
+#   analysisImage: a reduced-resolution copy of the unrotated image, at least
+#   as large as the analysis sizes in its smaller dimension
+#   angle: rotation angle in degrees
+#   scale: factor mapping analysisImage coordinates to the coordinates of
+#   the full-resolution image
+#   circleAnalysisSize, rectAnalysisSize: see findCircles() and findRects()
+# Returns a tuple of (circles, rects) as returned by findCircles() and
+#   findRects(), in the coordinates of the rotated full-resolution image
+def findCropCandidates(analysisImage, angle, scale, circleAnalysisSize=400, rectAnalysisSize=600):
+    (rows, cols) = analysisImage.shape[:2]
+    M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
+    with tracing.span('warpAffine', size=(rows, cols)):
+        rotatedImage = cv.warpAffine(analysisImage, M, (cols, rows))
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        circlesFuture = executor.submit(findCircles, rotatedImage, circleAnalysisSize)
+        rectsFuture = executor.submit(findRects, rotatedImage, rectAnalysisSize)
+        circles = [(int(centerX * scale), int(centerY * scale), int(radius * scale))
+            for (centerX, centerY, radius) in circlesFuture.result()]
+        rects = [(int(minX * scale), int(minY * scale), int(maxX * scale), int(maxY * scale), int(area * scale * scale), skew,
+            int(width * scale), int(height * scale)) for (minX, minY, maxX, maxY, area, skew, width, height) in rectsFuture.result()]
+    return (circles, rects)
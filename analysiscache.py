@@ -0,0 +1,210 @@
+import functools
+import hashlib
+import io
+import numpy as np
+import os
+import sys
+import tempfile
+import zipfile
+import zlib
+
+
+# The analysis cache keeps the results of the straight line and crop
+# candidate analyses on disk, so reopening a scan that was already analyzed
+# skips the Canny/Hough passes. Entries are keyed by a hash of the file
+# contents together with the analysis parameters, so a file that was moved or
+# renamed still hits and a file that was edited misses. Each entry is one .npz
+# file; the least recently used entries are deleted once the cache grows past
+# its size limit.
+#
+# Set the MOBYCAIRO_CACHE_DIR environment variable to move the cache, or to an
+# empty string to turn it off.
+
+
+# The default location of the cache directory, or None if caching is off
+def defaultDirectory():
+    directory = os.environ.get('MOBYCAIRO_CACHE_DIR')
+    if directory is not None:
+        return directory or None
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'MobyCAIRO')
+
+
+@functools.lru_cache(maxsize=64)
+def hashFileContents(filename, size, modificationTime):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Compute the hash of a file's contents. The hash is remembered for the rest
+# of the session as long as the file's size and modification time stay the
+# same.
+def fileHash(filename):
+    stat = os.stat(filename)
+    return hashFileContents(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+# Convert the output of the straight line analysis to and from a dictionary of
+# arrays for storage; see analysis.binLineSegments() for the format
+def packLines(edges, lineListByLength, lengths):
+    candidates = [lineListByLength[length] for length in lengths]
+    return {
+        'edges': edges,
+        'lengths': np.array(lengths, dtype=np.float64),
+        'angles': np.array([candidate['angle'] for candidate in candidates], dtype=np.float64),
+        'counts': np.array([len(candidate['lines']) for candidate in candidates], dtype=np.int64),
+        'lines': np.concatenate([candidate['lines'] for candidate in candidates]).astype(np.int32) if candidates else np.zeros((0, 4), np.int32),
+    }
+
+
+def unpackLines(arrays):
+    lengths = [float(length) for length in arrays['lengths']]
+    groups = np.split(arrays['lines'], np.cumsum(arrays['counts'])[:-1]) if lengths else []
+    lineListByLength = {}
+    for (length, angle, lines) in zip(lengths, arrays['angles'], groups):
+        lineListByLength[length] = { 'lines': lines, 'angle': float(angle) }
+    return (arrays['edges'], lineListByLength, lengths)
+
+
+# Convert crop candidates, as returned by analysis.findCropCandidates(), to and
+# from a dictionary of arrays for storage; the skews of the rectangles are
+# kept apart from their integer boxes and sides. Entries written before the
+# skews were recorded read back as unskewed rectangles filling their boxes.
+def packCropCandidates(circles, rects):
+    return {
+        'circles': np.array(circles, dtype=np.int64).reshape(-1, 3),
+        'rects': np.array([rect[:5] for rect in rects], dtype=np.int64).reshape(-1, 5),
+        'rectSkews': np.array([rect[5] for rect in rects], dtype=np.float64),
+        'rectSides': np.array([rect[6:8] for rect in rects], dtype=np.int64).reshape(-1, 2),
+    }
+
+
+def unpackCropCandidates(arrays):
+    circles = [tuple(int(v) for v in circle) for circle in arrays['circles']]
+    boxes = arrays['rects']
+    skews = arrays.get('rectSkews', np.zeros(len(boxes)))
+    sides = arrays.get('rectSides', np.column_stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]]))
+    rects = [tuple(int(v) for v in box) + (float(skew),) + tuple(int(v) for v in side) for (box, skew, side) in zip(boxes, skews, sides)]
+    return (circles, rects)
+
+
+# Convert circles refined by analysis.refineCircle() to and from a dictionary
+# of arrays for storage; a circle whose rim was not found is stored as NaNs
+def packRefinedCircles(circles):
+    circles = [circle if circle is not None else (np.nan, np.nan, np.nan) for circle in circles]
+    return { 'circles': np.array(circles, dtype=np.float64).reshape(-1, 3) }
+
+
+def unpackRefinedCircles(arrays):
+    return [None if np.isnan(circle).any() else tuple(float(v) for v in circle) for circle in arrays['circles']]
+
+
+class AnalysisCache:
+
+    # Parameters:
+    #   directory: where to keep the cache files; None turns caching off
+    #   maxBytes: the least recently used entries are deleted to keep the
+    #   cache under this size
+    def __init__(self, directory=None, maxBytes=256*1024*1024):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+
+
+    # Compute the filename of an entry.
+    # Parameters:
+    #   contentHash: hash of the image file, see fileHash()
+    #   kind: name of the analysis, e.g. 'lines'
+    #   parameters: tuple of the analysis parameters; its repr() is hashed
+    def entryFilename(self, contentHash, kind, parameters):
+        digest = hashlib.blake2b(repr((kind, parameters)).encode('utf-8'), digest_size=10).hexdigest()
+        return os.path.join(self.directory, '%s-%s-%s.npz' % (contentHash, kind, digest))
+
+
+    # Look up an entry.
+    # Returns a dictionary of arrays, or None on a miss
+    def get(self, contentHash, kind, parameters):
+        if self.directory is None or contentHash is None:
+            return None
+        filename = self.entryFilename(contentHash, kind, parameters)
+        try:
+            with np.load(filename, allow_pickle=False) as entry:
+                arrays = { name: entry[name] for name in entry.files }
+            # mark the entry as recently used
+            os.utime(filename)
+        except (zipfile.BadZipFile, EOFError, zlib.error, ValueError):
+            # a truncated or corrupt entry is removed, so it is recomputed
+            self.misses += 1
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return None
+        except (OSError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+
+    # Store an entry, then evict the least recently used entries if the cache
+    # is over its size limit. Failing to write to the cache is not an error.
+    # Parameters:
+    #   contentHash, kind, parameters: see entryFilename()
+    #   arrays: dictionary of arrays to store
+    def put(self, contentHash, kind, parameters, arrays):
+        if self.directory is None or contentHash is None:
+            return
+        filename = self.entryFilename(contentHash, kind, parameters)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            # write to a temporary file first, so that readers never see a
+            # partially written entry
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **arrays)
+            (handle, temporaryFilename) = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            with os.fdopen(handle, 'wb') as f:
+                f.write(buffer.getvalue())
+            os.replace(temporaryFilename, filename)
+            self.evict()
+        except OSError as e:
+            print('could not write to the analysis cache: %s' % (str(e)))
+
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum([size for (_, size, _) in entries])
+        for (_, size, name) in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+                total -= size
+            except OSError:
+                pass
+
+
+    def __str__(self):
+        return 'analysis cache: %d hits, %d misses' % (self.hits, self.misses)
+
+
+# The cache shared by the whole program
+defaultCache = AnalysisCache(defaultDirectory())
@@ -0,0 +1,306 @@
+import argparse
+import cv2 as cv
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import analysis
+import analysiscache
+import confidence
+import export
+import imagesource
+import items
+import loader
+import recipe
+import rotation
+
+
+imageExtensions = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp']
+
+# largest dimension of the reduced image that circles and rectangles are
+# detected on
+detectionSize = 1200
+
+# largest dimension of the reduced image that all of the items of a scan are
+# found on; the skew of each item is measured on it as well
+itemDetectionSize = 2000
+
+# a rectangle skewed further than this from the angle of the straight lines
+# is not taken to correct the angle; the lines and the rectangle disagree,
+# e.g. about a sticker on the item
+maxRectSkew = 2.0
+
+
+# Expand the input argument into a sorted list of image filenames; the input
+# may either be a directory or a glob pattern
+def findInputFiles(inputSpec):
+    if os.path.isdir(inputSpec):
+        filenames = [os.path.join(inputSpec, f) for f in os.listdir(inputSpec)]
+        filenames = [f for f in filenames if os.path.splitext(f)[1].lower() in imageExtensions]
+    else:
+        filenames = glob.glob(inputSpec)
+    return sorted([f for f in filenames if os.path.isfile(f)])
+
+
+# Compute the output filename for an input file
+def outputFilenameFor(inputFilename, outputDir, outputFormat):
+    (base, ext) = os.path.splitext(os.path.basename(inputFilename))
+    if outputFormat:
+        ext = '.' + outputFormat.lstrip('.')
+    return os.path.join(outputDir, base + ext)
+
+
+# Each worker process runs single-threaded OpenCV; the pool provides the
+# parallelism and this keeps the workers from fighting over the cores
+def initWorker():
+    cv.setNumThreads(1)
+
+
+# Rotate and crop a single image without any user interaction. This function
+# runs in a worker process.
+# Parameters:
+#   job: tuple of (input filename, output filename, circle, multiResolution,
+#   allItems, itemWorkers, minConfidence); circle is True to crop the largest
+#   circle, False to crop the largest rectangle; multiResolution selects the
+#   coarse-to-fine angle analysis; allItems exports every item on the scan
+#   instead, using itemWorkers threads, see processItems(); scans whose
+#   confidence score is below minConfidence are not saved but left for
+#   review, see confidence.py
+# Returns a dictionary summarizing the outcome for the file
+def processFile(job):
+    (inputFilename, outputFilename, circle, multiResolution, allItems, itemWorkers, minConfidence) = job
+    if allItems:
+        return processItems(inputFilename, outputFilename, itemWorkers)
+    summary = { 'input': inputFilename, 'output': outputFilename, 'status': 'ok', 'angle': None, 'crop': None, 'size': None, 'confidence': None }
+    startTime = time.time()
+
+    if os.path.exists(outputFilename):
+        summary['status'] = 'skipped: output already exists'
+        summary['time'] = time.time() - startTime
+        return summary
+
+    # uncompressed files are memory mapped rather than decoded; only the
+    # regions that are analyzed and exported are read
+    imagePrime = loader.openFull(inputFilename)
+    if imagePrime is None:
+        summary['status'] = 'failed: could not read image'
+        summary['time'] = time.time() - startTime
+        return summary
+    summary['size'] = (imagePrime.shape[1], imagePrime.shape[0])
+
+    # pick the angle with the most line segment length represented
+    if multiResolution:
+        (_, lineListByLength, lengths) = analysis.pyramidLineAnalysis(imagePrime)
+    else:
+        (_, lineListByLength, lengths) = analysis.straightLineAnalysis(imagesource.asArray(imagePrime))
+    if len(lengths) == 0:
+        summary['status'] = 'failed: no straight lines found'
+        summary['time'] = time.time() - startTime
+        return summary
+    # the lines of the top bin may be the vertical edges of the item; either
+    # way, the scan is only straightened, never turned on its side
+    angle = float(items.foldSkewAngles([lineListByLength[lengths[0]]['angle']])[0])
+    summary['angle'] = angle
+    angleConfidence = confidence.angleConfidence(lineListByLength, lengths, (imagePrime.shape[1], imagePrime.shape[0]))
+
+    # the crop is detected on a reduced, rotated copy of the image; the
+    # full-resolution image is only rotated within the final crop region
+    detectionScaler = max(1.0, max(imagePrime.shape[:2]) / detectionSize)
+    detectionImage = imagesource.resize(imagePrime, (int(imagePrime.shape[1] / detectionScaler), int(imagePrime.shape[0] / detectionScaler)))
+    detectionImage = rotation.rotateImage(detectionImage, angle)
+    detectionEdges = confidence.outlineEdges(detectionImage)
+
+    # crop the most likely candidate
+    if circle:
+        circles = analysis.findCircles(detectionImage)
+        if len(circles) == 0:
+            summary['status'] = 'failed: no circles found'
+            summary['time'] = time.time() - startTime
+            return summary
+        cropConfidence = confidence.circleConfidence(detectionEdges, circles)
+        (centerX, centerY, radius) = [int(v * detectionScaler) for v in circles[0]]
+
+        # the circle was found on a reduced image; its rim is located again
+        # at full resolution, which only reads the pixels around the rim
+        band = analysis.circleRefinementBand((detectionImage.shape[1], detectionImage.shape[0]), detectionScaler)
+        refined = analysis.refineCircle(imagePrime, angle, (centerX, centerY, radius), band)
+        if refined is not None:
+            (centerX, centerY, radius) = refined
+        summary['crop'] = 'circle (%0.2f, %0.2f), %0.2f' % (centerX, centerY, radius)
+        croppedImage = export.exportCircle(imagePrime, angle, centerX, centerY, radius)
+        crop = recipe.circleCrop(centerX, centerY, radius)
+    else:
+        rects = analysis.findRects(detectionImage)
+        if len(rects) == 0:
+            summary['status'] = 'failed: no rectangles found'
+            summary['time'] = time.time() - startTime
+            return summary
+        cropConfidence = confidence.rectangleConfidence(detectionEdges, rects)
+        (minX, minY, maxX, maxY) = [int(v * detectionScaler) for v in rects[0][:4]]
+
+        # the line angles come in whole bins; the skew of the rectangle
+        # refines the angle, and the crop is moved into the image rotated by
+        # the refined angle
+        if abs(rects[0][5]) <= maxRectSkew:
+            (area, skew, width, height) = rects[0][4:]
+            rect = (minX, minY, maxX, maxY, area * detectionScaler * detectionScaler, skew, width * detectionScaler, height * detectionScaler)
+            (skew, (minX, minY, maxX, maxY)) = analysis.straightenRect(rect, summary['size'])
+            angle = round(angle + skew, 3)
+            summary['angle'] = angle
+        summary['crop'] = 'rectangle (%d, %d) -> (%d, %d)' % (minX, minY, maxX, maxY)
+        croppedImage = export.exportRectangle(imagePrime, angle, minX, minY, maxX, maxY)
+        crop = recipe.rectangleCrop(minX, minY, maxX, maxY)
+
+    # the scan is only saved without review when both choices are clear
+    summary['confidence'] = min(angleConfidence['score'], cropConfidence['score'])
+    if minConfidence is not None and summary['confidence'] < minConfidence:
+        summary['status'] = 'review: angle %s, crop %s' % (confidence.describe(angleConfidence), confidence.describe(cropConfidence))
+        summary['time'] = time.time() - startTime
+        return summary
+
+    try:
+        if not cv.imwrite(outputFilename, croppedImage):
+            summary['status'] = 'failed: could not write output'
+    except cv.error as e:
+        summary['status'] = 'failed: %s' % (str(e).strip())
+
+    # save the edit alongside the image; see replay.py
+    if summary['status'] == 'ok':
+        recipe.writeRecipe(outputFilename, recipe.makeRecipe(inputFilename, analysiscache.fileHash(inputFilename), angle, crop, outputFilename))
+
+    summary['time'] = time.time() - startTime
+    return summary
+
+
+# Describe an exception raised while processing a file, for its summary
+def describeError(e):
+    message = str(e).strip()
+    return '%s: %s' % (type(e).__name__, message) if message else type(e).__name__
+
+
+# Run processFile() on one job and turn any exception into a failed summary,
+# so that one bad file does not abort the whole batch
+def tryProcessFile(job):
+    startTime = time.time()
+    try:
+        return processFile(job)
+    except Exception as e:
+        (inputFilename, outputFilename) = job[:2]
+        return { 'input': inputFilename, 'output': outputFilename, 'status': 'failed: %s' % (describeError(e)),
+            'angle': None, 'crop': None, 'size': None, 'confidence': None, 'time': time.time() - startTime }
+
+
+# Find every item on a scan, each with its own skew angle, and save them all
+# next to the output filename (see items.itemFilenameFor()). The scan is only
+# opened and analyzed once for all of the items. This function runs in a
+# worker process.
+# Returns a dictionary summarizing the outcome for the file
+def processItems(inputFilename, outputFilename, itemWorkers):
+    summary = { 'input': inputFilename, 'output': outputFilename, 'status': 'ok', 'angle': None, 'crop': None, 'size': None }
+    startTime = time.time()
+
+    imagePrime = loader.openFull(inputFilename)
+    if imagePrime is None:
+        summary['status'] = 'failed: could not read image'
+        summary['time'] = time.time() - startTime
+        return summary
+    summary['size'] = (imagePrime.shape[1], imagePrime.shape[0])
+
+    detectionScaler = max(1.0, max(imagePrime.shape[:2]) / itemDetectionSize)
+    detectionImage = imagesource.resize(imagePrime, (int(imagePrime.shape[1] / detectionScaler), int(imagePrime.shape[0] / detectionScaler)))
+    foundItems = items.findItems(detectionImage, detectionScaler, (imagePrime.shape[1], imagePrime.shape[0]))
+    if len(foundItems) == 0:
+        summary['status'] = 'failed: no items found'
+        summary['time'] = time.time() - startTime
+        return summary
+    summary['crop'] = '%d items: %s' % (len(foundItems), '; '.join([items.describeItem(item) for item in foundItems]))
+
+    if any([os.path.exists(items.itemFilenameFor(outputFilename, i)) for i in range(len(foundItems))]):
+        summary['status'] = 'skipped: output already exists'
+        summary['time'] = time.time() - startTime
+        return summary
+
+    results = items.exportItems(imagePrime, foundItems, outputFilename, inputFilename, analysiscache.fileHash(inputFilename), itemWorkers)
+    errors = ['%s: %s' % (filename, error) for (filename, error) in results if error]
+    if errors:
+        summary['status'] = 'failed: ' + ', '.join(errors)
+
+    summary['time'] = time.time() - startTime
+    return summary
+
+
+def printSummary(summary):
+    line = '%s: %s' % (summary['input'], summary['status'])
+    if summary['size']:
+        line += ', %dx%d' % summary['size']
+    if summary['angle'] is not None:
+        line += ', %0.2f°' % (summary['angle'])
+    if summary['crop']:
+        line += ', ' + summary['crop']
+    if summary.get('confidence') is not None:
+        line += ', confidence %0.2f' % (summary['confidence'])
+    line += ', %0.2f sec' % (summary['time'])
+    print(line, flush=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Rotate and crop a batch of images without user interaction')
+    parser.add_argument('input', help='directory of images, or a glob pattern such as "scans/*.png"')
+    parser.add_argument('outputDir', help='directory where the processed images will be saved')
+    parser.add_argument('-r', '--rectangle', action='store_true', help='crop the largest rectangle instead of the largest circle')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: number of cores)')
+    parser.add_argument('-a', '--all-items', action='store_true', help='save every disc and rectangular item on each scan, each with its own skew angle')
+    parser.add_argument('-m', '--multires', action='store_true', help='find angles with the faster multi-resolution analysis, refined to 0.01 degree')
+    parser.add_argument('-c', '--confidence', type=float, default=None, help='only save the scans whose angle and crop confidence is at least this (0 to 1, e.g. 0.6); list the others for review')
+    parser.add_argument('--review-list', default=None, help='file listing the scans left for review (default: review.txt in the output directory)')
+    parser.add_argument('-f', '--format', default=None, help='output image format extension, e.g. "png" (default: same as the input)')
+    args = parser.parse_args(argv)
+    # the items of a scan are not scored, see processItems()
+    if args.all_items and args.confidence is not None:
+        parser.error('-c/--confidence cannot be combined with -a/--all-items')
+
+    inputFilenames = findInputFiles(args.input)
+    if not inputFilenames:
+        print("no input images found for '%s'" % (args.input))
+        return 1
+    if not os.path.isdir(args.outputDir):
+        os.makedirs(args.outputDir)
+
+    workers = max(1, min(args.workers, len(inputFilenames)))
+    # the cores not taken by worker processes export the items of a scan in
+    # parallel
+    itemWorkers = max(1, (os.cpu_count() or 1) // workers)
+    jobs = [(f, outputFilenameFor(f, args.outputDir, args.format), not args.rectangle, args.multires, args.all_items, itemWorkers, args.confidence) for f in inputFilenames]
+    print('processing %d images with %d worker processes...' % (len(jobs), workers))
+
+    startTime = time.time()
+    summaries = []
+    with multiprocessing.Pool(workers, initializer=initWorker) as pool:
+        for summary in pool.imap_unordered(tryProcessFile, jobs):
+            printSummary(summary)
+            summaries.append(summary)
+    elapsed = time.time() - startTime
+
+    succeeded = len([s for s in summaries if s['status'] == 'ok'])
+    skipped = len([s for s in summaries if s['status'].startswith('skipped')])
+    review = sorted([s for s in summaries if s['status'].startswith('review')], key=lambda s: s['input'])
+    failed = len(summaries) - succeeded - skipped - len(review)
+    print('=====================')
+    print('%d processed, %d skipped, %d failed in %0.2f sec (%0.2f images/sec)' %
+        (succeeded, skipped, failed, elapsed, len(summaries) / elapsed if elapsed > 0 else 0.0))
+
+    # the uncertain scans are listed for a person to finish
+    if args.confidence is not None:
+        reviewListFilename = args.review_list or os.path.join(args.outputDir, 'review.txt')
+        confidence.writeReviewList(reviewListFilename,
+            [(s['input'], s['confidence'], s['status'][len('review: '):]) for s in review])
+        print('%d left for review, listed in "%s"' % (len(review), reviewListFilename))
+
+    return 0 if failed == 0 else 2
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
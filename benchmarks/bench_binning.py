@@ -0,0 +1,88 @@
+# Benchmark the line segment binning used by the straight line analysis: the
+# original per-segment Python loop vs. the vectorized analysis.binLineSegments()
+#
+# usage: python benchmarks/bench_binning.py [segment count] [bin size]
+
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis
+
+
+# the binning loop as it was originally written, kept as a reference
+def binLineSegmentsLoop(lines):
+    lineList = {}
+    for line in lines[:]:
+        for (x1, y1, x2, y2) in line:
+            dx = x2 - x1
+            dy = y2 - y1
+            # special case for vertical line
+            if dx == 0:
+                theta = 90
+            else:
+                theta = round(np.arctan(dy/dx) * 180/np.pi)
+            if theta not in lineList:
+                lineList[theta] = { 'lines': set(), 'total': 0.0 }
+            lineList[theta]['lines'].add((x1, y1, x2, y2))
+            lineList[theta]['total'] += np.sqrt(np.square(dx) + np.square(dy))
+
+    lineListByLength = {}
+    for angle in lineList.keys():
+        lineItem = lineList[angle]
+        lineListByLength[lineItem['total']] = { 'lines': lineItem['lines'], 'angle': angle * 1.0 }
+    lengths = sorted(lineListByLength.keys())
+    lengths.reverse()
+    return (lineListByLength, lengths)
+
+
+# generate segments shaped like cv.HoughLinesP output; mostly near-horizontal
+# and near-vertical lines, like a slightly skewed page of text
+def makeSegments(count, skew=1.3, seed=1):
+    rng = np.random.default_rng(seed)
+    angles = np.radians(skew + rng.normal(0, 0.4, count) + 90 * rng.integers(0, 2, count))
+    lengths = rng.uniform(50, 400, count)
+    x1 = rng.uniform(0, 10000, count)
+    y1 = rng.uniform(0, 10000, count)
+    x2 = x1 + lengths * np.cos(angles)
+    y2 = y1 + lengths * np.sin(angles)
+    segments = np.stack([x1, y1, x2, y2], axis=1).astype(np.int32)
+    return segments.reshape(-1, 1, 4)
+
+
+def timeIt(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    binSize = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    lines = makeSegments(count)
+
+    (loopTime, (loopList, loopLengths)) = timeIt(lambda: binLineSegmentsLoop(lines))
+    (vectorTime, (vectorList, vectorLengths)) = timeIt(lambda: analysis.binLineSegments(lines))
+    (fineTime, (fineList, fineLengths)) = timeIt(lambda: analysis.binLineSegments(lines, binSize))
+
+    # the vectorized binning at 1 degree should pick the same angles as the loop
+    loopAngles = [loopList[length]['angle'] for length in loopLengths[:5]]
+    vectorAngles = [vectorList[length]['angle'] for length in vectorLengths[:5]]
+
+    print('%d segments' % (count))
+    print('  Python loop, 1° bins:         %8.2f ms' % (loopTime * 1000))
+    print('  vectorized, 1° bins:          %8.2f ms (%0.1fx faster)' % (vectorTime * 1000, loopTime / vectorTime))
+    print('  vectorized, %0.2f° bins:      %8.2f ms (%0.1fx faster)' % (binSize, fineTime * 1000, loopTime / fineTime))
+    print('  top angles, loop:       %s' % (loopAngles))
+    print('  top angles, vectorized: %s' % (vectorAngles))
+    print('  top angles, %0.2f° bins: %s' % (binSize, [fineList[length]['angle'] for length in fineLengths[:5]]))
+
+
+if __name__ == '__main__':
+    main()
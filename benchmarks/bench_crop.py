@@ -0,0 +1,70 @@
+# Benchmark the circle and rectangle crops: the original per-row copy loops
+# vs. the masked copy and zero-copy views in export.py
+#
+# usage: python benchmarks/bench_crop.py [disc diameter in pixels]
+
+import cv2 as cv
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import export
+
+
+# the crop loops as they were originally written, kept as a reference
+def cropCircleLoop(image, centerX, centerY, radius):
+    diameter = int(radius*2) + 1
+    croppedImage = np.zeros((diameter, diameter, 3), np.uint8)
+    cv.rectangle(croppedImage, (0, 0), (diameter, diameter), (255, 255, 255), thickness=-1)
+    croppedImage[radius][0:radius*2] = image[centerY][centerX-radius:centerX+radius]
+    for i in range(radius):
+        dx = int(np.sqrt(np.square(radius) - np.square(i)))
+        croppedImage[radius-i][radius-dx:radius+dx] = image[centerY-i][centerX-dx:centerX+dx]
+        croppedImage[radius+i][radius-dx:radius+dx] = image[centerY+i][centerX-dx:centerX+dx]
+    return croppedImage
+
+
+def cropRectangleLoop(image, topX, topY, bottomX, bottomY):
+    croppedImage = np.zeros((bottomY-topY, bottomX-topX, 3), np.uint8)
+    for i in range(topY, bottomY):
+        croppedImage[i-topY][:] = image[i][topX:bottomX]
+    return croppedImage
+
+
+def timeIt(function, repeat=3):
+    best = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, result)
+
+
+def main():
+    diameter = int(sys.argv[1]) if len(sys.argv) > 1 else 6000
+    radius = diameter // 2
+    size = diameter + 400
+    image = np.random.default_rng(1).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    center = size // 2
+
+    # the first masked crop also builds the cached mask
+    (maskTime, _) = timeIt(lambda: (export.circleMask.cache_clear(), export.cropCircle(image, center, center, radius)), repeat=1)
+    results = [
+        ('circle, per-row loop', timeIt(lambda: cropCircleLoop(image, center, center, radius))[0]),
+        ('circle, masked copy (cold mask)', maskTime),
+        ('circle, masked copy', timeIt(lambda: export.cropCircle(image, center, center, radius))[0]),
+        ('circle, masked copy + alpha', timeIt(lambda: export.cropCircle(image, center, center, radius, alpha=True))[0]),
+        ('rectangle, per-row loop', timeIt(lambda: cropRectangleLoop(image, 200, 200, size - 200, size - 200))[0]),
+        ('rectangle, view', timeIt(lambda: export.cropRectangle(image, 200, 200, size - 200, size - 200))[0]),
+    ]
+
+    print('%d pixel diameter disc in a %dx%d image' % (diameter, size, size))
+    for (name, elapsed) in results:
+        print('  %-34s %10.3f ms' % (name, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Benchmark the preview rendering pipeline: rotated frame cache, compositor
+# and frame sink, driven the way the GUI drives them while a crop circle or a
+# freeform rectangle is dragged across the preview. Without a display, the
+# frames go to an offscreen sink, which measures the composition and the
+# pixels copied per frame. With a display, the original conversion (a new
+# PIL image and a new Tk image every frame) is compared with the long-lived
+# Tk image of render.TkFrameSink.
+#
+# usage: python benchmarks/bench_render.py [frame width] [frame height] [frames]
+
+import cv2 as cv
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import render
+
+
+# the shapes drawn over the preview for each frame of a drag
+def circleDrag(width, height, frame):
+    radius = min(width, height) // 3
+    return [('circle', (width // 2 + frame % 50, height // 2), radius, (255, 0, 0), 1)]
+
+
+def rectangleDrag(width, height, frame):
+    return [('rectangle', (50, 50), (width // 4 + (frame * 7) % (width // 2), height // 4 + (frame * 5) % (height // 2)), (255, 0, 0), 1)]
+
+
+# Render a drag and return the seconds per frame
+def renderDrag(base, shapesFor, sink, frames):
+    (height, width) = base.shape[:2]
+    frameCache = render.RotatedFrameCache()
+    compositor = render.Compositor()
+    startTime = time.perf_counter()
+    for frame in range(frames):
+        compositor.setBase(('image', 1.25), lambda: frameCache.get('image', base, 1.25).copy())
+        scaledImage = compositor.drawTop(shapesFor(width, height, frame))
+        sink.present(scaledImage, compositor.changed)
+    return (time.perf_counter() - startTime) / frames
+
+
+# The original conversion: a new Tk image for every frame
+class NewPhotoImageSink:
+
+    def __init__(self, label):
+        self.label = label
+
+
+    def present(self, frame, regions=None):
+        from PIL import Image, ImageTk
+        image = ImageTk.PhotoImage(Image.fromarray(frame))
+        self.label.configure(image=image)
+        self.label.image = image
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 1600
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    frames = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    base = np.random.default_rng(1).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    base = cv.GaussianBlur(base, (9, 9), 0)
+    print('%dx%d frames, %d frames per drag' % (width, height, frames))
+
+    for (dragName, shapesFor) in [('circle', circleDrag), ('rectangle', rectangleDrag)]:
+        sink = render.OffscreenFrameSink()
+        elapsed = renderDrag(base, shapesFor, sink, frames)
+        print('%-9s offscreen:          %7.2f ms/frame, %5.1f%% of the frame copied per frame' %
+            (dragName, elapsed * 1000, 100.0 * sink.pixels / sink.frames / (width * height)))
+
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        print('no display, skipping the Tk sinks (%s)' % (str(e).strip()))
+        return
+
+    label = tk.Label(root)
+    label.pack()
+    canvas = tk.Canvas(root, borderwidth=0, highlightthickness=0)
+    canvas.pack()
+    for (dragName, shapesFor) in [('circle', circleDrag), ('rectangle', rectangleDrag)]:
+        for (sinkName, sink) in [('new PhotoImage', NewPhotoImageSink(label)), ('TkFrameSink', render.TkFrameSink(canvas))]:
+            elapsed = renderDrag(base, shapesFor, sink, frames)
+            root.update()
+            print('%-9s %-18s %7.2f ms/frame' % (dragName, sinkName + ':', elapsed * 1000))
+    root.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Benchmark the startup of the GUI: how long each of the heavy modules takes
+# to import in a fresh interpreter, and how long it takes from launching the
+# program until its window is shown and until it is ready to load an image.
+# The GUI is launched with --exit-after-startup, which makes it print those
+# milestones and exit. Pass the path of a PyInstaller build with -e to time
+# the frozen executable instead of the source.
+#
+# usage: python benchmarks/bench_startup.py [-r repeats] [-e dist/MobyCAIRO-GUI.exe]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+repositoryDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules whose import time is measured, roughly in order of dependency
+measuredModules = ['tkinter', 'numpy', 'cv2', 'PIL.ImageTk', 'analysis', 'loader', 'render', 'viewport']
+
+
+# Time importing one module in a new interpreter
+def importTime(module):
+    code = 'import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)' % (module)
+    result = subprocess.run([sys.executable, '-c', code], cwd=repositoryDir, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+# Launch the GUI once and note when each startup milestone line appears.
+# Returns a dictionary of milestone name -> seconds since launch, or None if
+# the GUI did not start
+def launchOnce(command):
+    startTime = time.perf_counter()
+    process = subprocess.Popen(command, cwd=repositoryDir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    milestones = {}
+    for line in process.stdout:
+        if line.startswith('startup: '):
+            name = line[len('startup: '):].split(' after ')[0]
+            milestones[name] = time.perf_counter() - startTime
+    process.wait()
+    if process.returncode != 0 or not milestones:
+        print(process.stderr.read().strip().splitlines()[-1:])
+        return None
+    milestones['exit'] = time.perf_counter() - startTime
+    return milestones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of the MobyCAIRO GUI')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of launches')
+    parser.add_argument('-e', '--executable', default=None, help='frozen executable to launch instead of MobyCAIRO-GUI.py')
+    args = parser.parse_args()
+
+    print('module import times, fresh interpreter:')
+    for module in measuredModules:
+        times = [importTime(module) for _ in range(args.repeat)]
+        if None in times:
+            print('  %-12s failed to import' % (module))
+            continue
+        print('  %-12s %7.1f ms min, %7.1f ms median' % (module, min(times) * 1000, statistics.median(times) * 1000))
+
+    if args.executable:
+        command = [args.executable, '--exit-after-startup']
+    else:
+        command = [sys.executable, os.path.join(repositoryDir, 'MobyCAIRO-GUI.py'), '--exit-after-startup']
+    print('launching %s %d times:' % (' '.join(command), args.repeat))
+    runs = []
+    for i in range(args.repeat):
+        milestones = launchOnce(command)
+        if milestones is None:
+            print('  the GUI did not start; is there a display?')
+            return 1
+        runs.append(milestones)
+        print('  launch %d: %s' % (i + 1, ', '.join(['%s %0.3f sec' % (name, elapsed) for (name, elapsed) in milestones.items()])))
+
+    # the first launch is usually the slowest, with cold file caches
+    for name in runs[0].keys():
+        times = [run[name] for run in runs if name in run]
+        print('%-13s first %0.3f sec, median %0.3f sec' % (name + ':', times[0], statistics.median(times)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# Benchmark the analysis and export pipeline on synthetic scans with a known
+# skew angle, disc position and item outline. Every stage of the straight
+# line analysis, the multi-resolution analysis, the crop candidate detectors
+# and the export paths is timed, along with the peak memory each stage
+# allocates and the error of the results against the ground truth. The
+# results are written as JSON so that runs can be compared when the pipeline
+# changes.
+#
+# usage: python benchmarks/synthetic.py [-s 2000,6000] [-a -3.7,1.3,12.25]
+#            [-k rectangle,text,disc] [-r repeats] [-o results.json]
+
+import argparse
+import cv2 as cv
+import datetime
+import json
+import numpy as np
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis
+import export
+import rotation
+
+
+scanKinds = ['rectangle', 'text', 'disc']
+
+
+#############################################
+# Synthetic scans
+
+# Draw a photo-like item: a dark frame around blocks of random tones
+def drawPhoto(canvas, rng, x1, y1, x2, y2):
+    cv.rectangle(canvas, (x1, y1), (x2, y2), (40, 40, 40), thickness=-1)
+    border = max(4, (x2 - x1) // 40)
+    for _ in range(12):
+        bx = int(rng.integers(x1 + border, x2 - border))
+        by = int(rng.integers(y1 + border, y2 - border))
+        color = tuple(int(c) for c in rng.integers(60, 200, 3))
+        cv.rectangle(canvas, (bx, by), (min(x2 - border, bx + (x2 - x1) // 3), min(y2 - border, by + (y2 - y1) // 3)), color, thickness=-1)
+
+
+# Draw a page of printed-text-like texture: rows of words, each word a short
+# dark bar
+def drawText(canvas, rng, x1, y1, x2, y2):
+    cv.rectangle(canvas, (x1, y1), (x2, y2), (235, 235, 235), thickness=-1)
+    lineHeight = max(6, (y2 - y1) // 40)
+    margin = lineHeight * 3
+    for y in range(y1 + margin, y2 - margin, lineHeight * 2):
+        x = x1 + margin
+        lineEnd = x2 - margin - int(rng.integers(0, (x2 - x1) // 4))
+        while x < lineEnd:
+            wordLength = int(rng.integers(lineHeight, lineHeight * 6))
+            cv.rectangle(canvas, (x, y), (min(x + wordLength, lineEnd), y + lineHeight), (20, 20, 20), thickness=-1)
+            x += wordLength + lineHeight
+
+
+# Draw a disc (a CD or a record) with a center hole, lying in a case
+def drawDisc(canvas, rng, centerX, centerY, radius):
+    cv.rectangle(canvas, (centerX - radius - radius // 8, centerY - radius - radius // 8),
+        (centerX + radius + radius // 8, centerY + radius + radius // 8), (110, 110, 110), thickness=max(3, radius // 40))
+    cv.circle(canvas, (centerX, centerY), radius, (30, 30, 30), thickness=-1)
+    for _ in range(6):
+        ringRadius = int(rng.integers(radius // 3, radius - radius // 20))
+        cv.circle(canvas, (centerX, centerY), ringRadius, (50, 50, 50), thickness=max(1, radius // 200))
+    cv.circle(canvas, (centerX, centerY), radius // 8, (250, 250, 250), thickness=-1)
+
+
+# Generate a synthetic scan.
+# Parameters:
+#   kind: one of scanKinds
+#   width, height: size of the scan
+#   angle: the rotation angle, in degrees, that straightens the scan; i.e.,
+#   the angle the analysis should find
+#   seed: seed for the random content
+# Returns a tuple of (scan, truth); truth holds the angle and, depending on
+#   the kind, the disc ('circle': (centerX, centerY, radius)) or the item
+#   outline ('rect': (minX, minY, maxX, maxY)) in the straightened image
+def makeScan(kind, width, height, angle, seed=1):
+    rng = np.random.default_rng(seed)
+    canvas = np.full((height, width, 3), 250, np.uint8)
+    truth = { 'angle': angle }
+
+    (x1, y1, x2, y2) = (width // 8, height // 8, width - width // 8, height - height // 8)
+    if kind == 'rectangle':
+        drawPhoto(canvas, rng, x1, y1, x2, y2)
+        truth['rect'] = (x1, y1, x2, y2)
+    elif kind == 'text':
+        drawText(canvas, rng, x1, y1, x2, y2)
+        truth['rect'] = (x1, y1, x2, y2)
+    elif kind == 'disc':
+        radius = int(min(width, height) * 0.35)
+        drawDisc(canvas, rng, width // 2, height // 2, radius)
+        truth['circle'] = (width // 2, height // 2, radius)
+    else:
+        raise ValueError('unknown scan kind "%s"' % (kind))
+
+    # skew the content the opposite way of the correction angle; the area
+    # brought in from outside of the canvas is the white scanner lid
+    M = cv.getRotationMatrix2D(((width-1)/2.0, (height-1)/2.0), -angle, 1)
+    scan = cv.warpAffine(canvas, M, (width, height), flags=cv.INTER_LINEAR, borderValue=(250, 250, 250))
+
+    # a little sensor noise
+    noise = rng.integers(-6, 7, scan.shape, dtype=np.int16)
+    scan = np.clip(scan.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return (scan, truth)
+
+
+#############################################
+# Measurement
+
+# Time a function, keeping the best of several runs, and measure the peak
+# memory allocated through numpy during one run.
+# Returns a tuple of (result, stage record)
+def measure(function, repeat):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = function()
+    peakBytes = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    best = None
+    for _ in range(repeat):
+        startTime = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - startTime
+        best = elapsed if best is None else min(best, elapsed)
+    return (result, { 'seconds': best, 'peakBytes': int(peakBytes) })
+
+
+# Difference between two line angles, in degrees; the lines of an item are at
+# right angles to each other, so angles 90 degrees apart count as the same
+def angleError(measured, expected):
+    difference = (measured - expected) % 90.0
+    return min(difference, 90.0 - difference)
+
+
+def rectOverlap(a, b):
+    intersection = max(0, min(a[2], b[2]) - max(a[0], b[0])) * max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def topAngle(lineListByLength, lengths):
+    return lineListByLength[lengths[0]]['angle'] if lengths else None
+
+
+# Run every stage on one synthetic scan.
+# Returns the record of the case
+def runCase(kind, width, height, angle, repeat):
+    (scan, truth) = makeScan(kind, width, height, angle)
+    stages = {}
+    accuracy = {}
+
+    # straight line analysis, stage by stage
+    (edges, stages['detectEdges']) = measure(lambda: analysis.detectEdges(scan), repeat)
+    (lines, stages['findLineSegments']) = measure(lambda: analysis.findLineSegments(edges), repeat)
+    (_, stages['binLineSegments']) = measure(lambda: analysis.binLineSegments(lines), repeat)
+    ((_, lineListByLength, lengths), stages['straightLineAnalysis']) = measure(lambda: analysis.straightLineAnalysis(scan), repeat)
+    found = topAngle(lineListByLength, lengths)
+    accuracy['angle'] = found
+    accuracy['angleError'] = angleError(found, angle) if found is not None else None
+
+    # multi-resolution analysis; the refinement updates the candidates in
+    # place, so each run refines a fresh copy
+    ((_, coarseLines, coarseLengths), stages['coarseLineAnalysis']) = measure(lambda: analysis.coarseLineAnalysis(scan), repeat)
+    def refine():
+        candidates = { length: dict(item) for (length, item) in coarseLines.items() }
+        refinedLengths = list(coarseLengths)
+        analysis.refineCandidateAngles(scan, candidates, refinedLengths)
+        return (candidates, refinedLengths)
+    ((refinedLines, refinedLengths), stages['refineCandidateAngles']) = measure(refine, repeat)
+    found = topAngle(refinedLines, refinedLengths)
+    accuracy['pyramidAngle'] = found
+    accuracy['pyramidAngleError'] = angleError(found, angle) if found is not None else None
+
+    # crop candidates, on the image straightened by the true angle
+    (straightened, stages['rotateImage']) = measure(lambda: rotation.rotateImage(scan, angle), repeat)
+    (circles, stages['findCircles']) = measure(lambda: analysis.findCircles(straightened), repeat)
+    (rects, stages['findRects']) = measure(lambda: analysis.findRects(straightened), repeat)
+    if 'circle' in truth:
+        (centerX, centerY, radius) = truth['circle']
+        accuracy['circleFound'] = len(circles) > 0
+        if circles:
+            accuracy['circleCenterError'] = float(np.hypot(circles[0][0] - centerX, circles[0][1] - centerY))
+            accuracy['circleRadiusError'] = float(abs(circles[0][2] - radius))
+    if 'rect' in truth:
+        accuracy['rectFound'] = len(rects) > 0
+        if rects:
+            accuracy['rectOverlap'] = rectOverlap(rects[0][:4], truth['rect'])
+            accuracy['rectSkew'] = rects[0][5]
+
+    # export paths: the fused rotate-and-crop against cropping the fully
+    # rotated image
+    if 'circle' in truth:
+        (centerX, centerY, radius) = truth['circle']
+        (_, stages['exportCircle']) = measure(lambda: export.exportCircle(scan, angle, centerX, centerY, radius), repeat)
+        (_, stages['rotateAndCropCircle']) = measure(lambda: export.cropCircle(rotation.rotateImage(scan, angle), centerX, centerY, radius), repeat)
+    else:
+        (x1, y1, x2, y2) = truth['rect']
+        (_, stages['exportRectangle']) = measure(lambda: export.exportRectangle(scan, angle, x1, y1, x2, y2), repeat)
+        (_, stages['rotateAndCropRectangle']) = measure(lambda: export.cropRectangle(rotation.rotateImage(scan, angle), x1, y1, x2, y2).copy(), repeat)
+
+    return { 'kind': kind, 'width': width, 'height': height, 'angle': angle, 'stages': stages, 'accuracy': accuracy }
+
+
+def parseList(text, convert):
+    return [convert(item) for item in text.split(',') if item]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the analysis and export pipeline on synthetic scans')
+    parser.add_argument('-s', '--sizes', default='2000,6000', help='comma-separated widths of the scans; the height is 3/4 of the width (default: 2000,6000)')
+    parser.add_argument('-a', '--angles', default='-3.7,1.3,12.25', help='comma-separated skew angles in degrees (default: -3.7,1.3,12.25)')
+    parser.add_argument('-k', '--kinds', default=','.join(scanKinds), help='comma-separated kinds of scans (default: %s)' % (','.join(scanKinds)))
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timing runs per stage; the best is kept (default: 3)')
+    parser.add_argument('-o', '--output', default='synthetic-results.json', help='JSON file for the results (default: synthetic-results.json)')
+    args = parser.parse_args(argv)
+
+    results = {
+        'benchmark': 'synthetic',
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'opencv': cv.__version__,
+            'numpy': np.__version__,
+            'threads': cv.getNumThreads(),
+        },
+        'cases': [],
+    }
+
+    for width in parseList(args.sizes, int):
+        height = width * 3 // 4
+        for kind in parseList(args.kinds, str):
+            for angle in parseList(args.angles, float):
+                case = runCase(kind, width, height, angle, args.repeat)
+                results['cases'].append(case)
+
+                accuracy = case['accuracy']
+                line = '%-9s %5dx%-5d %6.2f°: line analysis %7.1f ms (error %s), pyramid %7.1f ms (error %s)' % (
+                    kind, width, height, angle,
+                    case['stages']['straightLineAnalysis']['seconds'] * 1000,
+                    '%0.3f°' % accuracy['angleError'] if accuracy['angleError'] is not None else 'n/a',
+                    (case['stages']['coarseLineAnalysis']['seconds'] + case['stages']['refineCandidateAngles']['seconds']) * 1000,
+                    '%0.3f°' % accuracy['pyramidAngleError'] if accuracy['pyramidAngleError'] is not None else 'n/a')
+                if 'circleCenterError' in accuracy:
+                    line += ', circle error %0.1f px' % (accuracy['circleCenterError'])
+                if 'rectOverlap' in accuracy:
+                    line += ', rect overlap %0.3f' % (accuracy['rectOverlap'])
+                print(line, flush=True)
+
+    # the peak resident size of the whole run; maxrss is in kilobytes on
+    # Linux and in bytes on macOS
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results['peakResidentBytes'] = maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print('results written to %s' % (args.output))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,177 @@
+import cv2 as cv
+import math
+import os
+import numpy as np
+
+import analysis
+
+
+# Confidence scores for the automatic choices: the top candidate angle and the
+# top crop candidate. A score runs from 0.0 (a guess) to 1.0 (certain), so
+# that scans whose choices are clear can be saved without anyone looking at
+# them, and only the uncertain ones are shown to a person.
+#
+# Each scoring function returns a dictionary with the overall 'score' and the
+# components it was made from, for reporting why a scan needs review.
+
+
+# Score the top candidate angle of a straight line analysis.
+#   margin: how far the lines agreeing with the top angle outweigh the
+#   strongest group of lines at a different angle. Lines at right angles to
+#   the top angle agree with it, as do the neighboring bins.
+#   orthogonal: whether there are lines at right angles to the top angle as
+#   well; the horizontal and the vertical edges of an item agreeing is strong
+#   evidence, but a page of text only has one direction, so this component
+#   only raises the score
+#   support: the length of the agreeing lines relative to the size of the
+#   image; a few short segments are not enough to decide on
+# Parameters:
+#   lineListByLength, lengths: output of the straight line analysis, see
+#   analysis.binLineSegments()
+#   imageSize: (width, height) of the image, in the coordinates of the lines
+#   tolerance: candidates within this many degrees of the top angle, or of
+#   the angle at right angles to it, agree with it
+def angleConfidence(lineListByLength, lengths, imageSize, tolerance=1.5):
+    if not lengths:
+        return { 'score': 0.0, 'margin': 0.0, 'orthogonal': 0.0, 'support': 0.0 }
+    topAngle = lineListByLength[lengths[0]]['angle']
+
+    # group the candidates relative to the top angle
+    angles = np.array([lineListByLength[length]['angle'] for length in lengths])
+    totals = np.array(lengths, dtype=np.float64)
+    deltas = analysis.foldAngles(angles - topAngle)
+    parallel = np.abs(deltas) <= tolerance
+    perpendicular = np.abs(np.abs(deltas) - 90) <= tolerance
+    agreeing = parallel | perpendicular
+    supportLength = totals[agreeing].sum()
+
+    # the competing lines are grouped the same way around the strongest
+    # disagreeing candidate
+    competingLength = 0.0
+    if not agreeing.all():
+        rivalAngle = angles[~agreeing][0]
+        rivalDeltas = np.abs(analysis.foldAngles(angles - rivalAngle))
+        rival = ~agreeing & ((rivalDeltas <= tolerance) | (np.abs(rivalDeltas - 90) <= tolerance))
+        competingLength = totals[rival].sum()
+
+    margin = max(0.0, 1.0 - competingLength / supportLength)
+    orthogonal = min(1.0, totals[perpendicular].sum() / (0.25 * totals[parallel].sum()))
+    support = min(1.0, supportLength / (imageSize[0] + imageSize[1]))
+    score = margin * support * (0.7 + 0.3 * orthogonal)
+    return { 'score': round(score, 3), 'margin': round(margin, 3), 'orthogonal': round(orthogonal, 3), 'support': round(support, 3) }
+
+
+# Compute the edge map the crop outlines are checked against. The thresholds
+# are lower than those of the line analysis, so that the outline of a light
+# page on the white scanner lid is found as well.
+# Parameters:
+#   image: the rotated image (3-channel)
+def outlineEdges(image):
+    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    gray = cv.GaussianBlur(gray, (5, 5), 0)
+    return cv.Canny(gray, 10, 30)
+
+
+# The fraction of a set of points that lie on an edge.
+# Parameters:
+#   edges: an edge map
+#   points: Nx2 array of (x, y) points
+#   tolerance: how far, in pixels, an edge may be from a point; the crop
+#   candidates are detected on reduced images, so their outlines are only
+#   known to within a few pixels
+def edgeSupport(edges, points, tolerance=2):
+    if len(points) == 0:
+        return 0.0
+    size = 2 * tolerance + 1
+    nearEdges = cv.dilate(edges, cv.getStructuringElement(cv.MORPH_ELLIPSE, (size, size)))
+    (rows, cols) = edges.shape[:2]
+    points = np.rint(points).astype(np.int64)
+    inside = (points[:, 0] >= 0) & (points[:, 0] < cols) & (points[:, 1] >= 0) & (points[:, 1] < rows)
+    hits = np.count_nonzero(nearEdges[points[inside, 1], points[inside, 0]])
+    return hits / len(points)
+
+
+# Score a crop circle by how much of its outline is backed by edges in the
+# image, and by how clearly it stands out from the next candidate.
+#   edges: how much of the circle lies on an edge
+#   margin: 1.0 unless the runner-up candidate is almost the same size but
+#   elsewhere, in which case it is hard to say which one is meant
+# Parameters:
+#   edges: edge map of the rotated image, see outlineEdges()
+#   circles: the candidate circles, (centerX, centerY, radius) sorted by
+#   radius, in the coordinates of the edge map
+def circleConfidence(edges, circles):
+    if not circles:
+        return { 'score': 0.0, 'edges': 0.0, 'margin': 0.0 }
+    (centerX, centerY, radius) = circles[0]
+    sampleCount = max(64, int(2 * math.pi * radius))
+    theta = np.linspace(0, 2 * math.pi, sampleCount, endpoint=False)
+    points = np.column_stack([centerX + radius * np.cos(theta), centerY + radius * np.sin(theta)])
+    onEdges = edgeSupport(edges, points, max(2, int(radius * 0.02)))
+
+    # circles nested in the top one (the label, the hole) do not compete
+    # with it; a circle elsewhere within 10% of its size does
+    margin = 1.0
+    for (otherX, otherY, otherRadius) in circles[1:]:
+        if math.hypot(otherX - centerX, otherY - centerY) > radius * 0.5:
+            margin = max(0.0, min(1.0, (1.0 - otherRadius / radius) * 10))
+            break
+    score = onEdges * margin
+    return { 'score': round(score, 3), 'edges': round(onEdges, 3), 'margin': round(margin, 3) }
+
+
+# Score a crop rectangle by how much of its outline is backed by edges in the
+# image; see circleConfidence()
+# Parameters:
+#   edges: edge map of the rotated image, see outlineEdges()
+#   rects: the candidate rectangles, (minX, minY, maxX, maxY, area) sorted by
+#   area, in the coordinates of the edge map
+def rectangleConfidence(edges, rects):
+    if not rects:
+        return { 'score': 0.0, 'edges': 0.0 }
+    (minX, minY, maxX, maxY) = rects[0][:4]
+    xs = np.arange(minX, maxX + 1, dtype=np.float64)
+    ys = np.arange(minY, maxY + 1, dtype=np.float64)
+    points = np.concatenate([
+        np.column_stack([xs, np.full_like(xs, minY)]), np.column_stack([xs, np.full_like(xs, maxY)]),
+        np.column_stack([np.full_like(ys, minX), ys]), np.column_stack([np.full_like(ys, maxX), ys])])
+    onEdges = edgeSupport(edges, points, max(2, int(max(maxX - minX, maxY - minY) * 0.01)))
+    return { 'score': round(onEdges, 3), 'edges': round(onEdges, 3) }
+
+
+# Describe a score and its components in one line, e.g.
+# "0.42 (margin 0.50, orthogonal 1.00, support 0.84)"
+def describe(confidence):
+    components = ', '.join(['%s %0.2f' % (name, value) for (name, value) in confidence.items() if name != 'score'])
+    return '%0.2f (%s)' % (confidence['score'], components)
+
+
+# Save the list of scans that need a person to look at them, one per line:
+# the filename, the confidence score and the reason, separated by tabs.
+# Parameters:
+#   filename: the review list file; it is replaced
+#   entries: list of (scan filename, score, reason) tuples
+def writeReviewList(filename, entries):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('# scans left for review: filename, confidence, reason\n')
+        for (scanFilename, score, reason) in entries:
+            f.write('%s\t%0.3f\t%s\n' % (os.path.abspath(scanFilename), score, reason))
+
+
+# Load a review list written by writeReviewList(); plain lists of filenames,
+# one per line, are accepted as well.
+# Returns a list of (scan filename, score or None, reason) tuples
+def readReviewList(filename):
+    entries = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            try:
+                score = float(fields[1]) if len(fields) > 1 else None
+            except ValueError:
+                score = None
+            entries.append((fields[0], score, fields[2] if len(fields) > 2 else ''))
+    return entries
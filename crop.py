@@ -1,11 +1,25 @@
 import cv2 as cv
-import numpy as np
 import screeninfo
 
+import analysiscache
+import export
 import key_codes as key
-
-
-def assistedCircleCrop(image, houghAnalysisSize=400):
+import render
+import rotation
+import tracing
+
+
+# Interactively select a circle to crop out of an image.
+# Parameters:
+#   image: the unrotated image; this may be a reduced-resolution copy
+#   angle: the rotation angle to preview the image at, in degrees
+#   houghAnalysisSize: the pixel size to resize the image down to before
+#   analysis
+#   contentHash: hash of the image file (see analysiscache.fileHash()); when
+#   given, the circle search is looked up in and saved to the analysis cache
+# Returns a tuple of (centerX, centerY, radius) in the coordinates of the
+#   rotated image, or None if the user quit
+def assistedCircleSelection(image, angle=0.0, houghAnalysisSize=400, contentHash=None):
     windowName = "MobyCAIRO - Assisted Circle Crop"
 
     # create window
@@ -20,21 +34,31 @@ def assistedCircleCrop(image, houghAnalysisSize=400):
     primeToDisplayScaler = max(primeRows / screenWidth, primeCols / screenHeight)
     windowWidth = int(primeCols / primeToDisplayScaler)
     windowHeight = int(primeRows / primeToDisplayScaler)
-    scaledImage = cv.resize(image, (windowWidth, windowHeight))
+    with tracing.span('resize'):
+        scaledImage = cv.resize(image, (windowWidth, windowHeight))
+    scaledImage = rotation.rotateImage(scaledImage, angle)
     cv.moveWindow(windowName, screenWidth-windowWidth, 0)
 
     # set up an image for analysis
     primeToAnalyzerScaler = min(primeRows, primeCols) / houghAnalysisSize
     analyzerWidth = int(primeCols / primeToAnalyzerScaler)
     analyzerHeight = int(primeRows / primeToAnalyzerScaler)
-    analyzerImage = cv.resize(image, (analyzerWidth, analyzerHeight))
+    analyzerImage = cv.resize(scaledImage, (analyzerWidth, analyzerHeight))
     (_, analyzerImage) = cv.threshold(analyzerImage, 60, 255, cv.THRESH_BINARY)
     analyzerImageGray = cv.cvtColor(analyzerImage, cv.COLOR_BGR2GRAY)
     minRadius = 0
 
     # find the circles
-    print('searching the image for circles...')
-    circles = cv.HoughCircles(analyzerImageGray, cv.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=minRadius, maxRadius=0)
+    cacheParameters = (round(angle, 4), houghAnalysisSize, analyzerImageGray.shape)
+    cached = analysiscache.defaultCache.get(contentHash, 'displayCircles', cacheParameters)
+    if cached is not None:
+        circles = cached['circles']
+    else:
+        print('searching the image for circles...')
+        with tracing.span('HoughCircles', size=analyzerImageGray.shape):
+            circles = cv.HoughCircles(analyzerImageGray, cv.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=minRadius, maxRadius=0)
+        if circles is not None:
+            analysiscache.defaultCache.put(contentHash, 'displayCircles', cacheParameters, { 'circles': circles })
     displayToAnalyzerScaler = 1.0 * primeToAnalyzerScaler / primeToDisplayScaler
 
     print("""=====================
@@ -52,17 +76,19 @@ Circle cropping interface:
 """)
 
     index = 0
+    compositor = render.Compositor()
+    compositor.setBase(None, lambda: scaledImage)
     # input loop
     while True:
         (centerX, centerY, radius) = circles[0][index]
         centerX = int(centerX * displayToAnalyzerScaler)
         centerY = int(centerY * displayToAnalyzerScaler)
         radius = int(radius * displayToAnalyzerScaler)
-        displayImage = scaledImage.copy()
-        cv.circle(displayImage, (centerX, centerY), radius, (0, 0, 255), 2)
+        displayImage = compositor.drawTop([('circle', (centerX, centerY), radius, (0, 0, 255), 2)])
 
         # show the update
-        cv.imshow(windowName, displayImage)
+        with tracing.span('imshow'):
+            cv.imshow(windowName, displayImage)
         print('\r', end='')
         print('circle # %d/%d @ (%d, %d), r = %d    ' % (index+1, len(circles[0]), centerX, centerY, radius), end='', flush=True)
 
@@ -110,26 +136,38 @@ Circle cropping interface:
     if keyCode != key.ENTER:
         return None
 
-    # create a new canvas with all white and 1 cell of padding beyond the radius
+    # map the circle back to the original image
     centerX = int(centerX * primeToDisplayScaler)
     centerY = int(centerY * primeToDisplayScaler)
     radius = int(radius * primeToDisplayScaler)
-    diameter = int(radius*2) + 1
-    croppedImage = np.zeros((diameter, diameter, 3), np.uint8)
-    cv.rectangle(croppedImage, (0, 0), (diameter, diameter), (255, 255, 255), thickness=-1)
 
-    # copy over the circle
-    print('performing final crop...')
-    croppedImage[radius][0:radius*2] = image[centerY][centerX-radius:centerX+radius]
-    for i in range(radius):
-        dx = int(np.sqrt(np.square(radius) - np.square(i)))
-        croppedImage[radius-i][radius-dx:radius+dx] = image[centerY-i][centerX-dx:centerX+dx]
-        croppedImage[radius+i][radius-dx:radius+dx] = image[centerY+i][centerX-dx:centerX+dx]
+    return (centerX, centerY, radius)
+
+
+# Interactively crop a circle out of an image.
+# Parameters:
+#   image: the unrotated image
+#   angle: the rotation angle to apply before cropping, in degrees; the
+#   rotation and the crop are performed together as a final step
+#   houghAnalysisSize: see assistedCircleSelection()
+# Returns the rotated and cropped image, or None if the user quit
+def assistedCircleCrop(image, angle=0.0, houghAnalysisSize=400):
+    circle = assistedCircleSelection(image, angle, houghAnalysisSize)
+    if circle is None:
+        return None
 
-    return croppedImage
+    print('performing final crop...')
+    (centerX, centerY, radius) = circle
+    return export.exportCircle(image, angle, centerX, centerY, radius)
 
 
-def assistedRectangleCrop(image):
+# Interactively select a rectangle to crop out of an image.
+# Parameters:
+#   image: the unrotated image; this may be a reduced-resolution copy
+#   angle: the rotation angle to preview the image at, in degrees
+# Returns a tuple of (topX, topY, bottomX, bottomY) in the coordinates of the
+#   rotated image, or None if the user quit
+def assistedRectangleSelection(image, angle=0.0):
     windowName = "MobyCAIRO - Rectangle Crop"
 
     # create window
@@ -144,7 +182,9 @@ def assistedRectangleCrop(image):
     primeToDisplayScaler = max(primeRows / screenWidth, primeCols / screenHeight)
     windowWidth = int(primeCols / primeToDisplayScaler)
     windowHeight = int(primeRows / primeToDisplayScaler)
-    scaledImage = cv.resize(image, (windowWidth, windowHeight))
+    with tracing.span('resize'):
+        scaledImage = cv.resize(image, (windowWidth, windowHeight))
+    scaledImage = rotation.rotateImage(scaledImage, angle)
     cv.moveWindow(windowName, screenWidth-windowWidth, 0)
 
     print('select a rectangular region to crop and press ENTER to save the cropped image')
@@ -156,10 +196,19 @@ def assistedRectangleCrop(image):
 
     if rectWidth <= 0 or rectHeight <= 0:
         return None
-    print('performing final crop...')
-    croppedImage = np.zeros((bottomY-topY, bottomX-topX, 3), np.uint8)
-    # copy each line
-    for i in range(topY, bottomY):
-        croppedImage[i-topY][:] = image[i][topX:bottomX]
+    return (topX, topY, bottomX, bottomY)
+
 
-    return croppedImage
+# Interactively crop a rectangle out of an image.
+# Parameters:
+#   image: the unrotated image
+#   angle: the rotation angle to apply before cropping, in degrees
+# Returns the rotated and cropped image, or None if the user quit
+def assistedRectangleCrop(image, angle=0.0):
+    rectangle = assistedRectangleSelection(image, angle)
+    if rectangle is None:
+        return None
+
+    print('performing final crop...')
+    (topX, topY, bottomX, bottomY) = rectangle
+    return export.exportRectangle(image, angle, topX, topY, bottomX, bottomY)
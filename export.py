@@ -0,0 +1,133 @@
+import cv2 as cv
+import functools
+import numpy as np
+
+import imagesource
+import tracing
+
+
+# Compute the mask of a circle centered in a square of 1 diameter on each side.
+# The masks are cached since the same radius is typically cropped repeatedly
+# while previewing and exporting.
+# Parameters:
+#   radius: the radius of the circle in pixels
+#   dtype: pixel type of the mask
+# Returns a read-only array of (radius*2 + 1) x (radius*2 + 1) which is the
+#   maximum value of the pixel type inside the circle and 0 outside
+@functools.lru_cache(maxsize=8)
+def circleMask(radius, dtype=np.uint8):
+    diameter = radius*2 + 1
+    mask = np.zeros((diameter, diameter), np.uint8)
+    cv.circle(mask, (radius, radius), radius, 255, thickness=-1)
+    if dtype != np.uint8:
+        mask = mask.astype(dtype) * (np.iinfo(dtype).max // 255)
+    mask.flags.writeable = False
+    return mask
+
+
+# Clip a rectangle to the bounds of an image and return the source slices
+# along with the matching destination slices in a rectangle-sized buffer
+def clipRegion(image, topX, topY, bottomX, bottomY):
+    (rows, cols) = image.shape[:2]
+    sourceX1 = max(topX, 0)
+    sourceY1 = max(topY, 0)
+    sourceX2 = max(min(bottomX, cols), sourceX1)
+    sourceY2 = max(min(bottomY, rows), sourceY1)
+    source = (slice(sourceY1, sourceY2), slice(sourceX1, sourceX2))
+    destination = (slice(sourceY1 - topY, sourceY2 - topY), slice(sourceX1 - topX, sourceX2 - topX))
+    return (source, destination)
+
+
+# Crop a circle out of an image with a single masked copy.
+# Parameters:
+#   image: the image to be cropped (3-channel, any integer pixel depth)
+#   centerX, centerY, radius: the circle to keep
+#   alpha: if True, return a 4-channel image with the area outside of the
+#   circle transparent instead of white
+# Returns a square image, 1 diameter on each side, with the area outside of
+#   the circle (or outside of the source image) filled with white or
+#   transparent
+def cropCircle(image, centerX, centerY, radius, alpha=False):
+    (centerX, centerY, radius) = (int(round(centerX)), int(round(centerY)), int(round(radius)))
+    diameter = radius*2 + 1
+    white = np.iinfo(image.dtype).max
+    (source, destination) = clipRegion(image, centerX - radius, centerY - radius, centerX + radius + 1, centerY + radius + 1)
+
+    if alpha:
+        # only the pixels inside of both the circle and the source image are
+        # opaque; the color conversion makes the copied region opaque
+        croppedImage = np.zeros((diameter, diameter, 4), image.dtype)
+        croppedImage[destination] = cv.cvtColor(image[source], cv.COLOR_BGR2BGRA)
+        alphaChannel = croppedImage[..., 3]
+        np.bitwise_and(alphaChannel, circleMask(radius, image.dtype), out=alphaChannel)
+    else:
+        croppedImage = np.full((diameter, diameter, 3), white, image.dtype)
+        region = croppedImage[destination]
+        cv.copyTo(image[source], circleMask(radius)[destination], region)
+
+    return croppedImage
+
+
+# Crop a rectangle out of an image. No pixels are copied; the result is a view
+# into the original image, clipped to its bounds.
+# Parameters:
+#   image: the image to be cropped
+#   topX, topY: the upper left corner of the rectangle
+#   bottomX, bottomY: the lower right corner of the rectangle (exclusive)
+# Returns the cropped image
+def cropRectangle(image, topX, topY, bottomX, bottomY):
+    (source, _) = clipRegion(image, int(topX), int(topY), int(bottomX), int(bottomY))
+    return image[source]
+
+
+# Rotate an image about its center point, computing only one rectangular
+# region of the rotated result. The rotation and the crop offset are composed
+# into a single affine transform, so only the destination pixels are warped;
+# the time and memory needed depend on the size of the region rather than on
+# the size of the image.
+# Parameters:
+#   image: the image to be rotated; either an array or an image source, in
+#   which case only the part of the image under the region is read
+#   angle: rotation angle in degrees; positive values rotate counter-clockwise
+#   topX, topY: upper left corner of the region, in rotated image coordinates
+#   width, height: size of the region
+# Returns the region of the rotated image
+def rotatedRegion(image, angle, topX, topY, width, height):
+    (rows, cols) = image.shape[:2]
+    M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
+    M[0, 2] -= topX
+    M[1, 2] -= topY
+    with tracing.span('warpAffine', size=(int(height), int(width))):
+        return imagesource.warpAffine(image, M, (int(width), int(height)))
+
+
+# Rotate an image and crop a circle out of the rotated image in one step.
+# Parameters:
+#   image: the unrotated image
+#   angle: rotation angle in degrees
+#   centerX, centerY, radius: the circle to keep, in rotated image coordinates;
+#   a fractional center is kept, the warp puts it on the center pixel of the
+#   result, while the radius is rounded
+#   alpha: see cropCircle()
+# Returns the cropped image, as cropCircle() would on the fully rotated image
+def exportCircle(image, angle, centerX, centerY, radius, alpha=False):
+    radius = int(round(radius))
+    diameter = radius*2 + 1
+    region = rotatedRegion(image, angle, centerX - radius, centerY - radius, diameter, diameter)
+    return cropCircle(region, radius, radius, radius, alpha)
+
+
+# Rotate an image and crop a rectangle out of the rotated image in one step.
+# Parameters:
+#   image: the unrotated image
+#   angle: rotation angle in degrees
+#   topX, topY, bottomX, bottomY: the rectangle to keep, in rotated image
+#   coordinates; it is clipped to the bounds of the image
+# Returns the cropped image
+def exportRectangle(image, angle, topX, topY, bottomX, bottomY):
+    (rows, cols) = image.shape[:2]
+    topX = min(max(int(topX), 0), cols)
+    topY = min(max(int(topY), 0), rows)
+    bottomX = min(max(int(bottomX), topX), cols)
+    bottomY = min(max(int(bottomY), topY), rows)
+    return rotatedRegion(image, angle, topX, topY, bottomX - topX, bottomY - topY)
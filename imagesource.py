@@ -0,0 +1,340 @@
+import cv2 as cv
+import numpy as np
+import struct
+
+
+# Image sources give access to the pixels of an image file without decoding
+# the whole file into memory. Uncompressed TIFF (stripped or tiled), PPM/PGM
+# and BMP files are memory mapped, so reading a region of the image only
+# touches the part of the file holding that region.
+#
+# All of the read functions return 8-bit, 3-channel BGR images, the same as
+# cv.imread() would; deeper images are reduced to 8 bits per sample and
+# grayscale images are expanded to 3 channels.
+#
+# Sources have a numpy-like shape attribute and the module level functions
+# below accept either a source or an in-memory image, so most of the code
+# does not need to know which one it is working with.
+class ImageSource:
+
+    # Parameters:
+    #   filename: the image file
+    #   width, height: dimensions of the image in pixels
+    #   samples: number of samples stored per pixel
+    #   dtype: numpy type of one stored sample, including the byte order
+    #   channelOrder: 'RGB' or 'BGR', the order of the stored color samples
+    def __init__(self, filename, width, height, samples, dtype, channelOrder):
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.samples = samples
+        self.dtype = np.dtype(dtype)
+        self.channelOrder = channelOrder
+
+
+    @property
+    def shape(self):
+        return (self.height, self.width, 3)
+
+
+    # Read a region of the image in the stored format; the region has already
+    # been clipped to the image bounds
+    def readNative(self, x, y, width, height):
+        raise NotImplementedError()
+
+
+    # Convert stored pixels to 8-bit BGR
+    def convert(self, pixels):
+        if pixels.dtype.itemsize > 1:
+            pixels = (pixels >> (8 * (pixels.dtype.itemsize - 1))).astype(np.uint8)
+        if self.samples < 3:
+            return cv.cvtColor(np.ascontiguousarray(pixels[..., 0]), cv.COLOR_GRAY2BGR)
+        if self.samples > 4:
+            pixels = pixels[..., :3]
+        if self.channelOrder == 'RGB':
+            return cv.cvtColor(pixels, cv.COLOR_RGBA2BGR if pixels.shape[2] == 4 else cv.COLOR_RGB2BGR)
+        if pixels.shape[2] == 4:
+            return cv.cvtColor(pixels, cv.COLOR_BGRA2BGR)
+        return np.ascontiguousarray(pixels)
+
+
+    # Read a rectangular region of the image.
+    # Parameters:
+    #   x, y: upper left corner of the region
+    #   width, height: size of the region
+    # Returns the region clipped to the bounds of the image
+    def readRegion(self, x, y, width, height):
+        x1 = min(max(int(x), 0), self.width)
+        y1 = min(max(int(y), 0), self.height)
+        x2 = min(max(int(x + width), x1), self.width)
+        y2 = min(max(int(y + height), y1), self.height)
+        return self.convert(self.readNative(x1, y1, x2 - x1, y2 - y1))
+
+
+    # Read the entire image
+    def read(self):
+        return self.readRegion(0, 0, self.width, self.height)
+
+
+    # Read the image reduced by an integer factor, averaging each block of
+    # factor x factor pixels. The image is read in bands of rows so that only
+    # one band is held in memory at full resolution, and each band is reduced
+    # before it is converted.
+    # Parameters:
+    #   factor: the reduction factor
+    #   bandBytes: approximate size of the full-resolution bands
+    def readReduced(self, factor, bandBytes=64*1024*1024):
+        if factor <= 1:
+            return self.read()
+        reducedWidth = max(1, self.width // factor)
+        reducedHeight = max(1, self.height // factor)
+        reduced = np.empty((reducedHeight, reducedWidth, 3), np.uint8)
+        rowBytes = self.width * self.samples * self.dtype.itemsize
+        bandRows = max(1, bandBytes // (rowBytes * factor))
+        for row in range(0, reducedHeight, bandRows):
+            rows = min(bandRows, reducedHeight - row)
+            band = self.readNative(0, row * factor, reducedWidth * factor, rows * factor)
+            if not band.dtype.isnative:
+                band = band.astype(band.dtype.newbyteorder('='))
+            if self.samples > 4:
+                band = band[..., :3]
+            reduced[row:row+rows] = self.convert(cv.resize(band, (reducedWidth, rows), interpolation=cv.INTER_AREA).reshape(rows, reducedWidth, -1))
+        return reduced
+
+
+    # Read the image resized to the given (width, height); the bulk of the
+    # reduction is done while reading, see readReduced()
+    def resize(self, dsize):
+        factor = max(1, min(self.width // dsize[0], self.height // dsize[1]))
+        image = self.readReduced(factor)
+        if (image.shape[1], image.shape[0]) != tuple(dsize):
+            image = cv.resize(image, dsize, interpolation=cv.INTER_AREA)
+        return image
+
+
+# An image stored as one contiguous raster of rows
+class RasterSource(ImageSource):
+
+    # Parameters:
+    #   raster: height x width x samples array, usually a memory mapped view
+    #   of the file
+    #   remaining parameters: see ImageSource
+    def __init__(self, filename, raster, dtype, channelOrder):
+        (height, width, samples) = raster.shape
+        super().__init__(filename, width, height, samples, dtype, channelOrder)
+        self.raster = raster
+
+
+    def readNative(self, x, y, width, height):
+        return self.raster[y:y+height, x:x+width]
+
+
+# An image stored in separate blocks: the tiles of a tiled TIFF, or the strips
+# of a TIFF whose strips are not stored back to back
+class TiledSource(ImageSource):
+
+    # Parameters:
+    #   fileMap: the whole file, memory mapped as bytes
+    #   offsets: file offset of each block, in row-major order
+    #   blockWidth, blockHeight: size of each block in pixels; the tiles at
+    #   the right and bottom edges are stored padded to the full size, the
+    #   last strip of a stripped image may be shorter
+    #   remaining parameters: see ImageSource
+    def __init__(self, filename, width, height, samples, dtype, channelOrder, fileMap, offsets, blockWidth, blockHeight):
+        super().__init__(filename, width, height, samples, dtype, channelOrder)
+        self.fileMap = fileMap
+        self.offsets = offsets
+        self.blockWidth = blockWidth
+        self.blockHeight = blockHeight
+        self.blocksAcross = (width + blockWidth - 1) // blockWidth
+
+
+    def readBlock(self, blockX, blockY):
+        offset = self.offsets[blockY * self.blocksAcross + blockX]
+        rows = min(self.blockHeight, self.height - blockY * self.blockHeight)
+        count = rows * self.blockWidth * self.samples * self.dtype.itemsize
+        return self.fileMap[offset:offset+count].view(self.dtype).reshape(rows, self.blockWidth, self.samples)
+
+
+    def readNative(self, x, y, width, height):
+        region = np.empty((height, width, self.samples), self.dtype)
+        for blockY in range(y // self.blockHeight, (y + height + self.blockHeight - 1) // self.blockHeight):
+            for blockX in range(x // self.blockWidth, (x + width + self.blockWidth - 1) // self.blockWidth):
+                block = self.readBlock(blockX, blockY)
+                (originX, originY) = (blockX * self.blockWidth, blockY * self.blockHeight)
+                x1 = max(x, originX)
+                y1 = max(y, originY)
+                x2 = min(x + width, originX + block.shape[1])
+                y2 = min(y + height, originY + block.shape[0])
+                region[y1-y:y2-y, x1-x:x2-x] = block[y1-originY:y2-originY, x1-originX:x2-originX]
+        return region
+
+
+# TIFF tag types: (struct format character, size in bytes)
+tiffTypes = { 1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8) }
+
+
+# Parse the first image directory of a TIFF file. Only uncompressed,
+# interleaved, unsigned integer images are supported.
+# Returns an image source, or None if the file is not supported
+def openTIFF(filename, fileMap):
+    byteOrder = { b'II': '<', b'MM': '>' }.get(bytes(fileMap[:2]))
+    if byteOrder is None or struct.unpack(byteOrder + 'H', fileMap[2:4])[0] != 42:
+        return None
+
+    # collect the tags of the first directory
+    tags = {}
+    directory = struct.unpack(byteOrder + 'I', fileMap[4:8])[0]
+    (entryCount,) = struct.unpack(byteOrder + 'H', fileMap[directory:directory+2])
+    for i in range(entryCount):
+        entry = directory + 2 + i * 12
+        (tag, tagType, count) = struct.unpack(byteOrder + 'HHI', fileMap[entry:entry+8])
+        if tagType not in tiffTypes:
+            continue
+        (format, size) = tiffTypes[tagType]
+        valueOffset = entry + 8
+        if count * size > 4:
+            valueOffset = struct.unpack(byteOrder + 'I', fileMap[entry+8:entry+12])[0]
+        tags[tag] = struct.unpack(byteOrder + format * count, fileMap[valueOffset:valueOffset+count*size])
+
+    width = tags.get(256, (0,))[0]
+    height = tags.get(257, (0,))[0]
+    bitsPerSample = tags.get(258, (1,))
+    samples = tags.get(277, (1,))[0]
+    if width == 0 or height == 0 or \
+       tags.get(259, (1,))[0] != 1 or \
+       tags.get(284, (1,))[0] != 1 or \
+       tags.get(339, (1,))[0] != 1 or \
+       tags.get(262, (2,))[0] not in (1, 2) or \
+       len(set(bitsPerSample)) != 1 or bitsPerSample[0] not in (8, 16):
+        return None
+    dtype = np.dtype(np.uint8) if bitsPerSample[0] == 8 else np.dtype(byteOrder + 'u2')
+
+    if 322 in tags:
+        # tiled image
+        return TiledSource(filename, width, height, samples, dtype, 'RGB', fileMap,
+            tags[324], tags[322][0], tags[323][0])
+
+    # stripped image; when the strips are stored back to back, the whole
+    # image is one raster
+    offsets = tags[273]
+    rowsPerStrip = min(tags.get(278, (height,))[0], height)
+    stripBytes = rowsPerStrip * width * samples * dtype.itemsize
+    if all(offsets[i+1] - offsets[i] == stripBytes for i in range(len(offsets) - 1)):
+        raster = np.ndarray((height, width, samples), dtype, fileMap, offsets[0])
+        return RasterSource(filename, raster, dtype, 'RGB')
+    return TiledSource(filename, width, height, samples, dtype, 'RGB', fileMap, offsets, width, rowsPerStrip)
+
+
+# Parse a binary PPM (P6) or PGM (P5) file.
+# Returns an image source, or None if the file is not supported
+def openPPM(filename, fileMap):
+    if bytes(fileMap[:2]) not in (b'P5', b'P6'):
+        return None
+    samples = 3 if fileMap[1] == ord('6') else 1
+
+    # the header is made up of the magic number, width, height and maximum
+    # value, separated by whitespace and comments, and ends after a single
+    # whitespace character
+    fields = []
+    position = 2
+    while len(fields) < 3:
+        while chr(fileMap[position]).isspace():
+            position += 1
+        if fileMap[position] == ord('#'):
+            while int(fileMap[position]) not in b'\r\n':
+                position += 1
+            continue
+        start = position
+        while not chr(fileMap[position]).isspace():
+            position += 1
+        fields.append(int(bytes(fileMap[start:position])))
+    (width, height, maxValue) = fields
+    dtype = np.dtype(np.uint8) if maxValue < 256 else np.dtype('>u2')
+    if maxValue not in (255, 65535):
+        return None
+    raster = np.ndarray((height, width, samples), dtype, fileMap, position + 1)
+    return RasterSource(filename, raster, dtype, 'RGB')
+
+
+# Parse an uncompressed 24- or 32-bit BMP file.
+# Returns an image source, or None if the file is not supported
+def openBMP(filename, fileMap):
+    if bytes(fileMap[:2]) != b'BM':
+        return None
+    (pixelOffset,) = struct.unpack('<I', fileMap[10:14])
+    (width, height, _, bitsPerPixel, compression) = struct.unpack('<iiHHI', fileMap[18:34])
+    if compression != 0 or bitsPerPixel not in (24, 32):
+        return None
+
+    # rows are padded to 4 bytes and stored bottom-up unless the height is
+    # negative
+    samples = bitsPerPixel // 8
+    stride = ((width * bitsPerPixel + 31) // 32) * 4
+    raster = np.ndarray((abs(height), width, samples), np.uint8, fileMap, pixelOffset, (stride, samples, 1))
+    if height > 0:
+        raster = raster[::-1]
+    return RasterSource(filename, raster, np.uint8, 'BGR')
+
+
+# Open an image file as a memory mapped image source.
+# Returns the image source, or None if the file is not in one of the
+#   supported formats; such files need to be decoded with cv.imread()
+def openImage(filename):
+    try:
+        fileMap = np.memmap(filename, np.uint8, 'r')
+    except (OSError, ValueError):
+        return None
+    for opener in (openTIFF, openPPM, openBMP):
+        try:
+            source = opener(filename, fileMap)
+        except (struct.error, IndexError, KeyError, ValueError, TypeError):
+            source = None
+        if source is not None:
+            return source
+    return None
+
+
+# Return the entire image as an array, whether it is an image source or
+# already an array
+def asArray(image):
+    if isinstance(image, ImageSource):
+        return image.read()
+    return image
+
+
+# Resize an image source or an array to the given (width, height)
+def resize(image, dsize):
+    if isinstance(image, ImageSource):
+        return image.resize(dsize)
+    return cv.resize(image, dsize, interpolation=cv.INTER_AREA)
+
+
+# Apply an affine transform like cv.warpAffine(), to either an image source
+# or an array. For a source, only the region of the image that the output
+# maps back to is read.
+def warpAffine(image, M, dsize, flags=cv.INTER_LINEAR, borderMode=cv.BORDER_CONSTANT, borderValue=0):
+    if not isinstance(image, ImageSource):
+        return cv.warpAffine(image, M, dsize, flags=flags, borderMode=borderMode, borderValue=borderValue)
+
+    # the inverse transform maps output coordinates to source coordinates
+    if flags & cv.WARP_INVERSE_MAP:
+        inverse = np.array(M, dtype=np.float64)
+    else:
+        inverse = cv.invertAffineTransform(np.array(M, dtype=np.float64))
+    (width, height) = dsize
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1], [width, height, 1]], dtype=np.float64)
+    sourceCorners = corners @ inverse.T
+
+    # the bounding box of the output in the source, with a margin for the
+    # interpolation, clipped to the image but always at least one pixel
+    margin = 3
+    x1 = min(max(int(np.floor(sourceCorners[:, 0].min())) - margin, 0), image.width - 1)
+    y1 = min(max(int(np.floor(sourceCorners[:, 1].min())) - margin, 0), image.height - 1)
+    x2 = max(min(int(np.ceil(sourceCorners[:, 0].max())) + margin, image.width), x1 + 1)
+    y2 = max(min(int(np.ceil(sourceCorners[:, 1].max())) + margin, image.height), y1 + 1)
+    region = image.readRegion(x1, y1, x2 - x1, y2 - y1)
+
+    inverse[0, 2] -= x1
+    inverse[1, 2] -= y1
+    return cv.warpAffine(region, inverse, dsize, flags=flags | cv.WARP_INVERSE_MAP, borderMode=borderMode, borderValue=borderValue)
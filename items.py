@@ -0,0 +1,205 @@
+import concurrent.futures
+import cv2 as cv
+import math
+import numpy as np
+import os
+
+import analysis
+import recipe
+import tracing
+
+
+# Several items are often scanned together in one flatbed pass, e.g. a disc,
+# its front booklet and its back inlay. The functions here find every item on
+# the scanner bed in a single analysis of one reduced copy of the scan, and
+# export all of them from a single full-resolution image.
+#
+# Each item is a dictionary:
+#   {
+#     "type": "circle" or "rectangle",
+#     "angle": the item's own skew angle in degrees,
+#     "crop": the crop geometry, see recipe.circleCrop() and recipe.rectangleCrop()
+#   }
+# Like in a recipe, the crop coordinates are in the full-resolution image
+# rotated by the item's angle, so an item can be saved as a recipe and
+# replayed on its own.
+
+
+# Fold line angles into (-45, 45]: the horizontal and the vertical edges of a
+# rectangle skewed by the same amount give the same skew angle
+def foldSkewAngles(angles):
+    angles = analysis.foldAngles(np.asarray(angles, dtype=np.float64))
+    angles[angles > 45] -= 90
+    angles[angles <= -45] += 90
+    return angles
+
+
+# Measure the skew of an item from its straight line segments.
+# Parameters:
+#   lines: line segments as returned by cv.HoughLinesP, or None
+#   binSize: width of the angle bins in degrees
+# Returns the skew angle in degrees, the length-weighted mean angle of the
+#   segments in and next to the angle bin holding the most segment length,
+#   or None if there are no segments
+def skewAngle(lines, binSize=1.0):
+    if lines is None or len(lines) == 0:
+        return None
+    segments = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    angles = foldSkewAngles(np.degrees(np.arctan2(dy, dx)))
+    lengths = np.hypot(dx, dy)
+
+    bins = np.rint(angles / binSize).astype(np.int64)
+    totals = np.bincount(bins - bins.min(), weights=lengths)
+    peak = (np.argmax(totals) + bins.min()) * binSize
+    near = np.abs(angles - peak) <= binSize
+    return float(np.average(angles[near], weights=lengths[near]))
+
+
+# Find the items on a scanner bed. The scanner lid is white, so the items are
+# the large regions darker than the lid; a region which fills most of its
+# enclosing circle is a disc, any other region is a rectangular item.
+# Parameters:
+#   image: a reduced-resolution copy of the unrotated scan (3-channel)
+#   scale: factor mapping image coordinates to those of the full-resolution
+#   image
+#   fullSize: (width, height) of the full-resolution image; by default the
+#   size of the image times the scale
+#   minArea: the smallest item, as a fraction of the area of the scan
+#   backgroundThreshold: gray level above which a pixel is the scanner lid
+#   circleFill: the fraction of its enclosing circle that a disc covers
+# Returns a list of items, see above, in reading order: top to bottom, then
+#   left to right
+def findItems(image, scale=1.0, fullSize=None, minArea=0.01, backgroundThreshold=240, circleFill=0.85):
+    (rows, cols) = image.shape[:2]
+    if fullSize is None:
+        fullSize = (cols * scale, rows * scale)
+    (fullWidth, fullHeight) = fullSize
+
+    # separate the items from the lid; closing fills the bright spots inside
+    # of the items (the hole of a disc, white areas of a booklet) and opening
+    # removes dust
+    with tracing.span('cvtColor', size=(rows, cols)):
+        gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    (_, mask) = cv.threshold(gray, backgroundThreshold, 255, cv.THRESH_BINARY_INV)
+    kernelSize = max(3, int(min(rows, cols) * 0.005) | 1)
+    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (kernelSize, kernelSize))
+    mask = cv.morphologyEx(mask, cv.MORPH_CLOSE, kernel)
+    mask = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel)
+    with tracing.span('findContours', size=mask.shape):
+        (contours, _) = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+
+    # the edges are computed once, for all of the items
+    edges = analysis.detectEdges(image)
+
+    items = []
+    for contour in contours:
+        area = cv.contourArea(contour)
+        if area < minArea * rows * cols:
+            continue
+        ((centerX, centerY), radius) = cv.minEnclosingCircle(contour)
+        isCircle = area >= circleFill * math.pi * radius * radius
+
+        # only the edges of this item count towards its skew. The outline of
+        # a rectangular item is the best evidence of its skew, but the
+        # outline of a disc is not straight anywhere, so a disc is measured
+        # on its label alone.
+        (x, y, width, height) = cv.boundingRect(contour)
+        margin = 2 * kernelSize
+        (x1, y1) = (max(x - margin, 0), max(y - margin, 0))
+        (x2, y2) = (min(x + width + margin, cols), min(y + height + margin, rows))
+        itemMask = np.zeros((y2 - y1, x2 - x1), np.uint8)
+        cv.drawContours(itemMask, [contour], -1, 255, thickness=-1, offset=(-x1, -y1))
+        if isCircle:
+            erosion = max(3, int(radius * 0.1) | 1)
+            itemMask = cv.erode(itemMask, cv.getStructuringElement(cv.MORPH_ELLIPSE, (erosion, erosion)))
+        else:
+            itemMask = cv.dilate(itemMask, kernel)
+        itemEdges = cv.bitwise_and(edges[y1:y2, x1:x2], itemMask)
+        angle = skewAngle(analysis.findLineSegments(itemEdges))
+        angle = round(angle, 4) if angle is not None else 0.0
+
+        # move the item into the full-resolution image rotated by its angle;
+        # an image pixel covers the full-resolution pixels around
+        # scale * p + (scale-1)/2
+        M = cv.getRotationMatrix2D(((fullWidth-1)/2.0, (fullHeight-1)/2.0), angle, 1)
+        offset = (scale - 1) / 2.0
+        if isCircle:
+            (rotatedX, rotatedY) = M[:, :2] @ np.array([centerX * scale + offset, centerY * scale + offset]) + M[:, 2]
+            crop = recipe.circleCrop(round(rotatedX), round(rotatedY), math.ceil(radius * scale))
+        else:
+            points = contour.reshape(-1, 2) * scale + offset
+            rotated = points @ M[:, :2].T + M[:, 2]
+            (minX, minY) = np.floor(rotated.min(axis=0))
+            (maxX, maxY) = np.ceil(rotated.max(axis=0)) + 1
+            crop = recipe.rectangleCrop(minX, minY, maxX, maxY)
+        items.append(({ 'type': 'circle' if isCircle else 'rectangle', 'angle': angle, 'crop': crop }, (y, x)))
+
+    return [item for (item, _) in sorted(items, key=lambda entry: entry[1])]
+
+
+# Compute the output filename for one of several items saved together, e.g.
+# "scan-2.png" for the second item saved as "scan.png"
+def itemFilenameFor(outputFilename, index):
+    (base, ext) = os.path.splitext(outputFilename)
+    return '%s-%d%s' % (base, index + 1, ext)
+
+
+# Describe an item in one line
+def describeItem(item):
+    crop = item['crop']
+    if crop['type'] == 'circle':
+        return 'circle (%d, %d), %d at %0.2f°' % (crop['centerX'], crop['centerY'], crop['radius'], item['angle'])
+    return 'rectangle (%d, %d) -> (%d, %d) at %0.2f°' % (crop['topX'], crop['topY'], crop['bottomX'], crop['bottomY'], item['angle'])
+
+
+# Rotate, crop and save one item along with its recipe; runs in a worker
+# thread of exportItems()
+def exportItem(image, editRecipe, outputFilename):
+    croppedImage = recipe.applyRecipe(editRecipe, image)
+    try:
+        with tracing.span('imwrite', size=croppedImage.shape[:2]):
+            if not cv.imwrite(outputFilename, croppedImage):
+                return 'could not write output'
+    except cv.error as e:
+        return str(e).strip()
+    recipe.writeRecipe(outputFilename, editRecipe)
+    return None
+
+
+# Export several items of one scan in parallel. The full-resolution image is
+# shared by all of the workers; each worker only warps the region of its own
+# item, and OpenCV releases the GIL while it does, so threads are enough.
+# Parameters:
+#   image: the full-resolution scan (BGR), or an image source
+#   items: the items to export, from findItems()
+#   outputFilename: the items are saved next to this name, see
+#   itemFilenameFor()
+#   sourceFilename, sourceHash: the scan, for the recipes; see
+#   recipe.makeRecipe()
+#   workers: number of worker threads; the number of cores by default
+#   transparent: make the area outside of the circle items transparent
+#   progress: optional function(fraction, message) called as the items are
+#   saved
+# Returns a list of (output filename, error message or None), one per item
+def exportItems(image, items, outputFilename, sourceFilename, sourceHash, workers=None, transparent=False, progress=None):
+    jobs = []
+    for (index, item) in enumerate(items):
+        filename = itemFilenameFor(outputFilename, index)
+        editRecipe = recipe.makeRecipe(sourceFilename, sourceHash, item['angle'], item['crop'], filename,
+            transparent and item['type'] == 'circle')
+        jobs.append((filename, editRecipe))
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(exportItem, image, editRecipe, filename) for (filename, editRecipe) in jobs]
+        try:
+            for (count, _) in enumerate(concurrent.futures.as_completed(futures)):
+                if progress:
+                    progress((count + 1) / len(futures), 'saved item %d of %d' % (count + 1, len(futures)))
+        finally:
+            # after a cancellation, the items not yet started are dropped
+            for future in futures:
+                future.cancel()
+    return [(filename, future.result()) for ((filename, _), future) in zip(jobs, futures)]
@@ -0,0 +1,83 @@
+import cv2 as cv
+from PIL import Image
+
+import imagesource
+import tracing
+
+
+# cv.imread() flags that decode an image at a reduced scale, by scale factor
+reducedReadFlags = {
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# Find the dimensions of an image by reading only its header.
+# Returns a tuple of (width, height), or None if the file could not be
+#   identified
+def imageSize(filename):
+    try:
+        with Image.open(filename) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+# Choose the largest reduction factor that keeps the largest dimension of an
+# image at or above a minimum size
+def reductionFactor(width, height, minSize):
+    factor = 1
+    for candidate in sorted(reducedReadFlags.keys()):
+        if max(width, height) / candidate >= minSize:
+            factor = candidate
+    return factor
+
+
+# Decode a reduced-resolution version of an image, for analysis and preview.
+# Uncompressed files that can be memory mapped (see imagesource) are reduced
+# while they are read, a band of rows at a time. JPEG files are reduced by the
+# decoder itself, which skips most of the work of a full decode; other formats
+# are decoded and then reduced by OpenCV, which at least avoids holding on to
+# the full-resolution pixels.
+# Parameters:
+#   filename: the image file
+#   minSize: the largest dimension of the reduced image is at least this
+#   large; smaller images are decoded at full resolution
+# Returns a tuple of (image, scale):
+#   image: the decoded image (3-channel BGR), or None if it could not be read
+#   scale: the full-resolution size divided by the reduced size; coordinates
+#   in the reduced image are multiplied by this to map them back to the
+#   full-resolution image
+def readReduced(filename, minSize=2048):
+    source = imagesource.openImage(filename)
+    if source is not None:
+        factor = reductionFactor(source.width, source.height, minSize)
+        with tracing.span('readReduced', factor=factor):
+            return (source.readReduced(factor), factor)
+
+    size = imageSize(filename)
+    factor = reductionFactor(size[0], size[1], minSize) if size else 1
+    with tracing.span('imread', factor=factor):
+        if factor == 1:
+            return (cv.imread(filename), 1)
+        return (cv.imread(filename, reducedReadFlags[factor]), factor)
+
+
+# Decode an image at full resolution, for export.
+# Returns the image (3-channel BGR), or None if it could not be read
+def readFull(filename):
+    with tracing.span('imread', factor=1):
+        return cv.imread(filename)
+
+
+# Open an image at full resolution, for export. Files that can be memory
+# mapped are returned as an image source, so that only the regions being
+# exported are read; other files are decoded.
+# Returns an image source or the image (3-channel BGR), or None if it could
+#   not be read
+def openFull(filename):
+    source = imagesource.openImage(filename)
+    if source is not None:
+        return source
+    return readFull(filename)
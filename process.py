@@ -2,8 +2,13 @@ import cv2 as cv
 import os
 import sys
 
+import analysiscache
 import crop
+import export
+import loader
+import recipe
 import rotation
+import tracing
 
 
 def validateArguments(infile, outfile):
@@ -32,8 +37,11 @@ def validateArguments(infile, outfile):
 
 
 # This function processes a circle if the circle parm is True;
-# else, process a rectangle
-def processImage(circle=True):
+# else, process a rectangle. The interactive steps work on a reduced-resolution
+# copy of the image, which may be passed in if the caller already decoded it
+# (see loader.readReduced()); the full-resolution image is only decoded for
+# the final crop.
+def processImage(circle=True, workingImage=None, workingScale=1):
     if len(sys.argv) < 3:
         print('%s <input image filename> <output image filename.PNG>' % (sys.argv[0]))
         sys.exit(1)
@@ -45,25 +53,60 @@ def processImage(circle=True):
         print('could not validate arguments')
         return
 
-    # load the image
-    imagePrime = cv.imread(inputFilename)
-    print("read image '%s', %dx%d" % (inputFilename, imagePrime.shape[1], imagePrime.shape[0]))
+    # load a reduced-resolution version of the image
+    if workingImage is None:
+        (workingImage, workingScale) = loader.readReduced(inputFilename)
+        if workingImage is None:
+            print("could not read image '%s'" % (inputFilename))
+            sys.exit(1)
+
+    # the analyses of a file that was processed before come from the cache;
+    # hashing reads the whole file, so without a cache it waits until the
+    # recipe is written
+    contentHash = None
+    if analysiscache.defaultCache.directory is not None:
+        with tracing.span('fileHash'):
+            contentHash = analysiscache.fileHash(inputFilename)
 
-    # rotate image
-    rotatedImage = rotation.assistedImageRotation(imagePrime)
-    if rotatedImage is None:
+    # select the rotation angle
+    angle = rotation.assistedAngleSelection(workingImage, contentHash=contentHash)
+    if angle is None:
         print('exiting program without saving the image')
         sys.exit(0)
 
-    # crop image
+    # select the crop region
     if circle:
-        croppedImage = crop.assistedCircleCrop(rotatedImage)
+        selection = crop.assistedCircleSelection(workingImage, angle, contentHash=contentHash)
     else:
-        croppedImage = crop.assistedRectangleCrop(rotatedImage)
-    if croppedImage is None:
+        selection = crop.assistedRectangleSelection(workingImage, angle)
+    if selection is None:
         print('exiting program without saving the image')
         sys.exit(0)
 
+    # load the full image and crop it; the final rotation is performed along
+    # with the crop
+    with tracing.span('openFull'):
+        imagePrime = loader.openFull(inputFilename)
+    print("read image '%s', %dx%d" % (inputFilename, imagePrime.shape[1], imagePrime.shape[0]))
+    selection = [int(v * workingScale) for v in selection]
+    print('performing final crop...')
+    if circle:
+        croppedImage = export.exportCircle(imagePrime, angle, *selection)
+        cropGeometry = recipe.circleCrop(*selection)
+    else:
+        croppedImage = export.exportRectangle(imagePrime, angle, *selection)
+        cropGeometry = recipe.rectangleCrop(*selection)
+
     # save the image
     print('saving rotated and cropped image to "%s"...' % (outputFilename))
-    cv.imwrite(outputFilename, croppedImage)
+    with tracing.span('imwrite', size=croppedImage.shape[:2]):
+        saved = cv.imwrite(outputFilename, croppedImage)
+    if not saved:
+        print('could not save image to "%s"' % (outputFilename))
+        return
+
+    # save the edit alongside the image; see replay.py
+    if contentHash is None:
+        with tracing.span('fileHash'):
+            contentHash = analysiscache.fileHash(inputFilename)
+    recipe.writeRecipe(outputFilename, recipe.makeRecipe(inputFilename, contentHash, angle, cropGeometry, outputFilename))
@@ -0,0 +1,107 @@
+import json
+import os
+
+import export
+
+
+# An edit recipe records everything needed to regenerate an output image from
+# its source scan: the hash of the source file, the rotation angle, the crop
+# geometry and the output settings. A recipe is saved as a small JSON sidecar
+# file next to each output image, and replay.py regenerates outputs from
+# recipes without repeating any analysis.
+#
+# Recipes are plain dictionaries:
+#   {
+#     "version": 1,
+#     "source": "/scans/disc.png",
+#     "sourceHash": "...",
+#     "angle": -1.25,
+#     "crop": { "type": "circle", "centerX": 1000, "centerY": 1000, "radius": 800 },
+#     "output": { "filename": "disc-fixed.png", "transparent": false }
+#   }
+# or, for rectangular crops,
+#     "crop": { "type": "rectangle", "topX": 10, "topY": 10, "bottomX": 500, "bottomY": 400 }
+# All of the crop coordinates are in the rotated full-resolution image. The
+# center of a circle may be fractional, when it was refined to sub-pixel
+# accuracy; see analysis.refineCircle().
+
+recipeVersion = 1
+recipeExtension = '.mobycairo.json'
+
+
+# Compute the sidecar filename for an output image
+def recipeFilenameFor(outputFilename):
+    return outputFilename + recipeExtension
+
+
+# A coordinate to 2 decimal places, or an integer if it is a whole number
+def subPixel(value):
+    value = round(float(value), 2)
+    return int(value) if value.is_integer() else value
+
+
+def circleCrop(centerX, centerY, radius):
+    return { 'type': 'circle', 'centerX': subPixel(centerX), 'centerY': subPixel(centerY), 'radius': int(round(radius)) }
+
+
+def rectangleCrop(topX, topY, bottomX, bottomY):
+    return { 'type': 'rectangle', 'topX': int(topX), 'topY': int(topY), 'bottomX': int(bottomX), 'bottomY': int(bottomY) }
+
+
+# Build a recipe.
+# Parameters:
+#   sourceFilename: the scan the output was made from
+#   sourceHash: hash of the scan's contents, see analysiscache.fileHash()
+#   angle: rotation angle in degrees
+#   crop: crop geometry from circleCrop() or rectangleCrop()
+#   outputFilename: the output image
+#   transparent: True if the area outside of a circle crop is transparent
+def makeRecipe(sourceFilename, sourceHash, angle, crop, outputFilename, transparent=False):
+    return {
+        'version': recipeVersion,
+        'source': os.path.abspath(sourceFilename),
+        'sourceHash': sourceHash,
+        'angle': float(angle),
+        'crop': crop,
+        'output': { 'filename': os.path.basename(outputFilename), 'transparent': bool(transparent) },
+    }
+
+
+# Save a recipe as the sidecar of an output image. Failing to write the
+# recipe is reported but does not fail the save.
+def writeRecipe(outputFilename, recipe):
+    try:
+        with open(recipeFilenameFor(outputFilename), 'w') as f:
+            json.dump(recipe, f, indent=2)
+            f.write('\n')
+    except OSError as e:
+        print('could not write the edit recipe for "%s": %s' % (outputFilename, str(e)))
+
+
+# Load a recipe file.
+# Returns the recipe; raises ValueError if the file is not a recipe this
+#   version understands
+def readRecipe(filename):
+    with open(filename) as f:
+        recipe = json.load(f)
+    if not isinstance(recipe, dict) or recipe.get('version') != recipeVersion:
+        raise ValueError('"%s" is not a version %d edit recipe' % (filename, recipeVersion))
+    for field in ['source', 'sourceHash', 'angle', 'crop', 'output']:
+        if field not in recipe:
+            raise ValueError('"%s" is missing the "%s" field' % (filename, field))
+    if recipe['crop'].get('type') not in ['circle', 'rectangle']:
+        raise ValueError('"%s" has an unknown crop type' % (filename))
+    return recipe
+
+
+# Rotate and crop an image according to a recipe.
+# Parameters:
+#   recipe: the recipe
+#   image: the full-resolution source image (BGR), or an image source
+# Returns the output image
+def applyRecipe(recipe, image):
+    crop = recipe['crop']
+    if crop['type'] == 'circle':
+        return export.exportCircle(image, recipe['angle'], crop['centerX'], crop['centerY'], crop['radius'], recipe['output'].get('transparent', False))
+    else:
+        return export.exportRectangle(image, recipe['angle'], crop['topX'], crop['topY'], crop['bottomX'], crop['bottomY'])
@@ -0,0 +1,382 @@
+import collections
+import cv2 as cv
+import math
+import numpy as np
+from PIL import Image, ImageTk
+import time
+
+import tracing
+
+
+# Compute the matrix that rotates an image of the given size about its center
+# point; positive angles rotate counter-clockwise
+def rotationMatrix(cols, rows, angle):
+    return cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
+
+
+# Apply a 2x3 affine matrix to an Nx4 array of line segments (x1, y1, x2, y2)
+# and return the transformed segments as an Nx4 float array
+def transformSegments(segments, M):
+    points = np.asarray(segments, dtype=np.float32).reshape(-1, 1, 2)
+    return cv.transform(points, M).reshape(-1, 4)
+
+
+# A bounded least-recently-used cache of rotated preview frames, keyed by the
+# source layer name and the rotation angle. Switching back and forth between
+# candidate angles, or toggling overlays, reuses the rotated frames instead of
+# warping them again. The cache is limited both by the number of entries and
+# by the total bytes of the cached frames.
+#
+# The returned frames are read-only since they are shared; copy a frame
+# before drawing on it.
+class RotatedFrameCache:
+
+    def __init__(self, maxEntries=16, maxBytes=128*1024*1024):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.frames = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    # Fetch the rotated version of a layer, warping and caching it on a miss.
+    # Parameters:
+    #   layerName: name identifying the source layer, e.g. 'image' or 'edges'
+    #   layer: the source layer itself
+    #   angle: rotation angle in degrees
+    def get(self, layerName, layer, angle):
+        key = (layerName, round(angle, 4))
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return frame
+
+        self.misses += 1
+        (rows, cols) = layer.shape[:2]
+        with tracing.span('warpAffine', size=(rows, cols)):
+            frame = cv.warpAffine(layer, rotationMatrix(cols, rows, angle), (cols, rows))
+        frame.flags.writeable = False
+        self.frames[key] = frame
+        self.bytes += frame.nbytes
+
+        # evict the least recently used frames to stay within the limits;
+        # the frame that was just added always stays
+        while len(self.frames) > 1 and (len(self.frames) > self.maxEntries or self.bytes > self.maxBytes):
+            (_, evicted) = self.frames.popitem(last=False)
+            self.bytes -= evicted.nbytes
+        return frame
+
+
+    # Drop all of the cached frames; call this whenever the source layers
+    # change, e.g. when a new image is loaded or the window is resized
+    def clear(self):
+        self.frames.clear()
+        self.bytes = 0
+
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hitRate = 100.0 * self.hits / lookups if lookups else 0.0
+        return 'rotated frame cache: %d frames, %0.1f MB, %d hits, %d misses (%0.1f%% hit rate)' % \
+            (len(self.frames), self.bytes / (1024*1024), self.hits, self.misses, hitRate)
+
+
+# Draw a light-colored grid on a frame, in place. The grid is a fixed pattern
+# of rows and columns, so it is painted with strided slice assignments instead
+# of individual line draws.
+def drawGrid(frame, spacing=20, color=(64, 64, 64)):
+    frame[:, 1::spacing] = color
+    frame[1::spacing, :] = color
+
+
+# Draw an Nx4 array of line segments (x1, y1, x2, y2) on a frame, in place,
+# with a single batched polyline call
+def drawSegments(frame, segments, color, thickness=1):
+    if len(segments) == 0:
+        return
+    polylines = np.rint(np.asarray(segments)).astype(np.int32).reshape(-1, 2, 2)
+    cv.polylines(frame, polylines, False, color, thickness)
+
+
+# Make a Tk image of a reduced copy of an RGB image, e.g. for a thumbnail.
+# Parameters:
+#   image: the image
+#   size: the longer side of the reduced copy, in pixels
+def thumbnailPhoto(image, size=96):
+    (rows, cols) = image.shape[:2]
+    scale = size / max(rows, cols)
+    thumbnail = cv.resize(image, (max(1, int(cols * scale)), max(1, int(rows * scale))), interpolation=cv.INTER_AREA)
+    return ImageTk.PhotoImage(Image.fromarray(thumbnail))
+
+
+# Cover the outline of a circle with boxes, so that redrawing the outline only
+# touches the pixels near it rather than the whole area of the circle. The
+# circle is cut into horizontal bands; each band holds two short arcs of the
+# outline, one on either side, except where the arcs meet at the top and the
+# bottom.
+# Returns a list of (x1, y1, x2, y2) boxes
+def circleOutlineBoxes(centerX, centerY, radius, bands=16):
+    if radius < 2 * bands:
+        return [(centerX - radius, centerY - radius, centerX + radius, centerY + radius)]
+    boxes = []
+    for band in range(bands):
+        top = -radius + 2.0 * radius * band / bands
+        bottom = -radius + 2.0 * radius * (band + 1) / bands
+        near = 0.0 if top < 0 < bottom else min(abs(top), abs(bottom))
+        far = max(abs(top), abs(bottom))
+        outer = math.sqrt(radius * radius - near * near)
+        inner = math.sqrt(max(0.0, radius * radius - far * far))
+        y1 = int(math.floor(centerY + top))
+        y2 = int(math.ceil(centerY + bottom))
+        if inner < 2:
+            boxes.append((int(math.floor(centerX - outer)), y1, int(math.ceil(centerX + outer)), y2))
+        else:
+            boxes.append((int(math.floor(centerX - outer)), y1, int(math.ceil(centerX - inner)), y2))
+            boxes.append((int(math.floor(centerX + inner)), y1, int(math.ceil(centerX + outer)), y2))
+    return boxes
+
+
+# Composites cheap, frequently changing shapes (crop circles and rectangles)
+# over a cached base frame (the rotated image plus the grid and line
+# overlays). The base is only rebuilt when its key changes. Drawing the top
+# layer restores the regions the previous shapes covered from the base and
+# then draws the new shapes, so moving a crop circle only touches the pixels
+# around the old and the new circle.
+#
+# The frame returned by drawTop() is reused by the next call; consumers must
+# copy it (e.g. into a Tk image) before the next draw. After each draw, the
+# changed attribute lists the regions of the frame that differ from the
+# previous draw, so that consumers can copy only those; see FrameSink.
+class Compositor:
+
+    def __init__(self):
+        self.invalidate()
+
+
+    # Forget the base frame, e.g. when the source layers change
+    def invalidate(self):
+        self.baseKey = None
+        self.base = None
+        self.frame = None
+        self.dirty = []
+        self.newFrame = True
+        self.changed = None
+
+
+    # Select the base frame for the following draws.
+    # Parameters:
+    #   key: hashable description of everything that goes into the base
+    #   buildBase: function returning a new base frame; only called when the
+    #   key differs from the current one
+    def setBase(self, key, buildBase):
+        if key == self.baseKey and self.base is not None:
+            return
+        self.base = buildBase()
+        self.baseKey = key
+        self.frame = self.base.copy()
+        self.dirty = []
+        self.newFrame = True
+
+
+    # Draw the top layer over the base frame.
+    # Parameters:
+    #   shapes: list of shape tuples, either
+    #     ('circle', (centerX, centerY), radius, color, thickness) or
+    #     ('rectangle', (x1, y1), (x2, y2), color, thickness)
+    # Returns the composited frame
+    def drawTop(self, shapes):
+        (rows, cols) = self.frame.shape[:2]
+
+        # put back the pixels covered by the previous shapes; a new frame has
+        # changed everywhere
+        changed = None if self.newFrame else list(self.dirty)
+        self.newFrame = False
+        for (x1, y1, x2, y2) in self.dirty:
+            self.frame[y1:y2, x1:x2] = self.base[y1:y2, x1:x2]
+        self.dirty = []
+
+        for shape in shapes:
+            if shape[0] == 'circle':
+                (_, (centerX, centerY), radius, color, thickness) = shape
+                cv.circle(self.frame, (centerX, centerY), radius, color, thickness)
+                if thickness < 0:
+                    boxes = [(centerX - radius, centerY - radius, centerX + radius, centerY + radius)]
+                else:
+                    boxes = circleOutlineBoxes(centerX, centerY, radius)
+            elif shape[0] == 'rectangle':
+                (_, corner1, corner2, color, thickness) = shape
+                cv.rectangle(self.frame, corner1, corner2, color, thickness)
+                (left, top) = (min(corner1[0], corner2[0]), min(corner1[1], corner2[1]))
+                (right, bottom) = (max(corner1[0], corner2[0]), max(corner1[1], corner2[1]))
+                if thickness < 0:
+                    boxes = [(left, top, right, bottom)]
+                else:
+                    # an outline only covers the four edges
+                    boxes = [(left, top, right, top), (left, bottom, right, bottom), (left, top, left, bottom), (right, top, right, bottom)]
+            else:
+                continue
+
+            # remember the regions the shape covers, clipped to the frame
+            margin = max(thickness, 1) + 1
+            for (x1, y1, x2, y2) in boxes:
+                x1 = min(max(0, x1 - margin), cols)
+                y1 = min(max(0, y1 - margin), rows)
+                x2 = min(max(0, x2 + margin + 1), cols)
+                y2 = min(max(0, y2 + margin + 1), rows)
+                if x2 > x1 and y2 > y1:
+                    self.dirty.append((x1, y1, x2, y2))
+
+        self.changed = None if changed is None else changed + self.dirty
+        return self.frame
+
+
+# Frame sinks put the composited frames on the screen, or elsewhere. A sink
+# has a single method, present(frame, regions): frame is an RGB image, and
+# regions is a list of the (x1, y1, x2, y2) boxes of the frame that changed
+# since the previous call with the same frame object (see
+# Compositor.changed), or None if the whole frame may have changed. The frame
+# is copied before present() returns, so the caller may reuse it.
+
+# Shows frames on a Tk canvas through one long-lived Tk image. The image is
+# updated in place, only in the changed regions when those are small, rather
+# than being replaced by a new image for every frame. The canvas is resized to
+# fit the frame.
+class TkFrameSink:
+
+    # the changed regions are copied in one at a time while their total area
+    # is under this fraction of the frame; above it, the whole frame is
+    # copied in one go
+    partialUpdateLimit = 0.5
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.photo = None
+        self.item = canvas.create_image(0, 0, anchor='nw')
+        self.lastFrame = None
+
+
+    def present(self, frame, regions=None):
+        (rows, cols) = frame.shape[:2]
+        if self.photo is None or (self.photo.width(), self.photo.height()) != (cols, rows):
+            self.photo = ImageTk.PhotoImage('RGB', (cols, rows))
+            self.canvas.itemconfigure(self.item, image=self.photo)
+            self.canvas.configure(width=cols, height=rows)
+            regions = None
+        elif frame is not self.lastFrame:
+            regions = None
+        self.lastFrame = frame
+
+        if regions is not None and sum([(x2 - x1) * (y2 - y1) for (x1, y1, x2, y2) in regions]) < self.partialUpdateLimit * rows * cols:
+            # convert each region into a small scratch image, then copy that
+            # into place with the Tk image's own copy command
+            for (x1, y1, x2, y2) in regions:
+                tile = ImageTk.PhotoImage(Image.fromarray(np.ascontiguousarray(frame[y1:y2, x1:x2])))
+                self.canvas.tk.call(str(self.photo), 'copy', str(tile), '-to', x1, y1)
+        else:
+            self.photo.paste(Image.fromarray(frame))
+
+
+# Keeps the presented frames in memory instead of showing them, mirroring
+# the updates TkFrameSink would make; used to run the rendering pipeline
+# without a display, e.g. for benchmarking
+class OffscreenFrameSink:
+
+    def __init__(self):
+        self.frame = None
+        self.lastFrame = None
+        self.frames = 0
+        self.pixels = 0
+
+
+    def present(self, frame, regions=None):
+        (rows, cols) = frame.shape[:2]
+        if self.frame is None or self.frame.shape != frame.shape:
+            self.frame = np.empty_like(frame)
+            regions = None
+        elif frame is not self.lastFrame:
+            regions = None
+        self.lastFrame = frame
+        if regions is None:
+            regions = [(0, 0, cols, rows)]
+        for (x1, y1, x2, y2) in regions:
+            self.frame[y1:y2, x1:x2] = frame[y1:y2, x1:x2]
+            self.pixels += (x2 - x1) * (y2 - y1)
+        self.frames += 1
+
+
+    def __str__(self):
+        average = self.pixels / self.frames if self.frames else 0
+        return 'offscreen frame sink: %d frames, %0.0f pixels updated per frame' % (self.frames, average)
+
+
+# Schedules redraws on the Tk event loop. Any number of redraw requests made
+# before the next frame is rendered are merged into a single redraw, and
+# redraws are spaced out to stay under a maximum frame rate. The render
+# function always draws the latest state, so the intermediate states of a
+# mouse drag or a held-down key are simply dropped instead of queuing up.
+class RenderScheduler:
+
+    # Parameters:
+    #   widget: any Tk widget, used for after()/after_idle()
+    #   renderFunction: function that draws a frame
+    #   maxFrameRate: upper limit of frames per second
+    #   onFrame: optional function called after each frame with the
+    #   scheduler as its argument, e.g. to display the frame statistics
+    def __init__(self, widget, renderFunction, maxFrameRate=60, onFrame=None):
+        self.widget = widget
+        self.renderFunction = renderFunction
+        self.minFrameInterval = 1.0 / maxFrameRate
+        self.onFrame = onFrame
+        self.pending = None
+        self.lastFrameStart = 0.0
+        self.frameTimes = collections.deque(maxlen=120)
+        self.requests = 0
+        self.frames = 0
+
+
+    # Ask for a redraw; it happens on the next idle moment of the event loop,
+    # or once the frame interval has elapsed, whichever comes later
+    def request(self):
+        self.requests += 1
+        if self.pending is not None:
+            return
+        wait = self.lastFrameStart + self.minFrameInterval - time.perf_counter()
+        if wait <= 0:
+            self.pending = self.widget.after_idle(self.renderFrame)
+        else:
+            self.pending = self.widget.after(int(wait * 1000) + 1, self.renderFrame)
+
+
+    # Drop a pending redraw, if any
+    def cancel(self):
+        if self.pending is not None:
+            self.widget.after_cancel(self.pending)
+            self.pending = None
+
+
+    # Render a pending redraw right away
+    def flush(self):
+        if self.pending is not None:
+            self.cancel()
+            self.renderFrame()
+
+
+    def renderFrame(self):
+        self.pending = None
+        startTime = time.perf_counter()
+        self.renderFunction()
+        self.lastFrameStart = startTime
+        self.frameTimes.append(time.perf_counter() - startTime)
+        self.frames += 1
+        if self.onFrame:
+            self.onFrame(self)
+
+
+    def __str__(self):
+        if not self.frameTimes:
+            return 'no frames rendered'
+        average = sum(self.frameTimes) / len(self.frameTimes)
+        return 'frame time %0.1f ms avg, %0.1f ms max; %d redraw requests merged into %d frames' % \
+            (average * 1000, max(self.frameTimes) * 1000, self.requests, self.frames)
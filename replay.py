@@ -0,0 +1,168 @@
+import argparse
+import cv2 as cv
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+import analysiscache
+import batch
+import loader
+import recipe
+
+
+# Expand the input arguments into a sorted list of recipe filenames; each
+# argument may be a recipe file, a directory to search for recipes, or a glob
+# pattern
+def findRecipeFiles(inputSpecs):
+    filenames = []
+    for inputSpec in inputSpecs:
+        if os.path.isdir(inputSpec):
+            for (directory, _, names) in os.walk(inputSpec):
+                filenames += [os.path.join(directory, name) for name in names if name.endswith(recipe.recipeExtension)]
+        else:
+            filenames += glob.glob(inputSpec)
+    return sorted(set([f for f in filenames if os.path.isfile(f)]))
+
+
+# Work out where a recipe's source scan is now: where it was when the recipe
+# was written or, failing that, a file with the same name in one of the
+# search directories
+def findSource(editRecipe, sourceDirs):
+    if os.path.exists(editRecipe['source']):
+        return editRecipe['source']
+    for directory in sourceDirs:
+        candidate = os.path.join(directory, os.path.basename(editRecipe['source']))
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+# Regenerate one output image from its recipe. This function runs in a worker
+# process.
+# Parameters:
+#   job: tuple of (recipe filename, output directory, output format,
+#   maximum size, source search directories, verify); output directory and
+#   format default to the ones in the recipe when None; maximum size limits
+#   the larger dimension of the output, 0 for no limit; verify checks the
+#   source file's hash against the recipe
+# Returns a dictionary summarizing the outcome for the recipe
+def processRecipe(job):
+    (recipeFilename, outputDir, outputFormat, maxSize, sourceDirs, verify) = job
+    summary = { 'input': recipeFilename, 'output': None, 'status': 'ok', 'angle': None, 'crop': None, 'size': None }
+    startTime = time.time()
+
+    def finish(status=None):
+        if status:
+            summary['status'] = status
+        summary['time'] = time.time() - startTime
+        return summary
+
+    try:
+        editRecipe = recipe.readRecipe(recipeFilename)
+    except (OSError, ValueError) as e:
+        return finish('failed: %s' % (str(e)))
+    summary['angle'] = editRecipe['angle']
+    summary['crop'] = editRecipe['crop']['type']
+
+    # the output goes next to the recipe unless another directory is given
+    if outputDir is None:
+        outputDir = os.path.dirname(recipeFilename)
+    outputFilename = batch.outputFilenameFor(editRecipe['output']['filename'], outputDir, outputFormat)
+    summary['output'] = outputFilename
+    if os.path.exists(outputFilename):
+        return finish('skipped: output already exists')
+
+    sourceFilename = findSource(editRecipe, sourceDirs)
+    if sourceFilename is None:
+        return finish('failed: source "%s" not found' % (editRecipe['source']))
+    if verify and analysiscache.fileHash(sourceFilename) != editRecipe['sourceHash']:
+        return finish('failed: source "%s" changed since the recipe was written' % (sourceFilename))
+
+    # only the cropped region is read from memory mapped sources
+    image = loader.openFull(sourceFilename)
+    if image is None:
+        return finish('failed: could not read "%s"' % (sourceFilename))
+    summary['size'] = (image.shape[1], image.shape[0])
+    outputImage = recipe.applyRecipe(editRecipe, image)
+
+    # shrink the output to the requested size, or to the size it was
+    # shrunk to when the recipe was replayed before
+    maxSize = maxSize or editRecipe['output'].get('maxSize', 0)
+    (rows, cols) = outputImage.shape[:2]
+    if maxSize and max(rows, cols) > maxSize:
+        scale = maxSize / max(rows, cols)
+        outputImage = cv.resize(outputImage, (max(1, int(cols * scale)), max(1, int(rows * scale))), interpolation=cv.INTER_AREA)
+
+    try:
+        if not cv.imwrite(outputFilename, outputImage):
+            return finish('failed: could not write output')
+    except cv.error as e:
+        return finish('failed: %s' % (str(e).strip()))
+
+    # the new output gets its own recipe, pointing at the same source
+    newRecipe = dict(editRecipe)
+    newRecipe['source'] = os.path.abspath(sourceFilename)
+    newRecipe['output'] = dict(editRecipe['output'], filename=os.path.basename(outputFilename))
+    if maxSize:
+        newRecipe['output']['maxSize'] = maxSize
+    recipe.writeRecipe(outputFilename, newRecipe)
+
+    return finish()
+
+
+# Run processRecipe() on one job and turn any exception, e.g. from a recipe
+# with a malformed crop, into a failed summary
+def tryProcessRecipe(job):
+    startTime = time.time()
+    try:
+        return processRecipe(job)
+    except Exception as e:
+        return { 'input': job[0], 'output': None, 'status': 'failed: %s' % (batch.describeError(e)),
+            'angle': None, 'crop': None, 'size': None, 'time': time.time() - startTime }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Regenerate rotated and cropped images from their edit recipes, without any re-analysis')
+    parser.add_argument('recipes', nargs='+', help='recipe files (*%s), directories to search for them, or glob patterns' % (recipe.recipeExtension))
+    parser.add_argument('-o', '--output-dir', default=None, help='directory where the images will be saved (default: next to each recipe)')
+    parser.add_argument('-f', '--format', default=None, help='output image format extension, e.g. "png" (default: same as the original output)')
+    parser.add_argument('-s', '--max-size', type=int, default=0, help='scale the outputs down so that neither dimension exceeds this many pixels')
+    parser.add_argument('-d', '--source-dir', action='append', default=[], help='directory to look in for source scans that have moved; may be given more than once')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='number of worker processes (default: number of cores)')
+    parser.add_argument('--no-verify', action='store_true', help='skip checking that the source scans are unchanged')
+    args = parser.parse_args(argv)
+
+    recipeFilenames = findRecipeFiles(args.recipes)
+    if not recipeFilenames:
+        print('no edit recipes found')
+        return 1
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    jobs = [(f, args.output_dir, args.format, args.max_size, args.source_dir, not args.no_verify) for f in recipeFilenames]
+    workers = max(1, min(args.workers, len(jobs)))
+    print('replaying %d recipes with %d worker processes...' % (len(jobs), workers))
+
+    startTime = time.time()
+    summaries = []
+    with multiprocessing.Pool(workers, initializer=batch.initWorker) as pool:
+        for summary in pool.imap_unordered(tryProcessRecipe, jobs):
+            batch.printSummary(summary)
+            summaries.append(summary)
+    elapsed = time.time() - startTime
+
+    succeeded = len([s for s in summaries if s['status'] == 'ok'])
+    skipped = len([s for s in summaries if s['status'].startswith('skipped')])
+    failed = len(summaries) - succeeded - skipped
+    print('=====================')
+    print('%d replayed, %d skipped, %d failed in %0.2f sec (%0.2f images/sec)' %
+        (succeeded, skipped, failed, elapsed, len(summaries) / elapsed if elapsed > 0 else 0.0))
+
+    return 0 if failed == 0 else 2
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
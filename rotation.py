@@ -1,11 +1,33 @@
 import cv2 as cv
-import numpy as np
 import screeninfo
 
+import analysis
+import analysiscache
 import key_codes as key
-
-
-def assistedImageRotation(image):
+import render
+import tracing
+
+
+# Rotate an image about its center point.
+# Parameters:
+#   image: the image to be rotated
+#   angle: rotation angle in degrees; positive values rotate counter-clockwise
+# Returns the rotated image, the same dimensions as the original
+def rotateImage(image, angle):
+    (rows, cols) = image.shape[:2]
+    M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
+    with tracing.span('warpAffine', size=(rows, cols)):
+        return cv.warpAffine(image, M, (cols, rows))
+
+
+# Interactively select the rotation angle for an image.
+# Parameters:
+#   image: the image to be rotated
+#   angleBinSize: width of the angle bins, in degrees
+#   contentHash: hash of the image file (see analysiscache.fileHash()); when
+#   given, the line analysis is looked up in and saved to the analysis cache
+# Returns the selected angle in degrees, or None if the user quit
+def assistedAngleSelection(image, angleBinSize=1.0, contentHash=None):
     windowName = "MobyCAIRO - Assisted Image Rotation"
 
     # create window
@@ -19,50 +41,22 @@ def assistedImageRotation(image):
     ratio = max(minDimension / image.shape[0], minDimension / image.shape[1])
     windowWidth = int(image.shape[1] * ratio)
     windowHeight = int(image.shape[0] * ratio)
-    scaledImage = cv.resize(image, (windowWidth, windowHeight))
+    with tracing.span('resize'):
+        scaledImage = cv.resize(image, (windowWidth, windowHeight))
     cv.moveWindow(windowName, screenWidth-windowWidth, 0)
     print("scaled %dx%d -> %dx%d for display" % (image.shape[1], image.shape[0], windowWidth, windowHeight))
 
-    # create an image for Hough line analysis
-    lineAnalyzerImage = cv.cvtColor(scaledImage, cv.COLOR_BGR2GRAY)
-    lineAnalyzerImage = cv.GaussianBlur(lineAnalyzerImage, (7, 7), 0)
-
-    # adapting the pipeline described in this Stack Overflow answer:
-    #  https://stackoverflow.com/a/45560545/475067
-    lowThreshold = 50
-    highThreshold = 150
-    edges = cv.Canny(lineAnalyzerImage, lowThreshold, highThreshold)
+    # find the straight lines in the image and organize them by angle
+    cacheParameters = (angleBinSize, scaledImage.shape[:2])
+    cached = analysiscache.defaultCache.get(contentHash, 'displayLines', cacheParameters)
+    if cached is not None:
+        (edges, lineListByLength, lengths) = analysiscache.unpackLines(cached)
+    else:
+        (edges, lineListByLength, lengths) = analysis.straightLineAnalysis(scaledImage, angleBinSize)
+        analysiscache.defaultCache.put(contentHash, 'displayLines', cacheParameters, analysiscache.packLines(edges, lineListByLength, lengths))
     edgesImage = cv.cvtColor(edges, cv.COLOR_GRAY2BGR)
-    edgesImage = cv.resize(edgesImage, (windowWidth, windowHeight))
-    rho = 1
-    theta = np.pi / 180
-    threshold = 15
-    minLineLength = 50
-    maxLineGap = 20
-    lines = cv.HoughLinesP(edges, rho, theta, threshold, np.array([]), minLineLength=minLineLength, maxLineGap=maxLineGap)
-    print("found %d line segments using probabilistic Hough line transform" % (len(lines)))
-
-    # organize the line segments into bins according to their angles
-    lineList = {}
-    for line in lines[:]:
-        for (x1, y1, x2, y2) in line:
-            dx = x2 - x1
-            dy = y2 - y1
-            theta = round(np.arctan(dy/dx) * 180/np.pi)
-            if theta not in lineList:
-                lineList[theta] = { 'lines': set(), 'total': 0.0 }
-            lineList[theta]['lines'].add((x1, y1, x2, y2))
-            lineList[theta]['total'] += np.sqrt(np.square(dx) + np.square(dy))
-
-    # organize the line list according to the most distance represented per angle
-    lineListByLength = {}
-    for angle in lineList.keys():
-        lineItem = lineList[angle]
-        lineListByLength[lineItem['total']] = { 'lines': lineItem['lines'], 'angle': angle * 1.0 }
-    lengths = lineListByLength.keys()
-    lengths = sorted(lengths)
-    lengths.reverse()
-    print("sorted %d line segments into %d angles" % (len(lines), len(lengths)))
+    segmentCount = sum([len(lineListByLength[length]['lines']) for length in lengths])
+    print("sorted %d line segments into %d angles" % (segmentCount, len(lengths)))
 
     print("""=====================
 Rotation interface:
@@ -80,35 +74,32 @@ Rotation interface:
 
     index = 0
     displayLines = False
+    frameCache = render.RotatedFrameCache()
 
     # input loop
     while True:
-        # choose which image to display: real image or the computed edges
+        # rotate the image so that the angle of the computed lines is parallel
+        # to the horizontal; choose which image to display: real image or the
+        # computed edges
+        angle = lineListByLength[lengths[index]]['angle']
         if displayLines:
-            displayImage = edgesImage.copy()
+            displayImage = frameCache.get('edges', edgesImage, angle).copy()
         else:
-            displayImage = scaledImage.copy()
-        
-        # draw the lines computed from the Hough transform
-        for line in lineListByLength[lengths[index]]['lines']:
-            (x1, y1, x2, y2) = line
-            cv.line(displayImage, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            displayImage = frameCache.get('image', scaledImage, angle).copy()
 
-        # rotate the image so that the angle of the computed lines is parallel to the horizontal
-        (rows, cols, _) = displayImage.shape
-        angle = lineListByLength[lengths[index]]['angle']
-        M = cv.getRotationMatrix2D(((cols-1)/2.0, (rows-1)/2.0), angle, 1)
-        displayImage = cv.warpAffine(displayImage, M, (cols, rows))
+        # draw the lines computed from the Hough transform, rotated to match
+        # the image
+        M = render.rotationMatrix(windowWidth, windowHeight, angle)
+        lines = render.transformSegments(lineListByLength[lengths[index]]['lines'], M)
+        render.drawSegments(displayImage, lines, (0, 0, 255), 2)
 
         # draw a light-colored grid
         if not displayLines:
-            for x in range(1, windowWidth, 20):
-                cv.line(displayImage, (x, 0), (x, windowHeight), (64, 64, 64), 1)
-            for y in range(1, windowHeight, 20):
-                cv.line(displayImage, (0, y), (windowWidth, y), (64, 64, 64), 1)
+            render.drawGrid(displayImage)
 
         # display the image
-        cv.imshow(windowName, displayImage)
+        with tracing.span('imshow'):
+            cv.imshow(windowName, displayImage)
         print('\r', end='')
         print('rotation # %d/%d (%3.1f degrees)    ' % (index+1, len(lineListByLength), angle), end='', flush=True)
 
@@ -144,15 +135,20 @@ Rotation interface:
     cv.destroyWindow(windowName)
     print()
 
-    if keyCode == key.ESC:
-        return None
-    elif keyCode == key.ENTER:
-        # perform final rotation on the original image
-        (rows, cols, _) = image.shape
-        M = cv.getRotationMatrix2D(((cols-1)/2.0,(rows-1)/2.0),lineListByLength[lengths[index]]['angle'],1)
-        image = cv.warpAffine(image, M, (cols, rows))
-        return image
+    if keyCode == key.ENTER:
+        return lineListByLength[lengths[index]]['angle']
     else:
         return None
 
 
+# Interactively rotate an image.
+# Returns the rotated image, or None if the user quit
+def assistedImageRotation(image, angleBinSize=1.0):
+    angle = assistedAngleSelection(image, angleBinSize)
+    if angle is None:
+        return None
+
+    # perform final rotation on the original image
+    return rotateImage(image, angle)
+
+
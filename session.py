@@ -0,0 +1,200 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+import numpy as np
+
+
+# A review session works through a list of scans one after the other. While
+# one scan is being edited, the next few are decoded and analyzed in a small
+# pool of background threads, so that moving on to the next scan does not
+# have to wait for the decode and the line analysis. The prefetched results
+# are bounded both in number and in bytes; the ones farthest ahead of the
+# current scan are dropped first.
+
+
+imageExtensions = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp']
+
+
+# Expand a folder into the sorted list of the image files in it
+def imagesInFolder(folder):
+    filenames = [os.path.join(folder, f) for f in os.listdir(folder)]
+    return sorted([f for f in filenames if os.path.isfile(f) and os.path.splitext(f)[1].lower() in imageExtensions])
+
+
+# Total size of the arrays held in a result, however deeply nested in tuples,
+# lists and dictionaries
+def resultBytes(result):
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (tuple, list)):
+        return sum([resultBytes(item) for item in result])
+    if isinstance(result, dict):
+        return sum([resultBytes(item) for item in result.values()])
+    return 0
+
+
+class Prefetcher:
+
+    # Parameters:
+    #   load: function(filename) decoding and analyzing one scan; runs in a
+    #   pool thread and returns the result handed back by take()
+    #   workers: number of pool threads
+    #   depth: how many scans past the current one are prefetched
+    #   maxBytes: limit for the prefetched results, see resultBytes()
+    def __init__(self, load, workers=2, depth=3, maxBytes=512*1024*1024):
+        self.load = load
+        self.depth = depth
+        self.maxBytes = maxBytes
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='prefetch')
+        self.lock = threading.Lock()
+
+        # filename -> future, for the scans in the window ahead of the
+        # current one; completed futures hold their results
+        self.futures = collections.OrderedDict()
+        self.bytes = {}
+
+        # size of the most recent result, to estimate the size of the
+        # results still to come
+        self.lastBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    # Start prefetching the scans that follow the current one and forget the
+    # ones that are no longer ahead of it.
+    # Parameters:
+    #   filenames: the scans of the session, in order
+    #   index: the index of the current scan
+    def update(self, filenames, index):
+        wanted = filenames[index + 1:index + 1 + self.depth]
+        with self.lock:
+            for filename in list(self.futures.keys()):
+                if filename not in wanted:
+                    self.futures.pop(filename).cancel()
+                    self.bytes.pop(filename, None)
+            # no more scans are started than are expected to fit in maxBytes,
+            # but the next scan is always prefetched
+            expectedBytes = sum(self.bytes.values()) + self.lastBytes * len([f for f in self.futures.values() if not f.done()])
+            started = []
+            for filename in wanted:
+                if filename not in self.futures:
+                    if self.futures and expectedBytes + self.lastBytes > self.maxBytes:
+                        break
+                    expectedBytes += self.lastBytes
+                    future = self.executor.submit(self.load, filename)
+                    self.futures[filename] = future
+                    started.append((filename, future))
+            self.futures = collections.OrderedDict([(f, self.futures[f]) for f in wanted if f in self.futures])
+
+        # a load that already finished runs its callback right away, which
+        # takes the lock; so the callbacks are only added once it is released
+        for (filename, future) in started:
+            future.add_done_callback(lambda future, filename=filename: self.loaded(filename, future))
+
+
+    # Pool thread: account for a finished result and keep within maxBytes by
+    # dropping the results farthest ahead
+    def loaded(self, filename, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self.lock:
+            if self.futures.get(filename) is not future:
+                return
+            self.bytes[filename] = self.lastBytes = resultBytes(future.result())
+            for farthest in reversed(list(self.futures.keys())):
+                if sum(self.bytes.values()) <= self.maxBytes or farthest == next(iter(self.futures)):
+                    break
+                if farthest in self.bytes:
+                    self.futures.pop(farthest)
+                    self.bytes.pop(farthest)
+
+
+    # Take the prefetch of a scan out of the window.
+    # Returns the future of the scan's load, which may still be running, or
+    # None if the scan was not prefetched
+    def take(self, filename):
+        with self.lock:
+            future = self.futures.pop(filename, None)
+            self.bytes.pop(filename, None)
+        if future is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return future
+
+
+    # The result of a prefetched scan, without taking it out of the window.
+    # Returns None unless the scan's load finished successfully
+    def peek(self, filename):
+        with self.lock:
+            future = self.futures.get(filename)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+
+    # The scans whose results are ready
+    def ready(self):
+        with self.lock:
+            return [filename for (filename, future) in self.futures.items() if future.done() and not future.cancelled()]
+
+
+    def pending(self):
+        with self.lock:
+            return len([future for future in self.futures.values() if not future.done()])
+
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+            self.bytes.clear()
+        self.executor.shutdown(wait=False)
+
+
+    def __str__(self):
+        with self.lock:
+            (count, total) = (len(self.bytes), sum(self.bytes.values()))
+        return 'prefetch: %d ready, %0.1f MB, %d hits, %d misses' % (count, total / (1024*1024), self.hits, self.misses)
+
+
+# The scans of a review session, the position in the list and a thumbnail of
+# every scan seen so far
+class Session:
+
+    # Parameters:
+    #   filenames: the scans to review, in order
+    #   load: see Prefetcher
+    #   workers, depth, maxBytes: see Prefetcher
+    def __init__(self, filenames, load, workers=2, depth=3, maxBytes=512*1024*1024):
+        self.filenames = list(filenames)
+        self.index = 0
+        self.thumbnails = {}
+        self.done = set()
+        self.prefetcher = Prefetcher(load, workers, depth, maxBytes)
+
+
+    def current(self):
+        return self.filenames[self.index]
+
+
+    def hasNext(self):
+        return self.index + 1 < len(self.filenames)
+
+
+    # Move to another scan of the session and start prefetching the ones
+    # after it.
+    # Returns the future of the scan's load if it was prefetched, see
+    # Prefetcher.take()
+    def moveTo(self, index):
+        self.index = index
+        future = self.prefetcher.take(self.filenames[index])
+        self.prefetcher.update(self.filenames, index)
+        return future
+
+
+    def close(self):
+        self.prefetcher.shutdown()
@@ -0,0 +1,121 @@
+import queue
+import threading
+import traceback
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+# Runs a long computation in a background thread while the Tk main loop keeps
+# running. OpenCV releases the GIL inside its functions, so the computation
+# really does run in parallel with the UI.
+#
+# The work function receives a progress function which it should call between
+# stages as progress(fraction, message); fraction runs from 0.0 to 1.0. Once
+# the task has been cancelled, the next call to progress() raises
+# TaskCancelled, which ends the work function.
+#
+# Results, progress updates and errors are passed back through a queue that is
+# polled from the Tk main loop with after(), so all of the callbacks run on the
+# main thread and are free to touch the UI.
+class BackgroundTask:
+
+    # Parameters:
+    #   widget: any Tk widget, used for after()
+    #   work: function(progress) performing the computation; its return value
+    #   is handed to onDone
+    #   onDone: function(result), called when the work function returns
+    #   onProgress: optional function(fraction, message)
+    #   onError: optional function(exception, traceback text); the default
+    #   prints the traceback
+    #   onFinished: optional function(task), called after the task ended for
+    #   any reason, including cancellation
+    #   pollInterval: milliseconds between checks of the result queue
+    def __init__(self, widget, work, onDone, onProgress=None, onError=None, onFinished=None, pollInterval=50):
+        self.widget = widget
+        self.work = work
+        self.onDone = onDone
+        self.onProgress = onProgress
+        self.onError = onError
+        self.onFinished = onFinished
+        self.pollInterval = pollInterval
+        self.results = queue.Queue()
+        self.cancelEvent = threading.Event()
+        self.finished = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.pollId = self.widget.after(self.pollInterval, self.poll)
+
+
+    # Ask the task to stop; none of its callbacks, other than onFinished,
+    # are called after this
+    def cancel(self):
+        if self.finished:
+            return
+        self.cancelEvent.set()
+        self.finish()
+
+
+    def isCancelled(self):
+        return self.cancelEvent.is_set()
+
+
+    # Called from the worker thread
+    def progress(self, fraction, message):
+        if self.cancelEvent.is_set():
+            raise TaskCancelled()
+        self.results.put(('progress', fraction, message))
+
+
+    # Worker thread body
+    def run(self):
+        try:
+            result = self.work(self.progress)
+            self.results.put(('done', result))
+        except TaskCancelled:
+            self.results.put(('cancelled',))
+        except Exception as e:
+            self.results.put(('error', e, traceback.format_exc()))
+
+
+    # Main thread: deliver whatever the worker thread has produced so far
+    def poll(self):
+        self.pollId = None
+        if self.finished:
+            return
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.cancelEvent.is_set():
+                return
+            if item[0] == 'progress':
+                if self.onProgress:
+                    self.onProgress(item[1], item[2])
+            elif item[0] == 'done':
+                self.finish()
+                self.onDone(item[1])
+                return
+            elif item[0] == 'error':
+                self.finish()
+                if self.onError:
+                    self.onError(item[1], item[2])
+                else:
+                    print(item[2])
+                return
+            elif item[0] == 'cancelled':
+                self.finish()
+                return
+        self.pollId = self.widget.after(self.pollInterval, self.poll)
+
+
+    def finish(self):
+        self.finished = True
+        if self.pollId is not None:
+            self.widget.after_cancel(self.pollId)
+            self.pollId = None
+        if self.onFinished:
+            self.onFinished(self)
@@ -0,0 +1,201 @@
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+
+
+# Lightweight timing of the stages of the image pipeline (decoding, color
+# conversion, blurring, edge detection, the Hough transforms, line binning,
+# warping, Tk image conversion, encoding). Each stage is wrapped in a span:
+#
+#   with tracing.span('Canny'):
+#       edges = cv.Canny(...)
+#
+# Tracing is off by default, in which case span() returns a shared do-nothing
+# context manager and the only cost is one function call per stage. Turn it on
+# by setting the MOBYCAIRO_TRACE environment variable, or by passing
+# "--trace <filename>" to the programs, see enableFromArguments(). The value is
+# the name of a file that receives a Chrome trace (JSON trace event format)
+# when the program exits; open it with chrome://tracing or
+# https://ui.perfetto.dev to see the stages on a timeline, one track per
+# thread. Per-stage totals are also kept, for the GUI's status bar.
+
+
+# Times a single occurrence of a stage; created by Tracer.span()
+class Span:
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+
+    def __exit__(self, excType, excValue, excTraceback):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+# Stands in for Span while tracing is off
+class NullSpan:
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, excTraceback):
+        return False
+
+
+nullSpan = NullSpan()
+
+
+class Tracer:
+
+    # Parameters:
+    #   maxEvents: only the most recent events are kept for the trace file,
+    #   so a long session does not grow without bound; the per-stage totals
+    #   cover the whole session
+    def __init__(self, maxEvents=500000):
+        self.enabled = False
+        self.filename = None
+        self.origin = time.perf_counter_ns()
+        self.events = collections.deque(maxlen=maxEvents)
+        self.threadNames = {}
+        self.lock = threading.Lock()
+
+        # stage name -> [count, total nanoseconds, last nanoseconds]
+        self.stages = {}
+
+
+    # Turn tracing on.
+    # Parameters:
+    #   filename: where to write the Chrome trace when the program exits, or
+    #   None to only keep the per-stage totals
+    def enable(self, filename=None):
+        if filename and self.filename is None:
+            atexit.register(self.writeOnExit)
+        self.filename = filename or self.filename
+        self.enabled = True
+
+
+    # Time a stage with a "with" block.
+    # Parameters:
+    #   name: name of the stage, e.g. 'Canny'
+    #   args: optional values shown with the event in the trace viewer, e.g.
+    #   the size of the image
+    def span(self, name, **args):
+        if not self.enabled:
+            return nullSpan
+        return Span(self, name, args)
+
+
+    # Record a finished span; start and end are from time.perf_counter_ns()
+    def record(self, name, start, end, args=None):
+        thread = threading.current_thread()
+        with self.lock:
+            self.events.append((name, start, end, thread.ident, args))
+            self.threadNames[thread.ident] = thread.name
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0, 0]
+            stage[0] += 1
+            stage[1] += end - start
+            stage[2] = end - start
+
+
+    # Forget the per-stage totals, e.g. when a new image is loaded; the
+    # events for the trace file are kept
+    def resetStages(self):
+        with self.lock:
+            self.stages = {}
+
+
+    # Describe the stages that took the most time, one per line.
+    # Parameters:
+    #   limit: the maximum number of stages to list
+    def summary(self, limit=8):
+        with self.lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+        if not stages:
+            return 'no stages traced'
+        lines = []
+        for (name, (count, total, last)) in stages[:limit]:
+            lines.append('%s: %0.1f ms last, %0.1f ms total (%d)' % (name, last / 1e6, total / 1e6, count))
+        return '\n'.join(lines)
+
+
+    # Build the trace in the Chrome trace event format, which Perfetto reads
+    # as well; timestamps are in microseconds since the tracer was created
+    def chromeTrace(self):
+        with self.lock:
+            events = list(self.events)
+            threadNames = dict(self.threadNames)
+        pid = os.getpid()
+        traceEvents = []
+        for (tid, threadName) in threadNames.items():
+            traceEvents.append({ 'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': { 'name': threadName } })
+        for (name, start, end, tid, args) in events:
+            event = { 'name': name, 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': (start - self.origin) / 1000.0, 'dur': (end - start) / 1000.0 }
+            if args:
+                event['args'] = { key: str(value) for (key, value) in args.items() }
+            traceEvents.append(event)
+        return { 'traceEvents': traceEvents, 'displayTimeUnit': 'ms' }
+
+
+    def writeChromeTrace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.chromeTrace(), f)
+
+
+    def writeOnExit(self):
+        if not self.filename:
+            return
+        try:
+            self.writeChromeTrace(self.filename)
+            print('wrote trace of %d events to "%s"' % (len(self.events), self.filename))
+        except OSError as e:
+            print('could not write the trace: %s' % (str(e)))
+
+
+    def __str__(self):
+        return self.summary()
+
+
+# The tracer shared by the whole program
+defaultTracer = Tracer()
+if os.environ.get('MOBYCAIRO_TRACE'):
+    defaultTracer.enable(os.environ['MOBYCAIRO_TRACE'])
+
+
+# Time a stage with the shared tracer; see Tracer.span()
+def span(name, **args):
+    if not defaultTracer.enabled:
+        return nullSpan
+    return Span(defaultTracer, name, args)
+
+
+def isEnabled():
+    return defaultTracer.enabled
+
+
+# Turn tracing on if a "--trace <filename>" option is present in a list of
+# command line arguments. The option is removed from the list, so that
+# programs which read their arguments by position are unaffected.
+def enableFromArguments(argv):
+    if '--trace' not in argv:
+        return
+    i = argv.index('--trace')
+    if i + 1 >= len(argv):
+        del argv[i]
+        defaultTracer.enable()
+        return
+    defaultTracer.enable(argv[i + 1])
+    del argv[i:i + 2]
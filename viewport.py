@@ -0,0 +1,305 @@
+import collections
+import cv2 as cv
+import math
+import numpy as np
+
+import imagesource
+import tracing
+
+
+# A zoomable, pannable view of the rotated image. The rotated image is never
+# computed as a whole; it is cut into square tiles, and only the tiles under
+# the visible part of the view are warped, each one straight from the
+# unrotated image in a single affine transform. The tiles come from a
+# multi-resolution pyramid of the unrotated image, whose reduced levels are
+# built the first time they are needed, and the view always samples the
+# coarsest level that still has at least the resolution of the screen. Warped
+# tiles are kept in a bounded least-recently-used cache, so panning around
+# only warps the tiles that come into view.
+#
+# Coordinates: "full" coordinates are the pixel coordinates of the rotated
+# full-resolution image, the same coordinates that the crop regions are kept
+# in; "display" coordinates are the pixels of the rendered view.
+# display = zoom * (full - origin), where the origin is the full coordinate
+# of the upper left corner of the view.
+
+
+# One layer of the view, e.g. the image or its edge map, with its pyramid
+# levels; each level is a tuple of (image, scale, conversion):
+#   image: the unrotated layer at the level's resolution; an array or an
+#   image source, see imagesource.py
+#   scale: full-resolution pixels per pixel of the level
+#   conversion: cv.cvtColor() code turning the level's pixels into the RGB
+#   of the view, or None if they already are
+class Layer:
+
+    def __init__(self, image, scale, conversion=None, tileSize=256):
+        self.levels = [(image, scale, conversion)]
+        self.tileSize = tileSize
+        self.fullyBuilt = False
+
+
+    # Add a finer source for the layer, e.g. the full-resolution image once
+    # it has been opened
+    def addSource(self, image, scale, conversion=None):
+        self.levels.append((image, scale, conversion))
+        self.levels.sort(key=lambda level: level[1])
+
+
+    # Build the next reduced level from the coarsest one, half its size;
+    # returns False once the coarsest level fits in a tile
+    def buildCoarserLevel(self):
+        (image, scale, conversion) = self.levels[-1]
+        (rows, cols) = image.shape[:2]
+        if self.fullyBuilt or max(rows, cols) <= self.tileSize:
+            self.fullyBuilt = True
+            return False
+        with tracing.span('buildLevel', scale=scale * 2):
+            reduced = imagesource.resize(image, (max(1, cols // 2), max(1, rows // 2)))
+        self.levels.append((reduced, scale * cols / max(1, cols // 2), conversion))
+        return True
+
+
+    # Choose the coarsest level with at least the given resolution, building
+    # reduced levels as needed; past the finest level, the finest is used.
+    # Parameters:
+    #   zoom: display pixels per full-resolution pixel
+    def levelFor(self, zoom):
+        while 1.0 / self.levels[-1][1] > zoom and self.buildCoarserLevel():
+            pass
+        for level in reversed(self.levels):
+            if 1.0 / level[1] >= zoom * 0.999:
+                return level
+        return self.levels[0]
+
+
+class Viewport:
+
+    # Parameters:
+    #   tileSize: the width and height of the tiles, in level pixels
+    #   maxBytes: limit for the cache of warped tiles
+    #   maxZoom: display pixels per full-resolution pixel at the largest zoom
+    def __init__(self, tileSize=256, maxBytes=96*1024*1024, maxZoom=8.0):
+        self.tileSize = tileSize
+        self.maxBytes = maxBytes
+        self.maxZoom = maxZoom
+        self.tiles = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.setImage(1, 1)
+        self.setWindow(1, 1)
+
+
+    # Start viewing a new image; this drops the layers and the cached tiles
+    # and goes back to fitting the whole image in the window.
+    # Parameters:
+    #   fullWidth, fullHeight: size of the full-resolution image
+    def setImage(self, fullWidth, fullHeight):
+        self.fullWidth = fullWidth
+        self.fullHeight = fullHeight
+        self.layers = {}
+        self.clearTiles()
+        self.zoom = None
+
+
+    # Add a layer, or another source for an existing layer; see Layer
+    def addLayer(self, name, image, scale, conversion=None):
+        if name in self.layers:
+            self.layers[name].addSource(image, scale, conversion)
+            self.clearTiles()
+        else:
+            self.layers[name] = Layer(image, scale, conversion, self.tileSize)
+
+
+    def clearTiles(self):
+        self.tiles.clear()
+        self.bytes = 0
+
+
+    # Set the size of the rendered view, in display pixels
+    def setWindow(self, width, height):
+        self.width = max(1, int(width))
+        self.height = max(1, int(height))
+        if self.zoom is not None:
+            self.zoom = max(self.zoom, self.fitZoom())
+            self.clampOrigin()
+
+
+    # The zoom at which the whole image fits in the window
+    def fitZoom(self):
+        return min(self.width / self.fullWidth, self.height / self.fullHeight)
+
+
+    def isZoomed(self):
+        return self.zoom is not None
+
+
+    # Change the zoom, keeping one point of the view in place.
+    # Parameters:
+    #   factor: multiplies the current zoom; the zoom stops at fitting the
+    #   whole image and at maxZoom, and going back down to the fit zoom
+    #   leaves the zoomed view
+    #   anchorX, anchorY: the display point to keep in place; the center of
+    #   the view by default
+    def zoomBy(self, factor, anchorX=None, anchorY=None):
+        fitZoom = self.fitZoom()
+        if self.zoom is None:
+            # the fit view is centered in the window
+            self.zoom = fitZoom
+            self.originX = (self.fullWidth - self.width / fitZoom) / 2
+            self.originY = (self.fullHeight - self.height / fitZoom) / 2
+        anchorX = self.width / 2 if anchorX is None else anchorX
+        anchorY = self.height / 2 if anchorY is None else anchorY
+        (fullX, fullY) = self.toFull(anchorX, anchorY)
+
+        zoom = min(max(self.zoom * factor, fitZoom), max(self.maxZoom, fitZoom))
+        if zoom <= fitZoom * 1.0001:
+            self.zoom = None
+            return
+        self.zoom = zoom
+        self.originX = fullX - anchorX / zoom
+        self.originY = fullY - anchorY / zoom
+        self.clampOrigin()
+
+
+    # Leave the zoomed view
+    def reset(self):
+        self.zoom = None
+
+
+    # Move the view by a distance in display pixels
+    def pan(self, deltaX, deltaY):
+        if self.zoom is None:
+            return
+        self.originX -= deltaX / self.zoom
+        self.originY -= deltaY / self.zoom
+        self.clampOrigin()
+
+
+    # Move the view so that a full-resolution point is in its center
+    def centerOn(self, fullX, fullY):
+        if self.zoom is None:
+            return
+        self.originX = fullX - self.width / (2 * self.zoom)
+        self.originY = fullY - self.height / (2 * self.zoom)
+        self.clampOrigin()
+
+
+    # Keep the image under the view; an image smaller than the view is
+    # centered in it
+    def clampOrigin(self):
+        for (axis, fullSize, windowSize) in [('originX', self.fullWidth, self.width), ('originY', self.fullHeight, self.height)]:
+            visible = windowSize / self.zoom
+            if visible >= fullSize:
+                setattr(self, axis, (fullSize - visible) / 2)
+            else:
+                setattr(self, axis, min(max(getattr(self, axis), 0.0), fullSize - visible))
+
+
+    # Returns a tuple of (zoom, originX, originY) describing the mapping from
+    # full coordinates to display coordinates
+    def transform(self):
+        return (self.zoom, self.originX, self.originY)
+
+
+    def toDisplay(self, fullX, fullY):
+        return ((fullX - self.originX) * self.zoom, (fullY - self.originY) * self.zoom)
+
+
+    def toFull(self, displayX, displayY):
+        return (displayX / self.zoom + self.originX, displayY / self.zoom + self.originY)
+
+
+    # Warp one tile of the rotated image at one pyramid level.
+    # Parameters:
+    #   level: the pyramid level, see Layer
+    #   angle: rotation angle in degrees
+    #   tileX, tileY: tile indices; tile (0, 0) starts at the upper left
+    #   corner of the rotated image
+    def warpTile(self, level, angle, tileX, tileY):
+        (image, scale, conversion) = level
+        (rows, cols) = image.shape[:2]
+
+        # rotate about the center of the full-resolution image; a level pixel
+        # p covers the full-resolution pixels around scale * p + (scale-1)/2
+        R = cv.getRotationMatrix2D(((self.fullWidth-1)/2.0, (self.fullHeight-1)/2.0), angle, 1)
+        offset = (scale - 1) / 2.0
+        M = R.copy()
+        M[:, 2] = (R[:, :2] @ np.array([offset, offset]) + R[:, 2] - offset) / scale
+        M[0, 2] -= tileX * self.tileSize
+        M[1, 2] -= tileY * self.tileSize
+        with tracing.span('warpTile', scale=scale):
+            tile = imagesource.warpAffine(image, M, (self.tileSize, self.tileSize))
+            if conversion is not None:
+                tile = cv.cvtColor(tile, conversion)
+        return tile
+
+
+    def getTile(self, layerName, level, angle, tileX, tileY):
+        key = (layerName, level[1], round(angle, 4), tileX, tileY)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+
+        self.misses += 1
+        tile = self.warpTile(level, angle, tileX, tileY)
+        self.tiles[key] = tile
+        self.bytes += tile.nbytes
+        while len(self.tiles) > 1 and self.bytes > self.maxBytes:
+            (_, evicted) = self.tiles.popitem(last=False)
+            self.bytes -= evicted.nbytes
+        return tile
+
+
+    # Render the zoomed view of a layer, rotated.
+    # Parameters:
+    #   layerName: the layer to render, e.g. 'image'
+    #   angle: rotation angle in degrees
+    # Returns an RGB frame of the size of the window
+    def render(self, layerName, angle):
+        layer = self.layers[layerName]
+        level = layer.levelFor(self.zoom)
+        scale = level[1]
+        offset = (scale - 1) / 2.0
+        tileSize = self.tileSize
+
+        # the visible part of the rotated image, in level pixels, and the
+        # tiles covering it
+        (fullX1, fullY1) = (self.originX, self.originY)
+        (fullX2, fullY2) = self.toFull(self.width, self.height)
+        levelWidth = int(math.ceil(self.fullWidth / scale))
+        levelHeight = int(math.ceil(self.fullHeight / scale))
+        tileX1 = max(0, int(math.floor((fullX1 - offset) / scale)) // tileSize)
+        tileY1 = max(0, int(math.floor((fullY1 - offset) / scale)) // tileSize)
+        tileX2 = min((levelWidth - 1) // tileSize, int(math.ceil((fullX2 - offset) / scale)) // tileSize)
+        tileY2 = min((levelHeight - 1) // tileSize, int(math.ceil((fullY2 - offset) / scale)) // tileSize)
+
+        # assemble the tiles into one mosaic
+        mosaic = np.zeros(((tileY2 - tileY1 + 1) * tileSize, (tileX2 - tileX1 + 1) * tileSize, 3), np.uint8)
+        for tileY in range(tileY1, tileY2 + 1):
+            for tileX in range(tileX1, tileX2 + 1):
+                y = (tileY - tileY1) * tileSize
+                x = (tileX - tileX1) * tileSize
+                mosaic[y:y + tileSize, x:x + tileSize] = self.getTile(layerName, level, angle, tileX, tileY)
+
+        # scale the mosaic into the view; mosaic pixel m is at full
+        # coordinate scale * (m + tile origin) + offset. Magnified pixels
+        # are kept sharp.
+        magnification = self.zoom * scale
+        M = np.array([
+            [magnification, 0, self.zoom * (scale * tileX1 * tileSize + offset - self.originX)],
+            [0, magnification, self.zoom * (scale * tileY1 * tileSize + offset - self.originY)]])
+        interpolation = cv.INTER_NEAREST if magnification >= 2 else cv.INTER_LINEAR
+        with tracing.span('composeView'):
+            return cv.warpAffine(mosaic, M, (self.width, self.height), flags=interpolation)
+
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hitRate = 100.0 * self.hits / lookups if lookups else 0.0
+        zoom = self.zoom if self.zoom is not None else self.fitZoom()
+        return 'viewport: zoom %0.0f%%, %d tiles, %0.1f MB, %0.1f%% tile hit rate' % \
+            (zoom * 100, len(self.tiles), self.bytes / (1024*1024), hitRate)